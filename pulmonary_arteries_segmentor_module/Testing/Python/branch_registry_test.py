@@ -0,0 +1,59 @@
+import os
+import sys
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", ".."))
+
+from ransac_slicer.branch_registry import Branch  # noqa: E402
+from ransac_slicer.ragged import RaggedPoints  # noqa: E402
+
+
+def make_branch(name: str, edge: tuple[int, int], start: float, length: int) -> Branch:
+    """
+    Branch as loaded from disk, without cylinders.
+    """
+    centerline = (start + np.arange(length))[:, None] * [1.0, 2.0, 3.0]
+    contour_points = RaggedPoints.from_lists(
+        [point + np.eye(3) for point in centerline]
+    )
+    return Branch(name, edge, centerline, contour_points, [1.0] * length)
+
+
+class BranchTest(unittest.TestCase):
+    """
+    Edits of the arrays of a branch, without Slicer.
+    """
+
+    def setUp(self) -> None:
+        # The last point of the parent is the first point of the child
+        self.parent = make_branch("b1", (0, 1), 0.0, 4)
+        self.child = make_branch("b2", (1, 2), 3.0, 3)
+
+    def assert_merged(self) -> None:
+        parent = self.parent
+        np.testing.assert_array_equal(
+            parent.centerline, np.arange(6)[:, None] * [1.0, 2.0, 3.0]
+        )
+        self.assertEqual(len(parent.contour_points), 6)
+        self.assertEqual(parent.centerline_radius, [1.0] * 6)
+        self.assertEqual(len(parent.cylinders), len(parent.centerline))
+        np.testing.assert_array_equal(
+            [cyl.center for cyl in parent.cylinders], parent.centerline
+        )
+
+    def test_merge_loaded_child(self) -> None:
+        self.parent.merge_child(self.child)
+        self.assert_merged()
+
+    def test_merge_child_with_cylinders(self) -> None:
+        # The cylinders already built are not appended twice
+        self.parent.cylinders
+        self.child.cylinders
+        self.parent.merge_child(self.child)
+        self.assert_merged()
+
+
+if __name__ == "__main__":
+    unittest.main()
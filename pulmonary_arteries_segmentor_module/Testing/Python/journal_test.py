@@ -0,0 +1,217 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from types import SimpleNamespace
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", ".."))
+
+from ransac_slicer.journal import Journal  # noqa: E402
+from ransac_slicer.ragged import RaggedPoints  # noqa: E402
+
+
+def make_branch(name: str, edge: tuple[int, int], length: int = 5) -> SimpleNamespace:
+    """
+    Arrays of a branch written by the journal, see Branch.
+    """
+    centerline = np.linspace(edge[0], edge[1], length)[:, None] * [1.0, 2.0, 3.0]
+    contour_points = RaggedPoints.from_lists(
+        [point + np.eye(3) for point in centerline]
+    )
+    return SimpleNamespace(
+        name=name,
+        edge=edge,
+        centerline=centerline,
+        contour_points=contour_points,
+        centerline_radius=[1.0] * length,
+    )
+
+
+class JournalTest(unittest.TestCase):
+    """
+    Crash recovery of the journal of the tree operations, without Slicer.
+    """
+
+    def setUp(self) -> None:
+        self.folder_path = tempfile.mkdtemp()
+        self.journal_path = os.path.join(self.folder_path, "journal")
+        self.journal = Journal(self.journal_path, compaction_interval=3)
+
+        # b1 (0 -> 1) -> b2 (1 -> 2)
+        self.b1 = make_branch("b1", (0, 1))
+        self.b2 = make_branch("b2", (1, 2))
+        self.nodes = {0: [0.0, 0.0, 0.0], 1: [1.0, 2.0, 3.0], 2: [2.0, 4.0, 6.0]}
+
+    def tearDown(self) -> None:
+        self.journal.release()
+        shutil.rmtree(self.folder_path, ignore_errors=True)
+
+    def append_tree(self) -> None:
+        self.journal.append(
+            "create",
+            [self.b1],
+            {"b1": None},
+            {0: self.nodes[0], 1: self.nodes[1]},
+        )
+        self.journal.append("create", [self.b2], {"b2": "b1"}, {2: self.nodes[2]})
+
+    def reopen(self) -> Journal:
+        # As done by the next instance after a crash
+        self.journal.release()
+        self.journal = Journal(self.journal_path, compaction_interval=3)
+        return self.journal
+
+    def assert_tree(self, state, names: list[str]) -> None:
+        self.assertEqual([name for name, _ in state.tree_order()], names)
+        for branch in [self.b1, self.b2]:
+            if branch.name not in names:
+                continue
+            centerline, contour_points, radius = state.branch_arrays(branch.name)
+            np.testing.assert_array_equal(centerline, branch.centerline)
+            np.testing.assert_array_equal(
+                contour_points.flat, branch.contour_points.flat
+            )
+            np.testing.assert_array_equal(
+                contour_points.offsets, branch.contour_points.offsets
+            )
+            self.assertEqual(radius, branch.centerline_radius)
+
+    def test_replay(self) -> None:
+        self.assertTrue(self.journal.is_empty())
+        self.append_tree()
+        self.journal.append("rename", renamed=("b2", "b3"))
+        self.b2.name = "b3"
+
+        state = self.reopen().replay()
+        self.assert_tree(state, ["b1", "b3"])
+        self.assertEqual(state.parents["b3"], "b1")
+        self.assertEqual(sorted(state.nodes), [0, 1, 2])
+        self.assertEqual(self.journal.seq, 3)
+
+    def test_delete(self) -> None:
+        self.append_tree()
+        self.journal.append("delete", removed_branches=["b2"], removed_nodes=[2])
+
+        state = self.reopen().replay()
+        self.assert_tree(state, ["b1"])
+        self.assertEqual(sorted(state.nodes), [0, 1])
+
+    def test_truncated_record_dropped(self) -> None:
+        self.append_tree()
+        self.journal.close()
+        size = os.path.getsize(self.journal.journal_path)
+        with open(self.journal.journal_path, "r+b") as f:
+            f.truncate(size - 10)
+
+        state = self.reopen().replay()
+        self.assert_tree(state, ["b1"])
+        self.assertEqual(self.journal.seq, 1)
+
+        # The torn record is removed, the next records are appended after the valid ones
+        self.journal.append("create", [self.b2], {"b2": "b1"}, {2: self.nodes[2]})
+        state = self.reopen().replay()
+        self.assert_tree(state, ["b1", "b2"])
+        self.assertEqual(self.journal.seq, 2)
+
+    def test_corrupted_record_dropped(self) -> None:
+        self.append_tree()
+        self.journal.close()
+        with open(self.journal.journal_path, "r+b") as f:
+            f.seek(-1, os.SEEK_END)
+            last = f.read(1)
+            f.seek(-1, os.SEEK_END)
+            f.write(bytes([last[0] ^ 0xFF]))
+
+        state = self.reopen().replay()
+        self.assert_tree(state, ["b1"])
+
+    def test_compaction(self) -> None:
+        self.append_tree()
+        should_compact = self.journal.append(
+            "create", [self.b2], {"b2": "b1"}, {2: self.nodes[2]}
+        )
+        self.assertTrue(should_compact)
+
+        self.journal.compact(self.nodes, [self.b1, self.b2], [None, "b1"])
+        self.assertEqual(os.path.getsize(self.journal.journal_path), 0)
+        self.assertFalse(self.journal.is_empty())
+
+        state = self.reopen().replay()
+        self.assert_tree(state, ["b1", "b2"])
+        self.assertEqual(self.journal.seq, 3)
+        self.assertEqual(self.journal.records_since_snapshot, 0)
+
+    def test_replay_skips_records_in_snapshot(self) -> None:
+        self.append_tree()
+        self.journal.close()
+        with open(self.journal.journal_path, "rb") as f:
+            records = f.read()
+
+        # Crash after the snapshot is written but before the journal is emptied
+        self.journal.compact(self.nodes, [self.b1, self.b2], [None, "b1"])
+        with open(self.journal.journal_path, "wb") as f:
+            f.write(records)
+
+        state = self.reopen().replay()
+        self.assert_tree(state, ["b1", "b2"])
+        self.assertEqual(self.journal.seq, 2)
+        self.assertEqual(self.journal.records_since_snapshot, 0)
+
+        # The records after the snapshot are applied
+        self.journal.append("delete", removed_branches=["b2"], removed_nodes=[2])
+        state = self.reopen().replay()
+        self.assert_tree(state, ["b1"])
+        self.assertEqual(self.journal.records_since_snapshot, 1)
+
+    def test_snapshot_swap_recovered(self) -> None:
+        self.journal.append(
+            "create", [self.b1], {"b1": None}, {0: self.nodes[0], 1: self.nodes[1]}
+        )
+        self.journal.compact(self.nodes, [self.b1], [None])
+        self.journal.append("create", [self.b2], {"b2": "b1"}, {2: self.nodes[2]})
+
+        # Crash while the snapshot is replaced: the former one is moved aside, the new one is not in place yet
+        snapshot_path = self.journal.snapshot_path
+        shutil.copytree(snapshot_path, snapshot_path + ".new")
+        os.rename(snapshot_path, snapshot_path + ".old")
+
+        state = self.reopen().replay()
+        self.assertTrue(os.path.isdir(snapshot_path))
+        self.assertFalse(os.path.isdir(snapshot_path + ".old"))
+        self.assert_tree(state, ["b1", "b2"])
+        self.assertEqual(self.journal.seq, 2)
+
+        # The leftover new snapshot is replaced by the next compaction
+        self.journal.compact(self.nodes, [self.b1, self.b2], [None, "b1"])
+        self.assertFalse(os.path.isdir(snapshot_path + ".new"))
+        self.assert_tree(self.reopen().replay(), ["b1", "b2"])
+
+    def test_clear(self) -> None:
+        self.append_tree()
+        self.journal.compact(self.nodes, [self.b1, self.b2], [None, "b1"])
+        self.journal.clear()
+
+        self.assertTrue(self.reopen().is_empty())
+        self.assertEqual(len(self.journal.replay()), 0)
+
+    def test_lock(self) -> None:
+        with self.assertRaises(RuntimeError):
+            Journal(self.journal_path)
+
+        # Another instance uses the next free journal
+        other = Journal.for_instance(self.journal_path)
+        self.assertEqual(other.folder_path, self.journal_path + "_1")
+        other.release()
+
+        # The journal is free once released, e.g. after a crash
+        self.journal.release()
+        other = Journal.for_instance(self.journal_path)
+        self.assertEqual(other.folder_path, self.journal_path)
+        other.release()
+
+
+if __name__ == "__main__":
+    unittest.main()
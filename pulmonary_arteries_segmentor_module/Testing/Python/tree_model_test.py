@@ -0,0 +1,160 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", ".."))
+
+from ransac_slicer.tree_model import TreeModel  # noqa: E402
+
+
+class TreeModelTest(unittest.TestCase):
+    """
+    Edits of the branch tree topology, without Slicer.
+    """
+
+    def setUp(self) -> None:
+        # b1 -> (b2 -> (b4, b5), b3)
+        self.model = TreeModel()
+        self.model.insert_after_node("b1", None)
+        self.model.insert_after_node("b2", "b1")
+        self.model.insert_after_node("b3", "b1")
+        self.model.insert_after_node("b4", "b2")
+        self.model.insert_after_node("b5", "b2")
+
+    def fill_cache(self) -> None:
+        self.model.bfs()
+        self.model.dfs()
+        for node_id in self.model:
+            self.model.depth(node_id)
+            self.model.subtree_size(node_id)
+
+    def assert_consistent(self) -> None:
+        """
+        Check that the cached queries match the ones computed from scratch on the current tree.
+        """
+        model = self.model
+        self.assertEqual(model.bfs(), model._bfs(model.root))
+        self.assertEqual(model.dfs(), model.subtree(model.root))
+        self.assertEqual(sorted(model.dfs()), sorted(model))
+        for node_id in model:
+            depth = 0
+            parent_id = model.parent(node_id)
+            while parent_id is not None:
+                depth += 1
+                parent_id = model.parent(parent_id)
+            self.assertEqual(model.depth(node_id), depth)
+            self.assertEqual(model.subtree_size(node_id), len(model.subtree(node_id)))
+            for child in model.children(node_id):
+                self.assertEqual(model.parent(child), node_id)
+
+    def test_queries(self) -> None:
+        self.assertEqual(self.model.bfs(), ["b1", "b2", "b3", "b4", "b5"])
+        self.assertEqual(self.model.dfs(), ["b1", "b2", "b4", "b5", "b3"])
+        self.assertEqual(self.model.bfs("b2"), ["b2", "b4", "b5"])
+        self.assertEqual(self.model.depth("b5"), 2)
+        self.assertEqual(self.model.subtree_size("b2"), 3)
+        self.assertTrue(self.model.is_root("b1"))
+        self.assertTrue(self.model.is_leaf("b3"))
+        self.assert_consistent()
+
+    def test_insert_invalidates_cache(self) -> None:
+        self.fill_cache()
+        self.model.insert_after_node("b6", "b4")
+
+        self.assertEqual(self.model.dfs(), ["b1", "b2", "b4", "b6", "b5", "b3"])
+        self.assertEqual(self.model.depth("b6"), 3)
+        self.assertEqual(self.model.subtree_size("b1"), 6)
+        self.assert_consistent()
+
+    def test_insert_unknown_parent(self) -> None:
+        with self.assertRaises(ValueError):
+            self.model.insert_after_node("b6", "unknown")
+
+    def test_insert_root(self) -> None:
+        self.fill_cache()
+        self.model.insert_after_node("b0", None)
+
+        self.assertEqual(self.model.root, "b0")
+        self.assertEqual(self.model.children("b0"), ["b1"])
+        self.assertEqual(self.model.depth("b4"), 3)
+        self.assert_consistent()
+
+    def test_become_intermediary_parent(self) -> None:
+        self.fill_cache()
+        self.model.insert_after_node("b6", "b2", become_intermediary_parent=True)
+
+        self.assertEqual(self.model.children("b2"), ["b6"])
+        self.assertEqual(self.model.children("b6"), ["b4", "b5"])
+        self.assertEqual(self.model.parent("b4"), "b6")
+        self.assertEqual(self.model.depth("b5"), 3)
+        self.assertEqual(self.model.subtree_size("b2"), 4)
+        self.assert_consistent()
+
+    def test_become_intermediary_parent_of_single_child(self) -> None:
+        # The children are only moved when the parent is a bifurcation
+        self.model.insert_after_node("b6", "b4")
+        self.fill_cache()
+        self.model.insert_after_node("b7", "b4", become_intermediary_parent=True)
+
+        self.assertEqual(self.model.children("b4"), ["b6", "b7"])
+        self.assertTrue(self.model.is_leaf("b7"))
+        self.assert_consistent()
+
+    def test_remove_node_moves_children_up(self) -> None:
+        self.fill_cache()
+        removed = []
+        self.model.nodeRemoved.connect(removed.append)
+
+        self.assertTrue(self.model.remove_node("b2"))
+        self.assertEqual(removed, ["b2"])
+        self.assertNotIn("b2", self.model)
+        self.assertEqual(self.model.children("b1"), ["b3", "b4", "b5"])
+        self.assertEqual(self.model.parent("b4"), "b1")
+        self.assertEqual(self.model.depth("b5"), 1)
+        self.assertEqual(self.model.subtree_size("b1"), 4)
+        self.assert_consistent()
+
+    def test_remove_root(self) -> None:
+        self.fill_cache()
+
+        self.assertFalse(self.model.remove_node("b1"))
+        self.assertEqual(len(self.model), 5)
+        self.assert_consistent()
+
+    def test_rename(self) -> None:
+        self.fill_cache()
+        renamed = []
+        self.model.nodeRenamed.connect(
+            lambda previous, new: renamed.append((previous, new))
+        )
+
+        self.model.rename("b2", "x")
+        self.assertEqual(renamed, [("b2", "x")])
+        self.assertNotIn("b2", self.model)
+        self.assertEqual(self.model.children("b1"), ["x", "b3"])
+        self.assertEqual(self.model.parent("b4"), "x")
+        self.assertEqual(self.model.dfs(), ["b1", "x", "b4", "b5", "b3"])
+        self.assertEqual(self.model.depth("x"), 1)
+        self.assertEqual(self.model.subtree_size("x"), 3)
+        self.assert_consistent()
+
+        self.model.rename("b1", "root")
+        self.assertEqual(self.model.root, "root")
+        self.assertEqual(self.model.bfs()[0], "root")
+        self.assert_consistent()
+
+    def test_rename_to_existing(self) -> None:
+        with self.assertRaises(ValueError):
+            self.model.rename("b2", "b3")
+
+    def test_clear(self) -> None:
+        self.fill_cache()
+        self.model.clear()
+
+        self.assertEqual(len(self.model), 0)
+        self.assertEqual(self.model.bfs(), [])
+        self.assertEqual(self.model.dfs(), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
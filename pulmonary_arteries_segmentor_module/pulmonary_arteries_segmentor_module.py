@@ -1,4 +1,5 @@
 import importlib
+import os
 import sys
 from typing import Annotated, Optional
 
@@ -31,9 +32,13 @@ try:
 except Exception as e:
     print(f"Exception occurred while reloading\n{e}")
 
-from ransac_slicer.cylinder import cylinder
 from ransac_slicer.ransac import run_ransac
 from ransac_slicer.graph_branches import GraphBranches
+from ransac_slicer.ragged import RaggedPoints
+from ransac_slicer.tree_file import TreeFile, is_tree_header
+from ransac_slicer.journal import Journal
+from ransac_slicer.scene_utils import batch_scene_update
+from ransac_slicer.rasterization import split_centerlines, stack_centerlines
 from ransac_slicer.branch_tree import BranchTree, TreeColumnRole, Icons
 from ransac_slicer.color_palettes import direction_points_color
 from ransac_slicer.popup_utils import (
@@ -41,7 +46,13 @@ from ransac_slicer.popup_utils import (
     CustomStatusDialog,
 )
 from ransac_slicer.volume import volume
-from ransac_slicer.region_growing_seeds import paint_segments
+from ransac_slicer.vesselness import (
+    cached_vesselness,
+    roi_contains,
+    tracking_roi,
+    vesselness_cache_path,
+)
+from ransac_slicer.region_growing_seeds import SegmentPainter
 
 from networkx.readwrite import json_graph
 import networkx as nx
@@ -91,6 +102,7 @@ class pulmonary_arteries_segmentor_moduleParameterNode:
     percentInlierPoints: percentage of inlier points to validate a cylinder.
     percentThreshold: percentage of last cylinders radius to make a point inlier of a cylinder.
     startingRadius: initiale radius of the first cylinder to fit
+    useVesselnessPrior: guide the tracking with a cached vesselness map of the input volume.
     """
 
     # Begin tab
@@ -100,6 +112,7 @@ class pulmonary_arteries_segmentor_moduleParameterNode:
     percentInlierPoints: Annotated[float, WithinRange(0, 100)] = 60.0
     percentThreshold: Annotated[float, WithinRange(0, 100)] = 30.0
     startingRadius: Annotated[float, WithinRange(0, 100)] = 0.0
+    useVesselnessPrior: bool = False
 
 
 #
@@ -126,6 +139,7 @@ class pulmonary_arteries_segmentor_moduleWidget(
         self._parameterNodeGuiTag = None
         self.graph_branches = None
         self.segmentationNode = None
+        self.segmentPainter = SegmentPainter()
         self.nodeDeletionObserverTag = None
         self.isPlacingPoints = False
 
@@ -176,11 +190,19 @@ class pulmonary_arteries_segmentor_moduleWidget(
         # Insert the branch tree widget defined in code
         begin_tab.layout().insertWidget(6, self.branch_tree)
 
+        # The structural operations on the tree are journaled, to restore the tree after a crash,
+        # each running instance of Slicer using its own journal
+        journal = Journal.for_instance(
+            os.path.join(
+                slicer.app.temporaryPath, "PulmonaryArteriesSegmentor", "journal"
+            )
+        )
         self.graph_branches = GraphBranches(
             self.branch_tree,
             self.ui.showCenterlineButton,
             self.ui.showContourPointsButton,
             self.ui.lockButton,
+            journal=journal,
         )
         # Connections / Callbacks
 
@@ -235,11 +257,16 @@ class pulmonary_arteries_segmentor_moduleWidget(
         self.initializeParameterNode()
         self.checkCanPlacePoint()
 
+        if not journal.is_empty():
+            self.restoreJournal()
+
     def cleanup(self) -> None:
         """
         Called when the application closes and the module widget is destroyed.
         """
         self.removeObservers()
+        if self.graph_branches.journal is not None:
+            self.graph_branches.journal.release()
 
     def enter(self) -> None:
         """
@@ -268,6 +295,8 @@ class pulmonary_arteries_segmentor_moduleWidget(
         """
         # Parameter node will be reset, do not use it anymore
         self.setParameterNode(None)
+        # Painted segmentation will be removed
+        self.segmentPainter.reset()
 
     def onSceneEndClose(self, caller, event) -> None:
         """
@@ -625,6 +654,7 @@ class pulmonary_arteries_segmentor_moduleWidget(
                 self.graph_branches,
                 self.ui.createBranch.text == "Create New Branch",
                 progress_dialog,
+                self._parameterNode.useVesselnessPrior,
             )
 
             self.recenter3dView()
@@ -691,24 +721,11 @@ class pulmonary_arteries_segmentor_moduleWidget(
             slicer.mrmlScene.RemoveObserver(self.nodeDeletionObserverTag)
             self.nodeDeletionObserverTag = None
 
-            # Compute branch drawing order, we draw in reverse bfs order, so that parent branches are always drawn on top of childs
-            G = nx.DiGraph()
-            for i, node in enumerate(self.graph_branches.nodes):
-                G.add_node(i, pos=node)
+            # Branch drawing order, we draw in reverse bfs order, so that parent branches are always drawn on top of childs
+            branch_draw_order = self.graph_branches.draw_order()
 
-            for i, edge in enumerate(self.graph_branches.edges):
-                G.add_edge(
-                    edge[0],
-                    edge[1],
-                    edge_idx=i,
-                )
-            branch_draw_order = [
-                G[a][b]["edge_idx"] for a, b in nx.bfs_edges(G, source=0)
-            ][::-1]
-            del G
-
-            # Create the segments and paint them
-            paint_segments(
+            # Create the segments and paint them, only the branches changed since the last painting are repainted
+            self.segmentPainter.paint(
                 self._parameterNode.inputVolume,
                 self.graph_branches.centerlines,
                 self.graph_branches.names,
@@ -719,17 +736,20 @@ class pulmonary_arteries_segmentor_moduleWidget(
                 self.ui.reductionThreshold.value,
                 self.ui.contourSpinbox.value,
                 self.ui.mergeAllVesselsCheckBox.checked,
+                "edt" if self.ui.distanceTransformCheckBox.checked else "capsule",
+                self.graph_branches.dirty_branches,
+                self.graph_branches.renamed_branches,
             )
+            self.graph_branches.clear_dirty()
 
             # Set the current segmentation into the UI
             self.ui.SegmentEditorWidget.setSegmentationNode(self.segmentationNode)
 
             # Hide markup nodes
-            for branch in (
-                self.graph_branches.centerline_markups
-                + self.graph_branches.contour_points_markups
-            ):
+            for branch in self.graph_branches.centerline_markups:
                 branch.GetDisplayNode().SetVisibility(False)
+            for branch in self.graph_branches.registry:
+                self.graph_branches.show_contour_points(branch, False)
 
             for branch in self.graph_branches.tree_widget._branchDict.values():
                 branch.setIcon(TreeColumnRole.VISIBILITY_CENTER, Icons.visibleOff)
@@ -756,18 +776,20 @@ class pulmonary_arteries_segmentor_moduleWidget(
             + self.graph_branches.contour_points_markups
         )
 
-        if button.checked:
-            button.text = "Unlock Tree"
-            for markup in markups:
-                markup.LockedOn()
-        else:
-            button.text = "Lock Tree"
-            for markup in markups:
-                markup.LockedOff()
+        with batch_scene_update():
+            if button.checked:
+                button.text = "Unlock Tree"
+                for markup in markups:
+                    markup.LockedOn()
+            else:
+                button.text = "Lock Tree"
+                for markup in markups:
+                    markup.LockedOff()
 
     def onLoadTreeArchitecture(self) -> None:
         """
-        Loads a vessel tree architecture from a .JSON file.
+        Loads a vessel tree architecture from a networkX .JSON file, or from the header.json file of a
+        tree saved in the binary tree format.
 
         Ask first if the user wants to delete the current tree.
         If not, does nothing.
@@ -784,9 +806,19 @@ class pulmonary_arteries_segmentor_moduleWidget(
         with slicer.util.tryWithErrorDisplay(
             "Failed to load tree architecture.", waitCursor=False
         ):
-            with open(file_path) as f:
-                js_graph = json.load(f)
-            graph: nx.DiGraph = json_graph.node_link_graph(js_graph)
+            if is_tree_header(file_path):
+                # Only the topology is read, the points of the branches are memory mapped
+                tree_file = TreeFile(file_path)
+                graph = nx.DiGraph()
+                for node_id, position in tree_file.nodes.items():
+                    graph.add_node(node_id, pos=position)
+                for idx, (a, b) in enumerate(tree_file.edges):
+                    graph.add_edge(a, b, name=tree_file.names[idx], idx=idx)
+            else:
+                tree_file = None
+                with open(file_path) as f:
+                    js_graph = json.load(f)
+                graph: nx.DiGraph = json_graph.node_link_graph(js_graph)
 
             # We ask to clear the tree before loading the new one, if not we do nothing
             if not self.graph_branches.clear_all():
@@ -797,56 +829,133 @@ class pulmonary_arteries_segmentor_moduleWidget(
         with slicer.util.tryWithErrorDisplay(
             "Failed to restore tree architecture.", waitCursor=True
         ):
+            edges = list(graph.edges)
+            names = [graph[a][b]["name"] for a, b in edges]
             edge_name_table = {0: None}
-
-            for a, b in CustomProgressBar(
-                iterable=graph.edges,
-                quantity_to_measure="branch loaded",
-                windowTitle="Restoring tree architecture...",
-                width=300,
-            ):
-                # Restoring lists
-                self.graph_branches.branch_list.append(
-                    [cylinder(center=np.array(cp)) for cp in graph[a][b]["centerline"]]
-                )
-                self.graph_branches.names.append(graph[a][b]["name"])
-                self.graph_branches.centerlines.append(
-                    np.array(graph[a][b]["centerline"])
-                )
-                self.graph_branches.contours_points.append(
-                    graph[a][b]["contour_points"]
-                )
-                # Recompute radius
-                self.graph_branches.centerline_radius.append(
-                    [
-                        np.linalg.norm(
-                            np.array(graph[a][b]["contour_points"][k])
-                            - np.array(graph[a][b]["centerline"][k]),
-                            axis=1,
-                        ).min()
-                        for k in range(len(graph[a][b]["centerline"]))
-                    ]
+            edge_name_table.update({b: name for (a, b), name in zip(edges, names)})
+
+            if tree_file is not None:
+                # Restoring the branches with their stored radius, their contour points stay memory mapped
+                indexes = [graph[a][b]["idx"] for a, b in edges]
+                centerlines = [np.array(tree_file.centerline(idx)) for idx in indexes]
+                contours_points = [tree_file.contour_points(idx) for idx in indexes]
+                centerline_radius = [
+                    tree_file.centerline_radius(idx).tolist() for idx in indexes
+                ]
+            else:
+                # Restoring the branches, their radius is recomputed for all the branches at once
+                centerlines = [np.array(graph[a][b]["centerline"]) for a, b in edges]
+                contours_points = [
+                    RaggedPoints.from_lists(graph[a][b]["contour_points"])
+                    for a, b in edges
+                ]
+                stacked_centerlines, offsets = stack_centerlines(centerlines, width=3)
+                distances = RaggedPoints.concatenate(contours_points).min_distances(
+                    stacked_centerlines
                 )
-                self.graph_branches.edges.append((a, b))
-                self.graph_branches.create_new_markups(
-                    graph[a][b]["name"],
-                    np.array(graph[a][b]["centerline"]),
-                    graph[a][b]["contour_points"],
+                centerline_radius = [
+                    radius.tolist() for radius in split_centerlines(distances, offsets)
+                ]
+
+            if tree_file is not None:
+                # The branches are saved in depth first order, each one after its parent
+                tree_order = zip(tree_file.names, tree_file.parents)
+            else:
+                tree_order = (
+                    (graph[a][b]["name"], edge_name_table[a])
+                    for a, b in nx.edge_dfs(graph)
                 )
-                edge_name_table[b] = graph[a][b]["name"]
+            self.restoreTree(
+                names,
+                edges,
+                centerlines,
+                contours_points,
+                centerline_radius,
+                {node[0]: node[1]["pos"] for node in graph.nodes(data=True)},
+                tree_order,
+            )
 
-            for node in graph.nodes(data=True):
-                self.graph_branches.nodes.append(node[1]["pos"])
+    def restoreTree(
+        self,
+        names: list[str],
+        edges: list[tuple[int, int]],
+        centerlines: list[np.ndarray],
+        contours_points: list[RaggedPoints],
+        centerline_radius: list[list[float]],
+        nodes: dict,
+        tree_order,
+    ) -> None:
+        """
+        Add the branches of a loaded tree at once, then save the tree as the snapshot of the journal.
 
-            for a, b in nx.edge_dfs(graph):
-                current_edge_name = graph[a][b]["name"]
-                parent_edge_name = edge_name_table[a]
-                self.graph_branches.tree_widget.insertAfterNode(
-                    nodeId=current_edge_name, parentNodeId=parent_edge_name
-                )
-            self._checkCanStartRansac()
-            self.updateSegmentationButtonState()
-            self.recenter3dView()
+        Parameters
+        ----------
+
+        names, edges, centerlines, contours_points, centerline_radius: data of each branch, see add_branches.
+        nodes: position of each node of the graph, by node id.
+        tree_order: name and parent name of each branch, each branch coming after its parent.
+        """
+        with batch_scene_update(self.graph_branches.tree_widget):
+            self.graph_branches.add_branches(
+                names,
+                edges,
+                centerlines,
+                contours_points,
+                centerline_radius,
+                progress=lambda iterable: CustomProgressBar(
+                    iterable=iterable,
+                    quantity_to_measure="branch loaded",
+                    windowTitle="Restoring tree architecture...",
+                    width=300,
+                ),
+            )
+
+            for node_id, position in nodes.items():
+                self.graph_branches.add_node(position, node_id)
+
+            for name, parent_name in tree_order:
+                self.graph_branches.tree_model.insert_after_node(name, parent_name)
+
+        # The loaded tree is the starting point of the next operations journaled
+        self.graph_branches.compact_journal()
+
+        self._checkCanStartRansac()
+        self.updateSegmentationButtonState()
+        self.recenter3dView()
+
+    def restoreJournal(self) -> None:
+        """
+        Ask if the user wants to restore the tree of the last session, which was not cleared, e.g. after a crash.
+        If not, the journal is cleared.
+        """
+        journal = self.graph_branches.journal
+
+        msg = qt.QMessageBox()
+        msg.setIcon(qt.QMessageBox.Question)
+        msg.setWindowTitle("Restore tree")
+        msg.setText(
+            "A vessel tree from the last session was found. Do you want to restore it ?"
+        )
+        msg.setStandardButtons(qt.QMessageBox.Yes | qt.QMessageBox.No)
+        if msg.exec_() != qt.QMessageBox.Yes:
+            journal.clear()
+            return
+
+        with slicer.util.tryWithErrorDisplay(
+            "Failed to restore the tree of the last session.", waitCursor=True
+        ):
+            state = journal.replay()
+            names = list(state.branches)
+            arrays = [state.branch_arrays(name) for name in names]
+            self.restoreTree(
+                names,
+                [state.branches[name]["edge"] for name in names],
+                [centerline for centerline, _, _ in arrays],
+                [contour_points for _, contour_points, _ in arrays],
+                [radius for _, _, radius in arrays],
+                state.nodes,
+                state.tree_order(),
+            )
 
 
 #
@@ -869,6 +978,7 @@ class pulmonary_arteries_segmentor_moduleLogic(ScriptedLoadableModuleLogic):
         Called when the logic class is instantiated. Can be used for initializing member variables.
         """
         ScriptedLoadableModuleLogic.__init__(self)
+        self.vesselness_map = None
 
     def getParameterNode(self):
         """
@@ -885,6 +995,7 @@ class pulmonary_arteries_segmentor_moduleLogic(ScriptedLoadableModuleLogic):
         graph_branches: GraphBranches,
         isNewBranch: bool,
         progress_dialog: CustomStatusDialog,
+        use_vesselness_prior: bool = False,
     ) -> GraphBranches:
         """
         Prepare the volume and run the RANSAC algorithm using the user parameters.
@@ -897,6 +1008,7 @@ class pulmonary_arteries_segmentor_moduleLogic(ScriptedLoadableModuleLogic):
         graph_branches: object holding the graph of vessels branches.
         isNewBranch: flag to tell if it is the first branch or not.
         progress_dialog: UI window to inform the user on the state of the branch tracking.
+        use_vesselness_prior: flag to guide the tracking with the vesselness map of the volume.
 
         Returns
         ----------
@@ -924,6 +1036,14 @@ class pulmonary_arteries_segmentor_moduleLogic(ScriptedLoadableModuleLogic):
             parameters[2].GetNumberOfControlPoints() - 1, direction_point
         )
 
+        vesselness = (
+            self.getVesselnessMap(
+                vol, np.array([starting_point, direction_point]), progress_dialog
+            )
+            if use_vesselness_prior
+            else None
+        )
+
         graph_branches = run_ransac(
             vol,
             starting_point,
@@ -935,10 +1055,53 @@ class pulmonary_arteries_segmentor_moduleLogic(ScriptedLoadableModuleLogic):
             graph_branches,
             isNewBranch,
             progress_dialog,
+            vesselness,
         )
 
         return graph_branches
 
+    def getVesselnessMap(
+        self, vol: volume, points: np.ndarray, progress_dialog: CustomStatusDialog
+    ):
+        """
+        Return the vesselness map of a volume around the points where the tracking starts, computed once and
+        cached in memory and on disk. The map in memory is reused as long as it covers the points.
+
+        Parameters
+        ----------
+
+        vol: the volume on which the vesselness is computed.
+        points: RAS points where the tracking starts, e.g. the seed and direction points.
+        progress_dialog: UI window to inform the user that the map is being computed.
+
+        Returns
+        ----------
+
+        vesselness_map
+        The vesselness map of a ROI around the points, see tracking_roi.
+        """
+        cache_dir = os.path.join(
+            slicer.app.temporaryPath, "PulmonaryArteriesSegmentor", "vesselness"
+        )
+        volume_path = vesselness_cache_path(vol.data, vol.ijk_to_ras, cache_dir)
+        roi = tracking_roi(points, vol.ijk_to_ras, vol.data.shape)
+
+        # Only keep the map of the last volume in memory
+        if (
+            self.vesselness_map is None
+            or self.vesselness_map[0] != volume_path
+            or not roi_contains(self.vesselness_map[1], roi)
+        ):
+            progress_dialog.setText("Computing vesselness map...")
+            self.vesselness_map = (
+                volume_path,
+                roi,
+                cached_vesselness(vol.data, vol.ijk_to_ras, cache_dir, roi=roi),
+            )
+            progress_dialog.setText("Please wait")
+
+        return self.vesselness_map[2]
+
 
 #
 # pulmonary_arteries_segmentor_moduleTest
@@ -4,16 +4,22 @@ import subprocess
 import sys
 from importlib.util import find_spec
 
-from .popup_utils import make_custom_progress_bar
-import slicer
 import math
 
+try:
+    import slicer
+except ImportError:
+    # Outside of Slicer, e.g. in the unit tests, the dependencies are installed beforehand
+    slicer = None
+
 
 def install_missing_module(modules: list[str | tuple[str, str]]) -> None:
     """
     Check that the module is installed, if not install it
     :param modules: list of str or tuple[str, str], modules to install
     """
+    from .popup_utils import make_custom_progress_bar
+
     progress_bar = make_custom_progress_bar(
         labelText="Installing dependency...",
         windowTitle="Installing dependencies...",
@@ -43,7 +49,7 @@ missing_modules = [
     if find_spec(module[0] if isinstance(module, tuple) else module) is None
 ]
 
-if missing_modules:
+if missing_modules and slicer is not None:
     with slicer.util.tryWithErrorDisplay(
         "Failed to install dependencies.", waitCursor=True
     ):
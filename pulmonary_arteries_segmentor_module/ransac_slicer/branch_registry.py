@@ -0,0 +1,197 @@
+from typing import Iterator, Union
+import numpy as np
+from .ragged import RaggedPoints
+from .cylinder import cylinder
+
+
+class Branch:
+    """
+    Record holding all the data of a branch of the vessel tree.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        edge: tuple[int, int],
+        centerline: np.ndarray,
+        contour_points: RaggedPoints,
+        centerline_radius: list[float],
+        cylinders: Union[list, None] = None,
+        centerline_markup=None,
+        contour_points_markup=None,
+    ) -> None:
+        """
+        Parameters
+        ----------
+
+        name: name of the branch, unique in the tree.
+        edge: nodes of the graph joined by the branch.
+        centerline: array containing the points of the centerline.
+        contour_points: contour points, contour_points[0] are the points sampled around centerline[0],
+        contour_points[1] are the points sampled around centerline[1] etc...
+        centerline_radius: array containing the underestimated radius of each point of the centerline.
+        cylinders: cylinder of each point of the centerline, built from the centerline when first used if None.
+        centerline_markup: markup of the centerline.
+        contour_points_markup: markup of the contour points.
+        """
+        self.branch_id = None
+        self.name = name
+        self.edge = edge
+        self.centerline = centerline
+        self.contour_points = contour_points
+        self.centerline_radius = centerline_radius
+        self._cylinders = cylinders
+        self.centerline_markup = centerline_markup
+        self.contour_points_markup = contour_points_markup
+
+    @property
+    def cylinders(self) -> list:
+        """
+        Cylinder of each point of the centerline, only needed to find the closest branch when tracking.
+        """
+        if self._cylinders is None:
+            self._cylinders = [
+                cylinder(center=np.array(point)) for point in self.centerline
+            ]
+        return self._cylinders
+
+    @cylinders.setter
+    def cylinders(self, cylinders: list) -> None:
+        self._cylinders = cylinders
+
+    def merge_child(self, child: "Branch") -> None:
+        """
+        Append the points of a child branch, starting at the last point of this branch, e.g. when merging an only child.
+
+        The first point of the child is the last point of this branch, it is not repeated. The cylinders are built
+        again from the merged centerline when needed.
+
+        Parameters
+        ----------
+
+        child: branch appended.
+        """
+        self.centerline = np.vstack((self.centerline, child.centerline[1:]))
+        self.contour_points = RaggedPoints.concatenate(
+            [self.contour_points, child.contour_points[1:]]
+        )
+        self.centerline_radius = list(self.centerline_radius) + list(
+            child.centerline_radius[1:]
+        )
+        self._cylinders = None
+
+
+class BranchRegistry:
+    """
+    Registry of the branches of the vessel tree.
+
+    Each branch gets a stable integer id when added, which is never reused. Branches are found by id or
+    by name in constant time, and added or removed in constant time. Iterating over the registry gives
+    the branches in the order they were added.
+    """
+
+    def __init__(self) -> None:
+        self._branches: dict[int, Branch] = {}
+        self._ids: dict[str, int] = {}
+        self._next_id = 0
+
+    def __len__(self) -> int:
+        return len(self._branches)
+
+    def __iter__(self) -> Iterator[Branch]:
+        return iter(self._branches.values())
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._ids
+
+    def __getitem__(self, branch_id: int) -> Branch:
+        return self._branches[branch_id]
+
+    def add(self, branch: Branch) -> int:
+        """
+        Add a branch to the registry.
+
+        Parameters
+        ----------
+
+        branch: branch to add, its name must not be used by another branch.
+
+        Returns
+        ----------
+
+        The id given to the branch.
+        """
+        if branch.name in self._ids:
+            raise ValueError(f"A branch named {branch.name} already exists")
+
+        branch.branch_id = self._next_id
+        self._next_id += 1
+        self._branches[branch.branch_id] = branch
+        self._ids[branch.name] = branch.branch_id
+
+        return branch.branch_id
+
+    def remove(self, branch_id: int) -> Branch:
+        """
+        Remove a branch from the registry.
+
+        Parameters
+        ----------
+
+        branch_id: id of the branch to remove.
+
+        Returns
+        ----------
+
+        The removed branch.
+        """
+        branch = self._branches.pop(branch_id)
+        del self._ids[branch.name]
+
+        return branch
+
+    def rename(self, branch_id: int, name: str) -> None:
+        """
+        Rename a branch.
+
+        Parameters
+        ----------
+
+        branch_id: id of the branch to rename.
+        name: new name of the branch, must not be used by another branch.
+        """
+        branch = self._branches[branch_id]
+        if name == branch.name:
+            return
+        if name in self._ids:
+            raise ValueError(f"A branch named {name} already exists")
+
+        del self._ids[branch.name]
+        branch.name = name
+        self._ids[name] = branch_id
+
+    def id_of(self, name: str) -> int:
+        """
+        Find the id of a branch from its name.
+        """
+        return self._ids[name]
+
+    def get(self, name: Union[str, None]) -> Union[Branch, None]:
+        """
+        Find a branch from its name, None if there is no such branch.
+        """
+        branch_id = self._ids.get(name)
+        return None if branch_id is None else self._branches[branch_id]
+
+    def ids(self) -> list[int]:
+        """
+        Ids of the branches, in the order they were added.
+        """
+        return list(self._branches)
+
+    def clear(self) -> None:
+        """
+        Remove every branch. The ids are not reused.
+        """
+        self._branches = {}
+        self._ids = {}
@@ -1,7 +1,9 @@
 from typing import Union
 import qt
 
-from .segmentation_utils import Signal, Icons
+from .segmentation_utils import Icons
+from .signal_utils import Signal
+from .tree_model import TreeModel
 
 
 class TreeColumnRole:
@@ -41,11 +43,19 @@ class BranchTree(qt.QTreeWidget):
 
     Class enables inserting new vessel node branches after or before existing nodes.
     Class signals when modified or user interacts with the UI.
+
+    The topology is held by a TreeModel, the widget is a view updated through the signals of the model.
     """
 
-    def __init__(self, parent=None):
+    def __init__(self, parent=None, treeModel: Union[TreeModel, None] = None):
         qt.QTreeWidget.__init__(self, parent)
 
+        self.treeModel = TreeModel() if treeModel is None else treeModel
+        self.treeModel.nodeInserted.connect(self._onNodeInserted)
+        self.treeModel.nodeRemoved.connect(self._onNodeRemoved)
+        self.treeModel.nodeRenamed.connect(self._onNodeRenamed)
+        self.treeModel.cleared.connect(self._onCleared)
+
         self.keyPressed = Signal("VesselBranchTreeItem, qt.Qt.Key")
         self.setContextMenuPolicy(qt.Qt.CustomContextMenu)
         self.customContextMenuRequested.connect(self.onContextMenu)
@@ -92,9 +102,27 @@ class BranchTree(qt.QTreeWidget):
         """
         Remove all Tree items.
         """
+        self.treeModel.clear()
+
+    def _onCleared(self):
         self._branchDict = {}
         qt.QTreeWidget.clear(self)
 
+    def _onNodeInserted(self, nodeId, parentNodeId, becomeIntermediaryParent):
+        self._insertNode(
+            nodeId, parentNodeId, becomeIntermediaryParent=becomeIntermediaryParent
+        )
+        self.expandAll()
+
+    def _onNodeRemoved(self, nodeId):
+        self._removeIntermediateItem(self._branchDict[nodeId], nodeId)
+
+    def _onNodeRenamed(self, previous, new):
+        nodeItem = self._branchDict.pop(previous)
+        self._branchDict[new] = nodeItem
+        nodeItem.nodeId = new
+        nodeItem.updateText()
+
     def setItemSelected(self, item):
         if item is not None:
             self.selectionModel().clearSelection()
@@ -112,7 +140,7 @@ class BranchTree(qt.QTreeWidget):
         bool
           True if nodeId is part of the tree, False otherwise.
         """
-        return nodeId in self._branchDict.keys()
+        return nodeId in self.treeModel
 
     def isRoot(self, nodeId):
         """
@@ -182,9 +210,7 @@ class BranchTree(qt.QTreeWidget):
             item.updateText()
             return
 
-        self._branchDict[item.text(0)] = self._branchDict.pop(item.nodeId)
-        item.nodeId = new
-        item.updateText()
+        self.treeModel.rename(previous, new)
         self.itemRenamed.emit(previous, new)
 
     def onHeaderClicked(self, column):
@@ -236,8 +262,11 @@ class BranchTree(qt.QTreeWidget):
                 nodeItem.addChild(rootItem)
             self._branchDict[nodeId] = nodeItem
         else:
-            children = self.getChildrenNodeId(parentId)
-            self._branchDict[parentId].addChild(nodeItem)
+            parentItem = self._branchDict[parentId]
+            children = [
+                parentItem.child(i).nodeId for i in range(parentItem.childCount())
+            ]
+            parentItem.addChild(nodeItem)
             self._branchDict[nodeId] = nodeItem
 
             if becomeIntermediaryParent:
@@ -272,10 +301,9 @@ class BranchTree(qt.QTreeWidget):
           ValueError
             If parentNodeId is not None and doesn't exist in the tree
         """
-        self._insertNode(
-            nodeId, parentNodeId, becomeIntermediaryParent=becomeIntermediaryParent
+        self.treeModel.insert_after_node(
+            nodeId, parentNodeId, become_intermediary_parent=becomeIntermediaryParent
         )
-        self.expandAll()
 
     def removeNode(self, nodeId):
         """Remove given node from tree.
@@ -292,12 +320,7 @@ class BranchTree(qt.QTreeWidget):
         -------
         bool - True if node was removed, False otherwise
         """
-        nodeItem = self._branchDict[nodeId]
-        if nodeItem.parent() is None:
-            return False
-        else:
-            self._removeIntermediateItem(nodeItem, nodeId)
-            return True
+        return self.treeModel.remove_node(nodeId)
 
     def _removeIntermediateItem(self, nodeItem, nodeId):
         """Move each child of node to node parent and remove item."""
@@ -320,8 +343,7 @@ class BranchTree(qt.QTreeWidget):
         str or None
           Id of the parent item or None if node has no parent
         """
-        parentItem = self._branchDict[childNodeId].parent()
-        return parentItem.nodeId if parentItem is not None else None
+        return self.treeModel.parent(childNodeId)
 
     def getChildrenNodeId(self, parentNodeId):
         """
@@ -330,8 +352,7 @@ class BranchTree(qt.QTreeWidget):
         List[str]
           List of nodeIds of every children associated with parentNodeId
         """
-        parent = self._branchDict[parentNodeId]
-        return [parent.child(i).nodeId for i in range(parent.childCount())]
+        return self.treeModel.children(parentNodeId)
 
     def getNodeList(self):
         """
@@ -340,7 +361,7 @@ class BranchTree(qt.QTreeWidget):
         List[str]
           List of every nodeIds referenced in the tree
         """
-        return self._branchDict.keys()
+        return list(self.treeModel)
 
     def getTreeWidgetItem(self, nodeId):
         return self._branchDict[nodeId] if nodeId in self._branchDict else None
@@ -356,7 +377,7 @@ class BranchTree(qt.QTreeWidget):
         bool
           True if nodeId has no children item, False otherwise
         """
-        return len(self.getChildrenNodeId(nodeId)) == 0
+        return self.treeModel.is_leaf(nodeId)
 
     def enforceOneRoot(self):
         """Reorders tree to have only one root item. If elements are defined after root, they will be inserted before
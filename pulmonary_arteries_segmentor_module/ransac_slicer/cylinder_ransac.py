@@ -7,6 +7,7 @@ from .volume import volume
 
 
 from . import cylinder, helper
+from .tracking_filter import tracking_filter
 
 
 class config:
@@ -31,6 +32,14 @@ class config:
         n_samples=128,
         ray_length=2,
         nb_iter=1000,
+        vesselness=None,
+        advance_ratio=0.5,
+        advance_ratio_min=0.25,
+        advance_ratio_max=0.75,
+        advance_growth=1.25,
+        advance_agreement=3,
+        curvature_angle=np.pi / 12,
+        radius_change=0.15,
     ):
         """
         Initialize algorithm's configuration
@@ -55,6 +64,20 @@ class config:
             n_samples (int, optional): Number of samples to extract on each ray cast. Defaults to 128.
             ray_length (int, optional): Length of a cast ray, as a proportion of the previous radius. Defaults to 3.
             nb_iter (int, optional): Number of iterations for the algorithm. Defaults to 1000.
+            vesselness (vesselness_map, optional): Vesselness prior used to order the candidate axes and to predict
+                                                   the next center. Defaults to None (no prior).
+            advance_ratio (float, optional): Initial proportion of the previous height to advance to get the new
+                                             center. Defaults to 0.5.
+            advance_ratio_min (float, optional): Lower bound of the adaptive advance ratio. Defaults to 0.25.
+            advance_ratio_max (float, optional): Upper bound of the adaptive advance ratio. Defaults to 0.75.
+            advance_growth (float, optional): Factor applied to the advance ratio when it is lengthened or shortened.
+                                              Defaults to 1.25.
+            advance_agreement (int, optional): Number of consecutive agreeing cylinders needed to lengthen the
+                                               advance. Defaults to 3.
+            curvature_angle (float, optional): Angle between two consecutive cylinder directions above which the
+                                               advance is shortened. Defaults to np.pi/12.
+            radius_change (float, optional): Relative radius change between two consecutive cylinders above which the
+                                             advance is shortened. Defaults to 0.15.
         """
 
         self.nb_test_min = nb_test_min
@@ -69,9 +92,19 @@ class config:
         self.n_samples = n_samples
         self.ray_len = ray_length
         self.nb_iter = nb_iter
-
-        # To be done: proportion of the previous height to advance to get the new center
-        self.advance_ratio = 0.5
+        self.vesselness = vesselness
+
+        # Proportion of the previous height to advance to get the new center, adapted along the tracking (see
+        # adapt_advance_ratio) within [advance_ratio_min, advance_ratio_max]
+        self.advance_ratio_min = min(advance_ratio_min, advance_ratio_max)
+        self.advance_ratio_max = max(advance_ratio_min, advance_ratio_max)
+        self.advance_ratio = float(
+            np.clip(advance_ratio, self.advance_ratio_min, self.advance_ratio_max)
+        )
+        self.advance_growth = max(advance_growth, 1)
+        self.advance_agreement = max(int(advance_agreement), 1)
+        self.curvature_angle = abs(curvature_angle)
+        self.radius_change = abs(radius_change)
 
     @property
     def nb_test_min(self):
@@ -422,9 +455,22 @@ class config:
         self._nb_iter = n if n > 0 else 0
 
 
-def fit_cylinder_ransac(p, axis, nb_test_min, nb_test_max, pct_inl, r_min, r_max, err):
+def fit_cylinder_ransac(
+    p,
+    axis,
+    nb_test_min,
+    nb_test_max,
+    pct_inl,
+    r_min,
+    r_max,
+    err,
+    seeds=(),
+    pct_inl_seeds=None,
+):
     """
     Fits a cylinder to a set of points using RANSAC, given the direction for the cylinder's axis
+    The seed triplets are reviewed first: the best one is returned if it reaches pct_inl_seeds. Otherwise, the seeds
+    are discarded and random triplets of p are drawn.
     The percentage of inliers might be below pct_inl if nb_test_max is reached.
     In that case, the cylinder with the best percentage of inliers is returned.
 
@@ -437,6 +483,10 @@ def fit_cylinder_ransac(p, axis, nb_test_min, nb_test_max, pct_inl, r_min, r_max
         r_min (float): Min radius allowed for returned cylinder
         r_max (float): Max radius allowed for returned cylinder
         err (float): Maximum allowable distance to cylinder for an inlier point
+        seeds (np.array(dtype=np.float64), optional): Hypotheses to review first, as a Kx3x3 array of point triplets
+                                                      (see warm_start_seeds). Defaults to ().
+        pct_inl_seeds (float, optional): Minimum percentage of inliers to return a seed without random sampling.
+                                         Defaults to None (halfway between pct_inl and 1).
 
     Returns:
         cylinder: Fitted cylinder
@@ -450,6 +500,31 @@ def fit_cylinder_ransac(p, axis, nb_test_min, nb_test_max, pct_inl, r_min, r_max
     if p.shape[0] < 3:
         return max_cyl, max_inliers, 0
 
+    if pct_inl_seeds is None:
+        pct_inl_seeds = (1 + pct_inl) / 2
+
+    # Warm start: review the seed triplets, and skip the random sampling if one of them is good enough. A seed is
+    # propagated from the previous cylinder, and may still gather enough inliers just past a vessel end: it needs more
+    # inliers than a random triplet to be kept
+    for q in seeds:
+        c = cylinder.fit_3_points(q[0], q[1], q[2], axis)
+
+        if c is not None and r_min < c.radius < r_max:
+            inliers = c.select_inliers(p, err)
+            p_inl = inliers.shape[0] / p.shape[0]
+
+            if p_inl > max_p_inl:
+                max_cyl = c
+                max_inliers = inliers
+                max_p_inl = p_inl
+
+    if max_p_inl >= pct_inl_seeds:
+        return max_cyl, max_inliers, max_p_inl
+
+    max_cyl = cylinder.cylinder(direction=axis)
+    max_p_inl = -1
+    max_inliers = np.empty((0, 3))
+
     # Do this at least nb_test_min times
     for _ in range(nb_test_min):
         # Pick 3 points at random
@@ -550,48 +625,143 @@ def filter_points(p, center, r_min, r_max):
     return p[i]
 
 
-def sample_around_cylinder(vol, cyl, cfg):
+def prior_direction(cfg, p, direction):
     """
-    Compute the current cylinder inliers without moving the cylinder center.
-    For more details about the process involved, please refer to the next_cylinder function,
-    since this function is a cheaper version of it.
+    Vessel direction given by the vesselness prior of cfg at point p, oriented as direction.
+    The prior is discarded if it deviates from direction by more than cfg.a_max.
 
     Args:
-        vol (volume): Input volume
-        cyl (cylinder): Current cylinder
         cfg (config): Tracking configuration
+        p (np.array(dtype=np.float64)): Query point, in RAS coordinates
+        direction (np.array(dtype=np.float64)): Current tracking direction
 
     Returns:
-        np.array(dtype=np.float64): Current cylinder's inlier point set
+        np.array(dtype=np.float64): Prior direction, or None if there is no usable prior
     """
 
-    order = vol.order
-    vol.order = 3
+    if cfg.vesselness is None:
+        return None
 
-    current_center = cyl.center
+    d = cfg.vesselness.direction(p, reference=direction)
 
-    r_min = cyl.radius * cfg.r_min
-    r_max = cyl.radius * cfg.r_max
-    ray_len = cyl.radius * cfg.ray_len
-    err_threshold = cyl.radius * cfg.threshold
+    if d is None or d @ direction < np.cos(cfg.a_max):
+        return None
 
-    p = sample(vol, current_center, ray_len, cfg.n_samples, cfg.ray_dir_set)
-    vol.order = order
-    p = filter_points(p, current_center, 0.1 * ray_len, 0.9 * ray_len)
+    return d
+
+
+def estimate_axis(vol, p, direction, cfg, max_ratio=0.5):
+    """
+    Direct estimation of the axis of a tubular point set from the gradient structure tensor at its points.
+    The image gradient at a vessel wall point is normal to the wall, hence orthogonal to the vessel axis: the axis is
+    the eigenvector associated with the smallest eigenvalue of the sum of the (normalized) gradient outer products.
+    The estimation is oriented as direction, and discarded if it deviates from it by more than cfg.a_max.
+
+    Args:
+        vol (volume): Input volume
+        p (np.array(dtype=np.float64)): Wall points, as a Nx3 array
+        direction (np.array(dtype=np.float64)): Current tracking direction
+        cfg (config): Tracking configuration
+        max_ratio (float, optional): Maximum ratio between the smallest and the middle eigenvalues for the point set to
+                                     be considered tubular. Defaults to 0.5.
+
+    Returns:
+        np.array(dtype=np.float64): Estimated axis, or None if the point set is not tubular enough
+    """
 
     if p.shape[0] < 3:
-        return None, None
+        return None
+
+    # Central differences along the RAS axes, with all samples interpolated at once
+    h = 0.5 * np.min(vol.voxel_size)
+    offsets = np.vstack((np.eye(3), -np.eye(3))) * h
+    values = vol((p[:, None, :] + offsets[None, :, :]).reshape((-1, 3))).reshape(
+        (-1, 6)
+    )
+    g = (values[:, :3] - values[:, 3:]) / (2 * h)
+
+    n = np.linalg.norm(g, axis=1)
+    g = g[n > 0] / n[n > 0, None]
+
+    if g.shape[0] < 3:
+        return None
+
+    w, v = np.linalg.eigh(g.T @ g)
+
+    if w[1] <= 0 or w[0] / w[1] > max_ratio:
+        return None
+
+    axis = v[:, 0]
+
+    if axis @ direction < 0:
+        axis = -axis
+
+    if axis @ direction < np.cos(cfg.a_max):
+        return None
+
+    return axis
+
+
+def candidate_axes(direction, cfg, priors=(), a_max=None):
+    """
+    Ordered set of candidate axes for the RANSAC search: the prior axes first, then the directions of
+    cfg.cyl_dir_set within a_max of direction, starting with the one most aligned with direction.
+
+    Args:
+        direction (np.array(dtype=np.float64)): Current tracking direction
+        cfg (config): Tracking configuration
+        priors (list, optional): Axes to review first, None entries are ignored. Defaults to ().
+        a_max (float, optional): Maximum angle to direction. Defaults to None (cfg.a_max).
+
+    Returns:
+        np.array(dtype=np.float64): Candidate axes, as a Nx3 array
+    """
+
+    if a_max is None:
+        a_max = cfg.a_max
+
+    cos_dir = np.abs(direction @ cfg.cyl_dir_set.T)
+
+    # Sort cylinder directions starting with the one most aligned with direction
+    idx = np.argsort(-cos_dir)
+    idx = idx[cos_dir[idx] >= np.cos(a_max)]
+
+    priors = [d for d in priors if d is not None]
+
+    if len(priors) == 0:
+        return cfg.cyl_dir_set[idx]
+
+    return np.vstack((priors, cfg.cyl_dir_set[idx]))
+
+
+def fit_best_axis(p, axes, cfg, r_min, r_max, err, seeds=()):
+    """
+    Look for the best cylinder fitting p among candidate axes:
+        - review axes in the given order
+        - as soon as a cylinder is found with more than cfg.pct_inl inlier rate, keep it and stop searching -
+          otherwise list cylinders with an inlier rate larger than cfg.pct_inl/2:
+            the cylinder with the best inlier rate will be kept, if any
+
+    Args:
+        p (np.array(dtype=np.float64)): Input set of points
+        axes (np.array(dtype=np.float64)): Candidate axes, as a Nx3 array
+        cfg (config): Tracking configuration
+        r_min (float): Min radius allowed for returned cylinder
+        r_max (float): Max radius allowed for returned cylinder
+        err (float): Maximum allowable distance to cylinder for an inlier point
+        seeds (np.array(dtype=np.float64), optional): Hypotheses reviewed first for each axis, as a Kx3x3 array of
+                                                      point triplets. Defaults to ().
 
-    idx = np.argsort(-np.abs(cyl.direction @ cfg.cyl_dir_set.T))
+    Returns:
+        cylinder: Best cylinder found
+        np.array(dtype=np.float64): Its inlier set, empty if no cylinder was found
+    """
 
     p_max = 0
     c_max = cylinder.cylinder()
     i_max = np.empty((0, 3))
 
-    for axis in cfg.cyl_dir_set[idx]:
-        if np.abs(cyl.direction @ axis) < np.cos(cfg.a_max):
-            continue
-
+    for axis in axes:
         c, inliers, p_inl = fit_cylinder_ransac(
             p,
             axis,
@@ -600,20 +770,121 @@ def sample_around_cylinder(vol, cyl, cfg):
             cfg.pct_inl,
             r_min,
             r_max,
-            err_threshold,
+            err,
+            seeds,
         )
 
         if p_inl > cfg.pct_inl:
-            p_max = p_inl
-            c_max = c
-            i_max = inliers
-            break
+            return c, inliers
 
+        # Also list cylinder with inlier rate > cfg.pct_inl/2
         elif p_inl > cfg.pct_inl / 2 and p_max < p_inl:
+            # Update cyl with max inliers
             p_max = p_inl
             c_max = c
             i_max = inliers
 
+    return c_max, i_max
+
+
+def warm_start_seeds(cyl, inliers, center, nb_triplets=2):
+    """
+    Hypotheses for the RANSAC search of a cylinder around center, derived from the cylinder cyl, as point triplets:
+        - 3 points spread on the surface of cyl, translated to center (the propagated model of cyl)
+        - triplets of inliers of cyl translated to center, spread around the axis of cyl
+    With the axis of cyl, the first triplet gives back the propagated model. With a different axis, the triplets
+    give the closest cylinders going through the (translated) previous wall points.
+
+    Args:
+        cyl (cylinder): Previous cylinder
+        inliers (np.array(dtype=np.float64)): Inlier set of cyl, or None
+        center (np.array(dtype=np.float64)): Guess for the center of the searched cylinder
+        nb_triplets (int, optional): Number of triplets built from the inliers. Defaults to 2.
+
+    Returns:
+        np.array(dtype=np.float64): Point triplets, as a Kx3x3 array
+    """
+
+    # Orthonormal frame of the plane orthogonal to the axis of cyl
+    u = helper.cross(cyl.direction, np.array([1.0, 0.0, 0.0]))
+
+    if np.linalg.norm(u) < 0.1:
+        u = helper.cross(cyl.direction, np.array([0.0, 1.0, 0.0]))
+
+    u /= np.linalg.norm(u)
+    v = helper.cross(cyl.direction, u)
+
+    angles = 2 * np.pi * np.arange(3) / 3
+    seeds = [
+        center
+        + cyl.radius * (np.cos(angles)[:, None] * u + np.sin(angles)[:, None] * v)
+    ]
+
+    if inliers is not None and inliers.shape[0] >= 3:
+        q = inliers + (center - cyl.center)
+
+        # Sort the points by angle around the axis, and pick triplets one third of a turn apart
+        d = q - center
+        order = np.argsort(np.arctan2(d @ v, d @ u))
+        n = order.shape[0]
+
+        for k in range(nb_triplets):
+            offset = k * n // (3 * nb_triplets)
+            seeds.append(q[order[(offset + np.arange(3) * n // 3) % n]])
+
+    return np.array(seeds)
+
+
+def sample_around_cylinder(vol, cyl, cfg):
+    """
+    Compute the current cylinder inliers without moving the cylinder center.
+    For more details about the process involved, please refer to the next_cylinder function,
+    since this function is a cheaper version of it.
+
+    Args:
+        vol (volume): Input volume
+        cyl (cylinder): Current cylinder
+        cfg (config): Tracking configuration
+
+    Returns:
+        np.array(dtype=np.float64): Current cylinder's inlier point set
+    """
+
+    order = vol.order
+    vol.order = 3
+
+    current_center = cyl.center
+
+    r_min = cyl.radius * cfg.r_min
+    r_max = cyl.radius * cfg.r_max
+    ray_len = cyl.radius * cfg.ray_len
+    err_threshold = cyl.radius * cfg.threshold
+
+    p = sample(vol, current_center, ray_len, cfg.n_samples, cfg.ray_dir_set)
+    vol.order = order
+    p = filter_points(p, current_center, 0.1 * ray_len, 0.9 * ray_len)
+
+    if p.shape[0] < 3:
+        return None, None
+
+    axes = candidate_axes(
+        cyl.direction,
+        cfg,
+        [
+            estimate_axis(vol, p, cyl.direction, cfg),
+            prior_direction(cfg, current_center, cyl.direction),
+        ],
+    )
+    c_max, i_max = fit_best_axis(
+        p,
+        axes,
+        cfg,
+        r_min,
+        r_max,
+        err_threshold,
+        warm_start_seeds(cyl, None, current_center),
+    )
+
     if i_max.shape[0] < 3:
         return None, None
 
@@ -642,7 +913,7 @@ def sample_around_cylinder(vol, cyl, cfg):
     return i_max
 
 
-def next_cylinder(vol, cyl, cfg):
+def next_cylinder(vol, cyl, cfg, pred=None, advance_ratio=None, inliers=None):
     """
     Compute next cylinder
 
@@ -650,6 +921,15 @@ def next_cylinder(vol, cyl, cfg):
         vol (volume): Input volume
         cyl (cylinder): Current cylinder
         cfg (config): Tracking configuration
+        pred (prediction, optional): Predicted next cylinder (see tracking_filter). If given, the first search is
+                                     centered on the predicted center and restricted to the predicted windows, the
+                                     next ones advance from the center of cyl within the windows of cfg.
+                                     Defaults to None.
+        advance_ratio (float, optional): Proportion of the current height to advance to get the predicted center.
+                                         The searches around the current center never advance more than
+                                         cfg.advance_ratio. Defaults to None (cfg.advance_ratio).
+        inliers (np.array(dtype=np.float64), optional): Inlier set of cyl, used to warm start the RANSAC search.
+                                                        Defaults to None.
 
     Returns:
         cylinder: Next cylinder
@@ -660,19 +940,41 @@ def next_cylinder(vol, cyl, cfg):
     order = vol.order
     vol.order = 3
 
-    # We try with original cfg.advance_ration, and if it fails, try again with 2*cfg.advance_ratio (typical case when
-    # the artery is highly curved)
-    for li in [1, 2]:
-        # Compute guess for next cylinder center: advance from current one by cfg.advance_ratio times its height along
+    if advance_ratio is None:
+        advance_ratio = cfg.advance_ratio
+
+    # A lengthened step is only tried from the prediction: the searches of cfg, and the acceptance window of the
+    # advance, are the ones of the initial step, so that the tracking does not go further past a vessel end
+    base_ratio = min(advance_ratio, cfg.advance_ratio)
+
+    # We try the predicted pose first, then with original advance_ratio, and if it fails, try again with
+    # 2*advance_ratio (typical case when the artery is highly curved)
+    for li in [0, 1, 2] if pred is not None else [1, 2]:
+        # Compute guess for next cylinder center: advance from current one by advance_ratio times its height along
         # direction li is here in case the original advance_ratio (0.5 by default) was not large enough to ensure
-        # sufficient progress in the tracking
-        next_center = cyl.center + li * cfg.advance_ratio * cyl.height * cyl.direction
+        # sufficient progress in the tracking.
+        # When a vesselness prior is available, advance along the local vessel direction rather than along the
+        # current cylinder axis
+        prior = prior_direction(cfg, cyl.center, cyl.direction)
+        advance_direction = cyl.direction if prior is None else prior
+        next_center = cyl.center + li * base_ratio * cyl.height * advance_direction
 
         # Sets some parameters from cfg
         r_min = cyl.radius * cfg.r_min
         r_max = cyl.radius * cfg.r_max
         ray_len = cyl.radius * cfg.ray_len
         err_threshold = cyl.radius * cfg.threshold
+        search_direction, a_max = cyl.direction, cfg.a_max
+
+        # The first search uses the predicted pose, in which the vesselness prior is already fused (see
+        # tracking_filter.predict), and its narrower windows. If it fails, the prediction may be wrong: the next
+        # searches do not rely on it, they advance from the current center within the windows of cfg
+        if li == 0:
+            next_center = pred.center
+            r_min = pred.radius * pred.r_min
+            r_max = pred.radius * pred.r_max
+            ray_len = pred.radius * pred.ray_len
+            search_direction, a_max = pred.direction, pred.a_max
 
         # Extract points. Remove (filter out) points at both extremities because the 3rd order interpolation might
         # provide tainted gradient values
@@ -683,45 +985,21 @@ def next_cylinder(vol, cyl, cfg):
         if p.shape[0] < 3:
             return None, None
 
-        # Sort cylinder directions starting with the one most aligned with cyl.direction
-        idx = np.argsort(-np.abs(cyl.direction @ cfg.cyl_dir_set.T))
-
-        # Look for best cylinder:
-        #   - review axes in idx-based order
-        #   - as soon as a cylinder is found with more than cfg.pct_inl inlier rate, keep it and stop searching -
-        #     otherwise list cylinders with an inlier rate larger than cfg.pct_inl/2:
-        #       the cylinder with the best inlier rate will be kept, if any
-        p_max = 0
-        c_max = cylinder.cylinder()
-        i_max = np.empty((0, 3))
-
-        for axis in cfg.cyl_dir_set[idx]:
-            if np.abs(cyl.direction @ axis) < np.cos(cfg.a_max):
-                continue
-
-            c, inliers, p_inl = fit_cylinder_ransac(
-                p,
-                axis,
-                cfg.nb_test_min,
-                cfg.nb_test_max,
-                cfg.pct_inl,
-                r_min,
-                r_max,
-                err_threshold,
-            )
-
-            if p_inl > cfg.pct_inl:
-                p_max = p_inl
-                c_max = c
-                i_max = inliers
-                break
-
-            # Also list cylinder with inlier rate > cfg.pct_inl/2
-            elif p_inl > cfg.pct_inl / 2 and p_max < p_inl:
-                # Update cyl with max inliers
-                p_max = p_inl
-                c_max = c
-                i_max = inliers
+        # Look for best cylinder. The axis estimated from the sampled points is reviewed first (it is usually the
+        # only one needed), then the prior directions, and the discrete set of directions as a fallback.
+        # For each axis, the hypotheses propagated from cyl and its inliers are reviewed before random sampling
+        axes = candidate_axes(
+            search_direction,
+            cfg,
+            [
+                estimate_axis(vol, p, search_direction, cfg),
+                prior,
+                prior_direction(cfg, next_center, search_direction),
+            ],
+            a_max,
+        )
+        seeds = warm_start_seeds(cyl, inliers, next_center)
+        c_max, i_max = fit_best_axis(p, axes, cfg, r_min, r_max, err_threshold, seeds)
 
         # Need at least 3 points to fit a cylinder.
         # Else: stop, no valid cylinder was found
@@ -777,13 +1055,14 @@ def next_cylinder(vol, cyl, cfg):
         # Fixes height, and select inliers with this height
         i_max = c_max.fix_height(i_max)
 
-        # Test if a sufficient advance was made.
+        # Test if a sufficient advance was made, relative to the requested one (height/2 to 2*height for the default
+        # advance_ratio of 0.5).
         # If not, we might try with a double advance_ratio (initial loop over li)
         if c_max.radius > 4:
             c_max.height = c_max.radius
         dist_centers = np.linalg.norm(c_max.center - cyl.center)
-        if dist_centers >= cyl.height / 2 and (
-            cyl.height == 0 or dist_centers <= cyl.height * 2
+        if dist_centers >= base_ratio * cyl.height and (
+            cyl.height == 0 or dist_centers <= 4 * cfg.advance_ratio * cyl.height
         ):
             # Restore interpolation order
             vol.order = order
@@ -796,6 +1075,65 @@ def next_cylinder(vol, cyl, cfg):
     return None, None
 
 
+def adapt_advance_ratio(advance_ratio, cyl, next_cyl, cfg, agreeing=0):
+    """
+    Adapt the advance ratio to the local shape of the vessel:
+        - shorten it when the direction or the radius changed significantly between two consecutive cylinders
+        - lengthen it when both agree, i.e. on straight segments of constant radius, once cfg.advance_agreement
+          consecutive cylinders agreed, and only up to the advance over which the measured turn and radius change
+          would stay within half of cfg.curvature_angle and cfg.radius_change
+    The result is clamped to [cfg.advance_ratio_min, cfg.advance_ratio_max].
+
+    Args:
+        advance_ratio (float): Current advance ratio
+        cyl (cylinder): Previous cylinder
+        next_cyl (cylinder): Cylinder found after cyl
+        cfg (config): Tracking configuration
+        agreeing (int, optional): Number of consecutive agreeing cylinders before next_cyl. Defaults to 0.
+
+    Returns:
+        float: Advance ratio for the next step
+        int: Number of consecutive agreeing cylinders, including next_cyl
+    """
+
+    angle = np.arccos(np.clip(np.abs(cyl.direction @ next_cyl.direction), 0, 1))
+    radius_change = (
+        abs(next_cyl.radius - cyl.radius) / cyl.radius if cyl.radius > 0 else 0
+    )
+
+    if angle > cfg.curvature_angle or radius_change > cfg.radius_change:
+        advance_ratio /= cfg.advance_growth
+        agreeing = 0
+    elif angle < cfg.curvature_angle / 2 and radius_change < cfg.radius_change / 2:
+        agreeing += 1
+    else:
+        agreeing = 0
+
+    if agreeing >= cfg.advance_agreement:
+        # Longest advance keeping the turn and the radius change per unit length measured along the last step
+        # within half of the thresholds
+        step = np.linalg.norm(next_cyl.center - cyl.center)
+        ratio_max = cfg.advance_ratio_max
+        if step > 0 and next_cyl.height > 0:
+            if angle > 0:
+                ratio_max = min(
+                    ratio_max, cfg.curvature_angle / 2 * step / angle / next_cyl.height
+                )
+            if radius_change > 0:
+                ratio_max = min(
+                    ratio_max,
+                    cfg.radius_change / 2 * step / radius_change / next_cyl.height,
+                )
+        advance_ratio = min(
+            advance_ratio * cfg.advance_growth, max(ratio_max, advance_ratio)
+        )
+
+    return (
+        float(np.clip(advance_ratio, cfg.advance_ratio_min, cfg.advance_ratio_max)),
+        agreeing,
+    )
+
+
 def track_cylinder(vol, cyl, cfg):
     """
     Generator that tracks cylinders in a volume, starting with an initial guess
@@ -810,12 +1148,24 @@ def track_cylinder(vol, cyl, cfg):
         np.array(dtype=np.float64): Next cylinder's inlier set
     """
 
+    state = tracking_filter(cyl, cfg)
+    advance_ratio = cfg.advance_ratio
+    agreeing = 0
+    inliers = None
+
     for _ in range(cfg.nb_iter):
-        c_max, i_max = next_cylinder(vol, cyl, cfg)
+        prior = prior_direction(cfg, cyl.center, cyl.direction)
+        pred = state.predict(advance_ratio * cyl.height, prior)
+        c_max, i_max = next_cylinder(vol, cyl, cfg, pred, advance_ratio, inliers)
 
         if c_max is not None:
+            state.update(c_max)
             yield c_max, i_max
+            advance_ratio, agreeing = adapt_advance_ratio(
+                advance_ratio, cyl, c_max, cfg, agreeing
+            )
             cyl = c_max.copy()
+            inliers = i_max
         else:
             break
 
@@ -843,6 +1193,7 @@ def track_branch(
 
     contour_points_cpt = 0
     current_branch_cylinders = []
+    contour_points = list(contour_points)
 
     for _cylinder, current_contour_points in track_cylinder(vol, cyl, cfg):
         # Criteria for acceptance: Need to be better justified especially third one
@@ -859,7 +1210,7 @@ def track_branch(
             current_branch_cylinders.append(_cylinder)
 
             centerline = np.vstack((centerline, _cylinder.center))
-            contour_points.append(current_contour_points.tolist())
+            contour_points.append(current_contour_points)
 
             radius = np.linalg.norm(
                 current_contour_points - _cylinder.center, axis=1
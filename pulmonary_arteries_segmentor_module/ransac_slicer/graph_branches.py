@@ -8,8 +8,14 @@ from .popup_utils import CustomProgressBar
 import slicer
 import qt
 import os
+from collections import OrderedDict
 from .cylinder import cylinder
 from .branch_tree import BranchTree, TreeColumnRole, Icons
+from .branch_registry import Branch, BranchRegistry
+from .scene_utils import batch_scene_update
+from .ragged import RaggedPoints
+from .tree_file import save_tree
+from .journal import Journal
 from .color_palettes import centerline_color, contour_points_color
 
 
@@ -29,27 +35,44 @@ class GraphBranches:
         centerline_button,
         contour_point_button,
         lock_button,
+        contour_markups_cache_size: int = 20,
+        journal: Union[Journal, None] = None,
     ) -> None:
-        self.branch_list = []  # list of shape (n,m) with n = number of branches and m = number of cylinder in the current branch
-        self.nodes = []  # list of nodes which are the birfucation + root + leafs
-        self.edges = []  # list of tuple for edges between nodes
-        self.names = []  # list of names in each edges
-        self.centerlines: list[
-            np.ndarray
-        ] = []  # list of shape (n,m,3) with n = number of branches and m = number of points in the current center line
-        self.contours_points: list[
-            list
-        ] = []  # list of shape (n,m,l,3) with n = number of branches, m = number of points in the current center line and l = number of points in the current contour
-        self.centerline_radius = []  # list of shape (n,m) with n = number of branches and m = the radius of each points of the center line
-        self.centerline_markups = []  # list of markups for centers line
-        self.contour_points_markups = []  # list of markups for contour points
+        """
+        Parameters
+        ----------
+
+        tree_widget: tree view of the branches.
+        centerline_button: button showing / hiding all the centerlines.
+        contour_point_button: button showing / hiding all the contour points.
+        lock_button: button locking the markups.
+        contour_markups_cache_size: number of hidden contour points markups kept in the scene, the least
+        recently shown ones are removed beyond it and created again when shown.
+        journal: journal where the structural operations are written, to restore the tree after a crash.
+        """
+        self.nodes = {}  # stable id -> position of the nodes, which are the birfucation + root + leafs
+        self._next_node_id = 0
+        self.registry = BranchRegistry()  # data of each branch, found by id or by name
+
+        # Changes since the last painting of the segmentation, see SegmentPainter
+        self.dirty_branches = set()  # names of the branches created or modified
+        self.renamed_branches = {}  # current name of the renamed branches -> name at the last painting
 
         self.tree_widget = tree_widget
+        # Topology of the branches, the widget being its view
+        self.tree_model = tree_widget.treeModel
         self.centerline_button = centerline_button
         self.contour_point_button = contour_point_button
         self.lock_button = lock_button
         self.centerline_text_size = 3.0
 
+        # The contour points markups are only created when shown, hidden ones are released beyond the cache size
+        self.contour_markups_cache_size = contour_markups_cache_size
+        # Ids of the branches whose contour points markup is created but hidden, the most recently hidden last
+        self._hidden_contour_markups = OrderedDict()
+
+        self.journal = journal
+
         self.current_tree_item = None
         self.tree_widget.connect(
             "itemClicked(QTreeWidgetItem *, int)", self.on_item_clicked
@@ -60,21 +83,144 @@ class GraphBranches:
         self.tree_widget.keyPressed.connect(self.on_key_pressed)
         self.tree_widget.headerClicked.connect(self.on_header_clicked)
 
-        self.node_selected = (-1, -1)
+        self.node_selected = (
+            -1,
+            -1,
+        )  # id of the branch and index of the point selected in the 3D view
+
+    # Per branch data, in the order the branches were added, for the code working on branch indexes
+    @property
+    def names(self) -> list[str]:
+        return [branch.name for branch in self.registry]
+
+    @property
+    def edges(self) -> list[tuple[int, int]]:
+        return [branch.edge for branch in self.registry]
+
+    @property
+    def centerlines(self) -> list[np.ndarray]:
+        return [branch.centerline for branch in self.registry]
+
+    @property
+    def contours_points(self) -> list[RaggedPoints]:
+        return [branch.contour_points for branch in self.registry]
+
+    @property
+    def centerline_radius(self) -> list[list[float]]:
+        return [branch.centerline_radius for branch in self.registry]
+
+    @property
+    def branch_list(self) -> list[list[cylinder]]:
+        return [branch.cylinders for branch in self.registry]
+
+    @property
+    def centerline_markups(self) -> list:
+        return [branch.centerline_markup for branch in self.registry]
+
+    @property
+    def contour_points_markups(self) -> list:
+        # Only the markups created, see show_contour_points
+        return [
+            branch.contour_points_markup
+            for branch in self.registry
+            if branch.contour_points_markup is not None
+        ]
+
+    def mark_dirty(self, name: str):
+        """
+        Flag a branch as created or modified since the last painting of the segmentation.
+
+        Parameters
+        ----------
+
+        name: name of the branch.
+        """
+        self.dirty_branches.add(name)
 
-    def create_new_markups(
-        self, name: str, centerline: np.ndarray, contour_points: list[list[np.ndarray]]
+    def clear_dirty(self):
+        """
+        Forget the changes, once the segmentation has been painted.
+        """
+        self.dirty_branches = set()
+        self.renamed_branches = {}
+
+    def write_journal(
+        self,
+        kind: str,
+        names: list[str] = (),
+        nodes: list[int] = (),
+        removed_names: list[str] = (),
+        removed_nodes: list[int] = (),
+        renamed: Union[tuple[str, str], None] = None,
     ):
         """
-        Create a new markup for the centerline and the associated contour points.
+        Append a structural operation to the journal, if any, and compact the journal when needed.
+
+        Parameters
+        ----------
+
+        kind: kind of operation, e.g. create, split, merge, trim, delete or rename.
+        names: names of the branches created or modified, the parent of their children is written too.
+        nodes: ids of the nodes created or moved.
+        removed_names: names of the branches deleted.
+        removed_nodes: ids of the nodes deleted.
+        renamed: previous and new name of a renamed branch.
+        """
+        if self.journal is None:
+            return
+
+        parents = {}
+        for name in names:
+            for node_id in [name] + self.tree_model.children(name):
+                parents[node_id] = self.tree_model.parent(node_id)
+
+        if self.journal.append(
+            kind,
+            branches=[self.registry.get(name) for name in names],
+            parents=parents,
+            nodes={node_id: self.nodes[node_id] for node_id in nodes},
+            removed_branches=removed_names,
+            removed_nodes=removed_nodes,
+            renamed=renamed,
+        ):
+            self.compact_journal()
+
+    def compact_journal(self):
+        """
+        Save the whole tree as the snapshot of the journal, if any, e.g. after loading a tree.
+        """
+        if self.journal is None:
+            return
+
+        names = self.tree_model.dfs()
+        self.journal.compact(
+            self.nodes,
+            [self.registry.get(name) for name in names],
+            [self.tree_model.parent(name) for name in names],
+        )
+
+    def draw_order(self) -> list[int]:
+        """
+        Indexes of the branches (in the order of names, centerlines...) in the order they are drawn: reverse
+        breadth first order, so that parent branches are always drawn on top of their children.
+        """
+        indexes = {name: idx for idx, name in enumerate(self.names)}
+        return [indexes[name] for name in reversed(self.tree_model.bfs())]
+
+    def create_centerline_markup(self, name: str, centerline: np.ndarray):
+        """
+        Create a new markup for the centerline.
 
         Parameters
         ----------
 
         name: name of the branch.
         centerline: array containing the points of the centerline.
-        contour_points: array of array of contour points, contour_points[0] are the points sampled around centerline[0],
-        contour_points[1] are the points sampled around centerline[1] etc...
+
+        Returns
+        ----------
+
+        The markup of the centerline.
         """
         centerline_markup = slicer.mrmlScene.AddNewNodeByClass(
             "vtkMRMLMarkupsCurveNode"
@@ -88,28 +234,182 @@ class GraphBranches:
         )
         centerline_markup.GetDisplayNode().SetSelectedColor(*centerline_color)
 
+        if self.lock_button.checked:
+            centerline_markup.LockedOn()
+
+        return centerline_markup
+
+    def create_contour_points_markup(self, name: str, contour_points: RaggedPoints):
+        """
+        Create a new hidden markup for the contour points.
+
+        Parameters
+        ----------
+
+        name: name of the branch.
+        contour_points: contour points of the branch.
+
+        Returns
+        ----------
+
+        The markup of the contour points.
+        """
         contour_points_markup = slicer.mrmlScene.AddNewNodeByClass(
             "vtkMRMLMarkupsFiducialNode"
         )
         slicer.util.updateMarkupsControlPointsFromArray(
-            contour_points_markup,
-            np.array([elt for pts in contour_points for elt in pts]),
+            contour_points_markup, contour_points.flat
         )
         contour_points_markup.GetDisplayNode().SetTextScale(0)
         contour_points_markup.GetDisplayNode().SetVisibility(False)
         contour_points_markup.GetDisplayNode().SetSelectedColor(*contour_points_color)
         contour_points_markup.SetName(name + "_contours")
 
-        self.centerline_markups.append(centerline_markup)
-        self.contour_points_markups.append(contour_points_markup)
-
         if self.lock_button.checked:
-            centerline_markup.LockedOn()
             contour_points_markup.LockedOn()
 
+        return contour_points_markup
+
+    def is_contour_points_visible(self, branch: Branch) -> bool:
+        """
+        Check if the contour points of a branch are shown, they are hidden if their markup is not created.
+        """
+        return (
+            branch.contour_points_markup is not None
+            and branch.branch_id not in self._hidden_contour_markups
+        )
+
+    def show_contour_points(self, branch: Branch, visible: bool):
+        """
+        Show or hide the contour points of a branch.
+
+        The markup is created the first time the contour points are shown. Once hidden, it is kept in the scene
+        until more than contour_markups_cache_size hidden markups are kept.
+
+        Parameters
+        ----------
+
+        branch: branch whose contour points are shown or hidden.
+        visible: flag to show the contour points.
+        """
+        if branch.contour_points_markup is None:
+            if not visible:
+                return
+            branch.contour_points_markup = self.create_contour_points_markup(
+                branch.name, branch.contour_points
+            )
+        branch.contour_points_markup.GetDisplayNode().SetVisibility(visible)
+        if visible:
+            self._hidden_contour_markups.pop(branch.branch_id, None)
+            return
+
+        self._hidden_contour_markups[branch.branch_id] = None
+        self._hidden_contour_markups.move_to_end(branch.branch_id)
+
+        # Release the least recently hidden markups beyond the cache size
+        while len(self._hidden_contour_markups) > self.contour_markups_cache_size:
+            branch_id = next(iter(self._hidden_contour_markups))
+            self.release_contour_points_markup(self.registry[branch_id])
+
+    def release_contour_points_markup(self, branch: Branch):
+        """
+        Remove the contour points markup of a branch from the scene, if it was created.
+        """
+        if branch.contour_points_markup is not None:
+            slicer.mrmlScene.RemoveNode(branch.contour_points_markup)
+            branch.contour_points_markup = None
+        self._hidden_contour_markups.pop(branch.branch_id, None)
+
+    def update_contour_points_markup(self, branch: Branch):
+        """
+        Update the contour points markup of a branch after its contour points changed, if it was created.
+        """
+        if branch.contour_points_markup is not None:
+            slicer.util.updateMarkupsControlPointsFromArray(
+                branch.contour_points_markup, branch.contour_points.flat
+            )
+
+    def add_branch(
+        self,
+        name: str,
+        edge,
+        centerline: np.ndarray,
+        contour_points: Union[RaggedPoints, list[list[np.ndarray]]],
+        centerline_radius: list[float],
+    ) -> Branch:
+        """
+        Add a branch to the registry, with its centerline markup.
+
+        Parameters
+        ----------
+
+        name: name of the branch.
+        edge: the edge of the graph joined by the branch.
+        centerline: array containing the points of the centerline.
+        contour_points: array of array of contour points, contour_points[0] are the points sampled around centerline[0],
+        contour_points[1] are the points sampled around centerline[1] etc...
+        centerline_radius: array containing the underestimated radius of each point of the centerline.
+
+        Returns
+        ----------
+
+        The branch added.
+        """
+        return self.add_branches(
+            [name], [edge], [centerline], [contour_points], [centerline_radius]
+        )[0]
+
+    def add_branches(
+        self,
+        names: list[str],
+        edges: list,
+        centerlines: list[np.ndarray],
+        contours_points: list[Union[RaggedPoints, list[list[np.ndarray]]]],
+        centerline_radius: list[list[float]],
+        progress=None,
+    ) -> list[Branch]:
+        """
+        Add several branches to the registry, with their centerline markups, e.g. when loading a tree.
+
+        The visibility buttons are only updated once all the branches are added, and the cylinders of the
+        branches are only built when needed.
+
+        Parameters
+        ----------
+
+        names: name of each branch.
+        edges: the edge of the graph joined by each branch.
+        centerlines: points of the centerline of each branch.
+        contours_points: contour points of each branch, see add_branch.
+        centerline_radius: underestimated radius of each point of the centerline of each branch.
+        progress: function wrapping the iterable of the branches added, e.g. to display a progress bar.
+
+        Returns
+        ----------
+
+        The branches added.
+        """
+        indexes = range(len(names))
+        branches = []
+        for idx in indexes if progress is None else progress(indexes):
+            branch = Branch(
+                names[idx],
+                edges[idx],
+                centerlines[idx],
+                RaggedPoints.from_lists(contours_points[idx]),
+                centerline_radius[idx],
+                None,
+                self.create_centerline_markup(names[idx], centerlines[idx]),
+            )
+            self.registry.add(branch)
+            self.mark_dirty(branch.name)
+            branches.append(branch)
+
         self.update_visibility_button(TreeColumnRole.VISIBILITY_CENTER)
         self.update_visibility_button(TreeColumnRole.VISIBILITY_CONTOUR)
 
+        return branches
+
     def create_new_branch(
         self,
         edge,
@@ -134,53 +434,43 @@ class GraphBranches:
         isFromSplitBranch: flag to check if this new branch is from a split, if it is not from a split we may
         merge branch with its single children.
         """
-        new_branch_list = []
-        for point in centerline:
-            new_branch_list.append(cylinder(center=np.array(point)))
-        self.branch_list.append(new_branch_list)
-
-        self.edges.append(edge)
-        new_name = "b" + str(len(self.edges))
-        self.names.append(new_name)
-        self.centerlines.append(centerline)
-        self.contours_points.append(contour_points)
-        self.centerline_radius.append(centerline_radius)
+        # Smallest free name, names of deleted branches may be taken
+        branch_number = len(self.registry) + 1
+        while "b" + str(branch_number) in self.registry:
+            branch_number += 1
+        new_name = "b" + str(branch_number)
 
-        self.create_new_markups(new_name, centerline, contour_points)
+        self.add_branch(new_name, edge, centerline, contour_points, centerline_radius)
 
-        self.tree_widget.insertAfterNode(
-            nodeId=new_name,
-            parentNodeId=parent_node,
-            becomeIntermediaryParent=isFromSplitBranch,
+        self.tree_model.insert_after_node(
+            new_name, parent_node, become_intermediary_parent=isFromSplitBranch
         )
+        self.write_journal("create", names=[new_name], nodes=edge)
 
         if not isFromSplitBranch:
             self.on_merge_only_child(parent_node)
 
-    def update_parent_branch(self, branch_idx: int, node_idx: int):
+    def update_parent_branch(self, branch_id: int, node_idx: int):
         """
         Update the graph when a split occurs.
 
         Parameters
         ----------
 
-        branch_idx: index of the branch updated.
+        branch_id: id of the branch updated.
         node_idx: index of the last point of the branch.
         """
-        self.branch_list[branch_idx] = self.branch_list[branch_idx][:node_idx]
-        self.centerlines[branch_idx] = self.centerlines[branch_idx][:node_idx]
-        self.contours_points[branch_idx] = self.contours_points[branch_idx][:node_idx]
-        self.centerline_radius[branch_idx] = self.centerline_radius[branch_idx][
-            :node_idx
-        ]
+        branch = self.registry[branch_id]
+        branch.cylinders = branch.cylinders[:node_idx]
+        branch.centerline = branch.centerline[:node_idx]
+        branch.contour_points = branch.contour_points[:node_idx]
+        branch.centerline_radius = branch.centerline_radius[:node_idx]
+        self.mark_dirty(branch.name)
 
         slicer.util.updateMarkupsControlPointsFromArray(
-            self.centerline_markups[branch_idx], self.centerlines[branch_idx]
-        )
-        slicer.util.updateMarkupsControlPointsFromArray(
-            self.contour_points_markups[branch_idx],
-            np.array([elt for pts in self.contours_points[branch_idx] for elt in pts]),
+            branch.centerline_markup, branch.centerline
         )
+        self.update_contour_points_markup(branch)
 
     def update_visibility_button(self, column: TreeColumnRole):
         """
@@ -192,14 +482,22 @@ class GraphBranches:
 
         column: flag to indicate the column to be updated.
         """
-        markup_list, button = (
-            (self.centerline_markups, self.centerline_button)
+        visibilities, button = (
+            (
+                [
+                    markup.GetDisplayNode().GetVisibility()
+                    for markup in self.centerline_markups
+                ],
+                self.centerline_button,
+            )
             if column == TreeColumnRole.VISIBILITY_CENTER
-            else (self.contour_points_markups, self.contour_point_button)
+            else (
+                [self.is_contour_points_visible(branch) for branch in self.registry],
+                self.contour_point_button,
+            )
         )
         majority_visibility = not (
-            np.sum([markup.GetDisplayNode().GetVisibility() for markup in markup_list])
-            >= max(1, (len(markup_list) // 2))
+            np.sum(visibilities) >= max(1, (len(visibilities) // 2))
         )
         button.text = (
             button.text.replace("Hide", "Show")
@@ -207,9 +505,7 @@ class GraphBranches:
             else button.text.replace("Show", "Hide")
         )
 
-    def split_branch(
-        self, idx_branch: int, idx_cyl: int, parent_node: Union[str, None]
-    ):
+    def split_branch(self, branch_id: int, idx_cyl: int, parent_node: Union[str, None]):
         """
         Split a branch into two parts.
         Triggered when the user adds a new branch, and the closest cylinder to that branch
@@ -219,7 +515,7 @@ class GraphBranches:
         Parameters
         ----------
 
-        idx_branch: index of the branch splited.
+        branch_id: id of the branch splited.
         idx_cyl: index of the closest cylinder to the new branch created.
         parent_node: name of the parent of the branch splited, None if it is the root.
 
@@ -230,19 +526,21 @@ class GraphBranches:
 
         """
         # Modify old branch which became a parent
-        centerline = self.centerlines[idx_branch]
-        contour_points = self.contours_points[idx_branch]
-        centerline_radius = self.centerline_radius[idx_branch]
-        self.update_parent_branch(idx_branch, idx_cyl + 1)
+        branch = self.registry[branch_id]
+        centerline = branch.centerline
+        contour_points = branch.contour_points
+        centerline_radius = branch.centerline_radius
+        self.update_parent_branch(branch_id, idx_cyl + 1)
 
         # Update edges
-        self.nodes.append(centerline[idx_cyl])
-        old_end = self.edges[idx_branch][1]
-        self.edges[idx_branch] = (self.edges[idx_branch][0], len(self.nodes) - 1)
+        new_node = self.add_node(centerline[idx_cyl])
+        old_end = branch.edge[1]
+        branch.edge = (branch.edge[0], new_node)
+        self.write_journal("split", names=[branch.name], nodes=[new_node])
 
         # Create new branch from the old one but as a child
         self.create_new_branch(
-            (len(self.nodes) - 1, old_end),
+            (new_node, old_end),
             centerline[idx_cyl:],
             contour_points[idx_cyl:],
             centerline_radius[idx_cyl:],
@@ -250,13 +548,25 @@ class GraphBranches:
             True,
         )
 
-        return centerline[idx_cyl : idx_cyl + 1], centerline_radius[
-            idx_cyl : idx_cyl + 1
-        ], contour_points[idx_cyl : idx_cyl + 1]
+        return (
+            centerline[idx_cyl : idx_cyl + 1],
+            centerline_radius[idx_cyl : idx_cyl + 1],
+            contour_points[idx_cyl : idx_cyl + 1],
+        )
+
+    def release_memory_maps(self) -> None:
+        """
+        Copy in memory the contour points still memory mapped from a loaded tree, closing its files.
+        """
+        for branch in self.registry:
+            if branch.contour_points.is_memory_mapped:
+                branch.contour_points = branch.contour_points.copy()
 
     def save_networkX(self):
         """
         Save the graph created as a networkx .JSON and .pickle file if the user select a valid directory.
+
+        The tree is also saved in the binary tree format, in the graph_tree folder, which loads much faster.
         """
         dialog = qt.QFileDialog()
         folder_path = dialog.getExistingDirectory(None, "Choose a folder")
@@ -265,18 +575,20 @@ class GraphBranches:
         if not folder_path:
             return
 
-        # Create graph Network X with node = bifurcation and edges = branches
+        # Create graph Network X with node = bifurcation and edges = branches, numbered from 0
+        self.compact_nodes()
         branch_graph = nx.DiGraph()
 
-        for i, n in enumerate(self.nodes):
+        for i, n in self.nodes.items():
             branch_graph.add_node(i, pos=n)
-        for i, e in enumerate(self.edges):
+        branches = [self.registry.get(name) for name in self.tree_model.dfs()]
+        for branch in branches:
             branch_graph.add_edge(
-                e[0],
-                e[1],
-                name=self.names[i],
-                centerline=self.centerlines[i],
-                contour_points=self.contours_points[i],
+                branch.edge[0],
+                branch.edge[1],
+                name=branch.name,
+                centerline=branch.centerline,
+                contour_points=branch.contour_points.tolist(),
             )
 
         # save with pickle
@@ -299,6 +611,16 @@ class GraphBranches:
         with open(os.path.join(folder_path, "graph_tree.json"), "w") as outfile:
             json.dump(data_list, outfile, indent=4)
 
+        # save in the binary tree format, the branches of a loaded tree must not keep its files mapped
+        # as they may be replaced, which fails on Windows
+        self.release_memory_maps()
+        save_tree(
+            os.path.join(folder_path, "graph_tree"),
+            self.nodes,
+            branches,
+            [self.tree_model.parent(branch.name) for branch in branches],
+        )
+
         slicer.util.infoDisplay(
             f"The graph has been successfully exported to :\n{folder_path}",
             windowTitle="Success",
@@ -322,26 +644,29 @@ class GraphBranches:
         if msg.exec_() != qt.QMessageBox.Yes:
             return False
 
-        self.branch_list = []
-        self.nodes = []
-        self.edges = []
-        self.names = []
-        self.centerlines = []
-        self.contours_points = []
-        self.centerline_radius = []
-
-        for _ in CustomProgressBar(
-            iterable=range(len(self.centerline_markups)),
-            quantity_to_measure="branch deleted",
-            windowTitle="Clearing tree architecture...",
-            width=300,
-        ):
-            slicer.mrmlScene.RemoveNode(self.centerline_markups.pop())
-            slicer.mrmlScene.RemoveNode(self.contour_points_markups.pop())
-
-        self.tree_widget.clear()
-        self.update_visibility_button(TreeColumnRole.VISIBILITY_CENTER)
-        self.update_visibility_button(TreeColumnRole.VISIBILITY_CONTOUR)
+        with batch_scene_update(self.tree_widget):
+            branches = list(self.registry)
+            for branch in branches:
+                self.release_contour_points_markup(branch)
+            self.nodes = {}
+            self._next_node_id = 0
+            self.registry.clear()
+            if self.journal is not None:
+                self.journal.clear()
+            self.dirty_branches = set()
+            self.renamed_branches = {}
+
+            for branch in CustomProgressBar(
+                iterable=branches,
+                quantity_to_measure="branch deleted",
+                windowTitle="Clearing tree architecture...",
+                width=300,
+            ):
+                slicer.mrmlScene.RemoveNode(branch.centerline_markup)
+
+            self.tree_model.clear()
+            self.update_visibility_button(TreeColumnRole.VISIBILITY_CENTER)
+            self.update_visibility_button(TreeColumnRole.VISIBILITY_CONTOUR)
         return True
 
     def on_stop_interaction(self):
@@ -360,26 +685,18 @@ class GraphBranches:
         """
         self.current_tree_item = treeItem
         node_id = treeItem.nodeId
-        branch_id = self.names.index(node_id)
+        branch = self.registry.get(node_id)
         if column == TreeColumnRole.VISIBILITY_CENTER:
-            is_visible = (
-                self.centerline_markups[branch_id].GetDisplayNode().GetVisibility()
-            )
-            self.centerline_markups[branch_id].GetDisplayNode().SetVisibility(
-                not is_visible
-            )
+            is_visible = branch.centerline_markup.GetDisplayNode().GetVisibility()
+            branch.centerline_markup.GetDisplayNode().SetVisibility(not is_visible)
             self.tree_widget._branchDict[node_id].setIcon(
                 TreeColumnRole.VISIBILITY_CENTER,
                 Icons.visibleOff if is_visible else Icons.visibleOn,
             )
             self.update_visibility_button(column)
         elif column == TreeColumnRole.VISIBILITY_CONTOUR:
-            is_visible = (
-                self.contour_points_markups[branch_id].GetDisplayNode().GetVisibility()
-            )
-            self.contour_points_markups[branch_id].GetDisplayNode().SetVisibility(
-                not is_visible
-            )
+            is_visible = self.is_contour_points_visible(branch)
+            self.show_contour_points(branch, not is_visible)
             self.tree_widget._branchDict[node_id].setIcon(
                 TreeColumnRole.VISIBILITY_CONTOUR,
                 Icons.visibleOff if is_visible else Icons.visibleOn,
@@ -400,10 +717,16 @@ class GraphBranches:
         previous: previous name of the branch.
         new: new name of the branch.
         """
-        branch_id = self.names.index(previous)
-        self.names[branch_id] = new
-        self.centerline_markups[branch_id].SetName(new + "_centers")
-        self.contour_points_markups[branch_id].SetName(new + "_contours")
+        branch = self.registry.get(previous)
+        self.registry.rename(branch.branch_id, new)
+        self.renamed_branches[new] = self.renamed_branches.pop(previous, previous)
+        if previous in self.dirty_branches:
+            self.dirty_branches.remove(previous)
+            self.mark_dirty(new)
+        branch.centerline_markup.SetName(new + "_centers")
+        if branch.contour_points_markup is not None:
+            branch.contour_points_markup.SetName(new + "_contours")
+        self.write_journal("rename", renamed=(previous, new))
 
     def on_key_pressed(self, treeItem, key):
         """
@@ -437,14 +760,25 @@ class GraphBranches:
                 branch.setIcon(column, icon)
             self.update_visibility_button(column)
 
-        if column == TreeColumnRole.VISIBILITY_CENTER:
-            change_majority_visibility(
-                self.centerline_markups, column, self.centerline_button
-            )
-        elif column == TreeColumnRole.VISIBILITY_CONTOUR:
-            change_majority_visibility(
-                self.contour_points_markups, column, self.contour_point_button
-            )
+        with batch_scene_update(self.tree_widget):
+            if column == TreeColumnRole.VISIBILITY_CENTER:
+                change_majority_visibility(
+                    self.centerline_markups, column, self.centerline_button
+                )
+            elif column == TreeColumnRole.VISIBILITY_CONTOUR:
+                branches = list(self.registry)
+                majority_visibility = not (
+                    np.sum(
+                        [self.is_contour_points_visible(branch) for branch in branches]
+                    )
+                    >= max(1, (len(branches) // 2))
+                )
+                icon = Icons.visibleOn if majority_visibility else Icons.visibleOff
+                for branch in branches:
+                    self.show_contour_points(branch, majority_visibility)
+                for branch in self.tree_widget._branchDict.values():
+                    branch.setIcon(column, icon)
+                self.update_visibility_button(column)
 
     def on_node_clicked(self, caller, event):
         """
@@ -463,7 +797,7 @@ class GraphBranches:
             node_id = displayNode.GetActiveComponentIndex()
 
             branch_name = "_".join(caller.GetName().split("_")[:-1])
-            branch_id = self.names.index(branch_name)
+            branch_id = self.registry.id_of(branch_name)
             self.node_selected = (branch_id, node_id)
 
             tree_item = self.tree_widget.getTreeWidgetItem(branch_name)
@@ -480,7 +814,7 @@ class GraphBranches:
         treeItem: tree item in which the user wants to delete the end.
         """
         node_id = treeItem.nodeId
-        branch_id = self.names.index(node_id)
+        branch_id = self.registry.id_of(node_id)
         branch_selected, branch_node_id = self.node_selected
         if branch_id != branch_selected:
             msg = qt.QMessageBox()
@@ -491,30 +825,60 @@ class GraphBranches:
             return
 
         # Nothing to delete
-        if branch_node_id == len(self.centerlines[branch_id]) - 1:
+        branch = self.registry[branch_id]
+        if branch_node_id == len(branch.centerline) - 1:
             return
 
-        edges_node_id = self.edges[branch_id][1]
-        self.nodes[edges_node_id] = self.centerlines[branch_id][branch_node_id]
+        edges_node_id = branch.edge[1]
+        self.nodes[edges_node_id] = branch.centerline[branch_node_id]
         self.update_parent_branch(branch_id, branch_node_id + 1)
+        self.write_journal("trim", names=[branch.name], nodes=[edges_node_id])
+
+    def add_node(self, position: np.ndarray, node_id: Union[int, None] = None) -> int:
+        """
+        Add a node to the graph.
+
+        Parameters
+        ----------
+
+        position: position of the node.
+        node_id: id of the node, e.g. when loading a graph, a new id if None.
+
+        Returns
+        ----------
+
+        The id of the node, which does not change until the next compaction (see compact_nodes).
+        """
+        if node_id is None:
+            node_id = self._next_node_id
+        self.nodes[node_id] = position
+        self._next_node_id = max(self._next_node_id, node_id + 1)
+
+        return node_id
 
     def delete_node(self, index: int):
         """
-        Delete a node from the graph
+        Delete a node from the graph, the ids of the other nodes are unchanged.
 
         Parameters
         ----------
 
-        index: index of the node to be removed.
+        index: id of the node to be removed.
         """
-        self.nodes.pop(index)
-        for i in range(len(self.edges)):
-            n1, n2 = self.edges[i]
-            if n1 > index:
-                n1 -= 1
-            if n2 > index:
-                n2 -= 1
-            self.edges[i] = n1, n2
+        del self.nodes[index]
+
+    def compact_nodes(self):
+        """
+        Renumber the nodes from 0, in the order of their ids, so that the root stays node 0.
+        """
+        new_ids = {node_id: idx for idx, node_id in enumerate(sorted(self.nodes))}
+        self.nodes = {new_ids[node_id]: pos for node_id, pos in self.nodes.items()}
+        self._next_node_id = len(self.nodes)
+        for branch in self.registry:
+            branch.edge = new_ids[branch.edge[0]], new_ids[branch.edge[1]]
+
+        # The journaled node ids are outdated
+        self.compact_journal()
 
     def on_delete_item(self, treeItem, showPopupForNonLeaf=True):
         """
@@ -531,7 +895,7 @@ class GraphBranches:
         self.on_stop_interaction()
         node_id = treeItem.nodeId
 
-        if self.tree_widget.isRoot(node_id):
+        if self.tree_model.is_root(node_id):
             slicer.util.errorDisplay(
                 text="You can't delete the root", windowTitle="Error"
             )
@@ -539,7 +903,7 @@ class GraphBranches:
 
         children = [
             self.tree_widget.getTreeWidgetItem(n_id)
-            for n_id in self.tree_widget.getChildrenNodeId(node_id)
+            for n_id in self.tree_model.children(node_id)
         ]
 
         if len(children) != 0 and showPopupForNonLeaf:
@@ -553,29 +917,29 @@ class GraphBranches:
             if msg.exec_() != qt.QMessageBox.Yes:
                 return
 
-        for child in children:
-            self.on_delete_item(child, showPopupForNonLeaf=False)
+        with batch_scene_update(self.tree_widget):
+            for child in children:
+                self.on_delete_item(child, showPopupForNonLeaf=False)
 
-        branch_id = self.names.index(node_id)
-        self.delete_node(self.edges[branch_id][1])
+            branch = self.registry.remove(self.registry.id_of(node_id))
+            self.delete_node(branch.edge[1])
 
-        self.names.pop(branch_id)
-        self.branch_list.pop(branch_id)
-        self.centerlines.pop(branch_id)
-        self.contours_points.pop(branch_id)
-        self.centerline_radius.pop(branch_id)
-        slicer.mrmlScene.RemoveNode(self.centerline_markups.pop(branch_id))
-        slicer.mrmlScene.RemoveNode(self.contour_points_markups.pop(branch_id))
+            self.dirty_branches.discard(node_id)
+            self.renamed_branches.pop(node_id, None)
+            slicer.mrmlScene.RemoveNode(branch.centerline_markup)
+            self.release_contour_points_markup(branch)
 
-        self.edges.pop(branch_id)
-        parent_id = self.tree_widget.getParentNodeId(node_id)
-        self.tree_widget.removeNode(node_id)
+            parent_id = self.tree_model.parent(node_id)
+            self.tree_model.remove_node(node_id)
+            self.write_journal(
+                "delete", removed_names=[node_id], removed_nodes=[branch.edge[1]]
+            )
 
-        if self.current_tree_item == treeItem:
-            self.current_tree_item = None
+            if self.current_tree_item == treeItem:
+                self.current_tree_item = None
 
-        if showPopupForNonLeaf:
-            self.on_merge_only_child(parent_id)
+            if showPopupForNonLeaf:
+                self.on_merge_only_child(parent_id)
 
     def on_merge_only_child(self, branch_id: str):
         """
@@ -588,38 +952,34 @@ class GraphBranches:
         """
         if branch_id is None:
             return
-        child_list = self.tree_widget.getChildrenNodeId(branch_id)
+        child_list = self.tree_model.children(branch_id)
         if len(child_list) != 1:
             return
 
-        parent_idx = self.names.index(branch_id)
-        child_idx = self.names.index(child_list[0])
+        parent = self.registry.get(branch_id)
+        child = self.registry.get(child_list[0])
 
         # Modify parent branch to add child branch
-        self.centerlines[parent_idx] = np.vstack(
-            (self.centerlines[parent_idx], self.centerlines[child_idx][1:])
-        )
-        self.centerlines.pop(child_idx)
-        self.contours_points[parent_idx] += self.contours_points[child_idx][1:]
-        self.contours_points.pop(child_idx)
-        self.centerline_radius[parent_idx] += self.centerline_radius[child_idx][1:]
-        self.centerline_radius.pop(child_idx)
-        slicer.util.updateMarkupsControlPointsFromArray(
-            self.centerline_markups[parent_idx], self.centerlines[parent_idx]
-        )
+        parent.merge_child(child)
         slicer.util.updateMarkupsControlPointsFromArray(
-            self.contour_points_markups[parent_idx],
-            np.array([elt for pts in self.contours_points[parent_idx] for elt in pts]),
+            parent.centerline_markup, parent.centerline
         )
-        slicer.mrmlScene.RemoveNode(self.centerline_markups.pop(child_idx))
-        slicer.mrmlScene.RemoveNode(self.contour_points_markups.pop(child_idx))
-        self.branch_list[parent_idx] += self.branch_list[child_idx]
-        self.branch_list.pop(child_idx)
+        self.update_contour_points_markup(parent)
+        slicer.mrmlScene.RemoveNode(child.centerline_markup)
+        self.release_contour_points_markup(child)
 
         # Delete old child
-        self.delete_node(self.edges[child_idx][0])
-        self.edges[parent_idx] = self.edges[parent_idx][0], self.edges[child_idx][1]
-        self.edges.pop(child_idx)
-        self.names.pop(child_idx)
-
-        self.tree_widget.removeNode(child_list[0])
+        self.delete_node(child.edge[0])
+        parent.edge = parent.edge[0], child.edge[1]
+        self.registry.remove(child.branch_id)
+        self.dirty_branches.discard(child_list[0])
+        self.renamed_branches.pop(child_list[0], None)
+        self.mark_dirty(branch_id)
+
+        self.tree_model.remove_node(child_list[0])
+        self.write_journal(
+            "merge",
+            names=[branch_id],
+            removed_names=[child_list[0]],
+            removed_nodes=[child.edge[0]],
+        )
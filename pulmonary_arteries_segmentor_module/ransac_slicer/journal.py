@@ -0,0 +1,419 @@
+import json
+import os
+import pickle
+import shutil
+import struct
+import zlib
+from typing import Iterable, Union
+import numpy as np
+from .ragged import RaggedPoints
+from .tree_file import HEADER_NAME, TreeFile, save_tree
+
+
+# Each record is its payload length and CRC32, followed by the pickled payload
+RECORD_HEADER = struct.Struct("<II")
+JOURNAL_NAME = "journal.log"
+SNAPSHOT_NAME = "snapshot"
+SEQ_NAME = "seq.json"  # sequence number of the last record included in the snapshot
+LOCK_NAME = "journal.lock"  # locked by the instance using the journal, released when it exits or crashes
+
+
+def _try_lock(f) -> bool:
+    """
+    Lock an open file without waiting, the lock is released by the system when the process ends.
+    """
+    try:
+        if os.name == "nt":
+            import msvcrt
+
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+        else:
+            import fcntl
+
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        return False
+    return True
+
+
+def _branch_data(branch) -> dict:
+    """
+    Arrays of a branch (see Branch) written in a record.
+    """
+    contour_points = RaggedPoints.from_lists(branch.contour_points)
+    return {
+        "edge": (int(branch.edge[0]), int(branch.edge[1])),
+        "centerline": np.array(branch.centerline, dtype=np.float64),
+        "contour_points": (
+            np.array(contour_points.flat),
+            contour_points.offsets - contour_points.offsets[0],
+        ),
+        "centerline_radius": np.array(branch.centerline_radius, dtype=np.float64),
+    }
+
+
+class JournalState:
+    """
+    Vessel tree rebuilt from a snapshot and the records appended after it, see Journal.replay.
+    """
+
+    def __init__(self) -> None:
+        self.nodes = {}  # node id -> position
+        self.branches = {}  # branch name -> edge, centerline, contour points and radius, in creation order
+        self.parents = {}  # branch name -> name of its parent, None for the root
+
+    def __len__(self) -> int:
+        return len(self.branches)
+
+    def apply(self, record: dict) -> None:
+        """
+        Apply the changes of a record.
+        """
+        if record.get("renamed") is not None:
+            previous, new = record["renamed"]
+            self.branches = {
+                (new if name == previous else name): data
+                for name, data in self.branches.items()
+            }
+            self.parents = {
+                (new if name == previous else name): (
+                    new if parent == previous else parent
+                )
+                for name, parent in self.parents.items()
+            }
+        for name in record["removed_branches"]:
+            self.branches.pop(name, None)
+            self.parents.pop(name, None)
+        for node_id in record["removed_nodes"]:
+            self.nodes.pop(node_id, None)
+        self.branches.update(record["branches"])
+        self.parents.update(record["parents"])
+        self.nodes.update(record["nodes"])
+
+    def branch_arrays(self, name: str) -> tuple[np.ndarray, RaggedPoints, list[float]]:
+        """
+        Centerline, contour points and radius of a branch.
+        """
+        data = self.branches[name]
+        return (
+            data["centerline"],
+            RaggedPoints(*data["contour_points"]),
+            data["centerline_radius"].tolist(),
+        )
+
+    def tree_order(self) -> list[tuple[str, Union[str, None]]]:
+        """
+        Name and parent name of each branch, each branch coming after its parent.
+        """
+        children = {}
+        for name in self.branches:
+            children.setdefault(self.parents.get(name), []).append(name)
+
+        order = []
+        stack = list(reversed(children.get(None, [])))
+        while stack:
+            name = stack.pop()
+            order.append((name, self.parents.get(name)))
+            stack.extend(reversed(children.get(name, [])))
+
+        return order
+
+
+class Journal:
+    """
+    Append-only journal of the changes of the vessel tree, to restore the tree after a crash.
+
+    Every structural operation appends a small record with the branches and nodes it changed, written and
+    synced to the disk at once. Once enough records are appended, the whole tree is compacted into a snapshot
+    in the binary tree format (see save_tree) and the journal starts again. A record cut by a crash is ignored.
+
+    The folder is locked while the journal is open, so that several instances of Slicer do not write in the same
+    journal, see for_instance.
+    """
+
+    def __init__(self, folder_path: str, compaction_interval: int = 100) -> None:
+        """
+        Parameters
+        ----------
+
+        folder_path: folder holding the journal and the snapshot, created if needed.
+        compaction_interval: number of records appended before compacting the journal into a snapshot.
+
+        Raises
+        ----------
+
+        RuntimeError if the journal is used by another instance.
+        """
+        os.makedirs(folder_path, exist_ok=True)
+        self._lock_file = open(os.path.join(folder_path, LOCK_NAME), "a+b")
+        if not _try_lock(self._lock_file):
+            self._lock_file.close()
+            self._lock_file = None
+            raise RuntimeError(f"The journal {folder_path} is used by another instance")
+
+        self.folder_path = folder_path
+        self.journal_path = os.path.join(folder_path, JOURNAL_NAME)
+        self.snapshot_path = os.path.join(folder_path, SNAPSHOT_NAME)
+        self.compaction_interval = compaction_interval
+
+        self.seq = self._snapshot_seq()
+        self.records_since_snapshot = 0
+        self._file = None
+
+    @classmethod
+    def for_instance(
+        cls, folder_path: str, compaction_interval: int = 100, max_instances: int = 16
+    ) -> "Journal":
+        """
+        Open the first journal not used by another instance, in folder_path, folder_path_1, folder_path_2 etc...
+
+        The journal of an instance which crashed is not locked anymore, so it is restored by the next instance.
+
+        Parameters
+        ----------
+
+        folder_path: folder of the journal of the first instance.
+        compaction_interval: see Journal.
+        max_instances: number of instances which can use a journal at the same time.
+
+        Raises
+        ----------
+
+        RuntimeError if every journal is used.
+        """
+        for idx in range(max_instances):
+            try:
+                return cls(
+                    folder_path if idx == 0 else f"{folder_path}_{idx}",
+                    compaction_interval,
+                )
+            except RuntimeError:
+                continue
+        raise RuntimeError(f"The {max_instances} journals are used")
+
+    def _snapshot_seq(self) -> int:
+        """
+        Sequence number of the last record included in the snapshot, 0 if there is no snapshot.
+        """
+        self._recover_snapshot()
+        seq_path = os.path.join(self.snapshot_path, SEQ_NAME)
+        if not os.path.isfile(seq_path):
+            return 0
+        with open(seq_path) as f:
+            return json.load(f)["seq"]
+
+    def _recover_snapshot(self) -> None:
+        """
+        Restore the former snapshot if a crash happened while it was being replaced.
+        """
+        old_path = self.snapshot_path + ".old"
+        if not os.path.isdir(self.snapshot_path) and os.path.isdir(old_path):
+            os.rename(old_path, self.snapshot_path)
+
+    def is_empty(self) -> bool:
+        """
+        Check if there is nothing to replay.
+        """
+        has_records = (
+            os.path.isfile(self.journal_path) and os.path.getsize(self.journal_path) > 0
+        )
+        return not has_records and not os.path.isdir(self.snapshot_path)
+
+    def append(
+        self,
+        kind: str,
+        branches: Iterable = (),
+        parents: Union[dict, None] = None,
+        nodes: Union[dict, None] = None,
+        removed_branches: Iterable[str] = (),
+        removed_nodes: Iterable[int] = (),
+        renamed: Union[tuple[str, str], None] = None,
+    ) -> bool:
+        """
+        Append a record to the journal.
+
+        Parameters
+        ----------
+
+        kind: kind of operation, e.g. create, split, merge, trim, delete or rename.
+        branches: branches created or modified, see Branch.
+        parents: name of the parent of each branch whose parent changed.
+        nodes: position of each node created or moved, by node id.
+        removed_branches: names of the branches deleted.
+        removed_nodes: ids of the nodes deleted.
+        renamed: previous and new name of a renamed branch, applied before the other changes.
+
+        Returns
+        ----------
+
+        True if the journal should be compacted, see compact.
+        """
+        self.seq += 1
+        record = {
+            "seq": self.seq,
+            "kind": kind,
+            "branches": {branch.name: _branch_data(branch) for branch in branches},
+            "parents": {} if parents is None else dict(parents),
+            "nodes": {
+                int(node_id): np.array(position, dtype=np.float64)
+                for node_id, position in ({} if nodes is None else nodes).items()
+            },
+            "removed_branches": list(removed_branches),
+            "removed_nodes": [int(node_id) for node_id in removed_nodes],
+            "renamed": renamed,
+        }
+        payload = pickle.dumps(record, pickle.HIGHEST_PROTOCOL)
+
+        if self._file is None:
+            self._file = open(self.journal_path, "ab")
+        self._file.write(RECORD_HEADER.pack(len(payload), zlib.crc32(payload)))
+        self._file.write(payload)
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+        self.records_since_snapshot += 1
+        return self.records_since_snapshot >= self.compaction_interval
+
+    def _read_records(self) -> list[dict]:
+        """
+        Read the records of the journal, up to the first incomplete or corrupted one.
+        """
+        if not os.path.isfile(self.journal_path):
+            return []
+
+        with open(self.journal_path, "rb") as f:
+            content = f.read()
+
+        records = []
+        position = 0
+        while position + RECORD_HEADER.size <= len(content):
+            length, crc = RECORD_HEADER.unpack_from(content, position)
+            start = position + RECORD_HEADER.size
+            payload = content[start : start + length]
+            if len(payload) != length or zlib.crc32(payload) != crc:
+                break
+            records.append(pickle.loads(payload))
+            position = start + length
+
+        return records
+
+    def replay(self) -> JournalState:
+        """
+        Rebuild the tree from the snapshot and the records appended after it.
+
+        Returns
+        ----------
+
+        The tree of the last record written.
+        """
+        self.close()
+        self.seq = self._snapshot_seq()
+        state = JournalState()
+
+        header_path = os.path.join(self.snapshot_path, HEADER_NAME)
+        if os.path.isfile(header_path):
+            # The arrays are copied, the snapshot being replaced by the next compaction
+            tree_file = TreeFile(header_path)
+            state.nodes = dict(tree_file.nodes)
+            for idx, name in enumerate(tree_file.names):
+                contour_points = tree_file.contour_points(idx)
+                state.branches[name] = {
+                    "edge": tree_file.edges[idx],
+                    "centerline": np.array(tree_file.centerline(idx)),
+                    "contour_points": (
+                        np.array(contour_points.flat),
+                        contour_points.offsets - contour_points.offsets[0],
+                    ),
+                    "centerline_radius": np.array(tree_file.centerline_radius(idx)),
+                }
+                state.parents[name] = tree_file.parents[idx]
+            del tree_file
+
+        records = [
+            record for record in self._read_records() if record["seq"] > self.seq
+        ]
+        for record in records:
+            state.apply(record)
+            self.seq = record["seq"]
+        self.records_since_snapshot = len(records)
+
+        # Drop a record cut by a crash, the next records are appended after the valid ones
+        self._rewrite_journal(records)
+
+        return state
+
+    def _rewrite_journal(self, records: list[dict]) -> None:
+        """
+        Replace the journal by the given records.
+        """
+        with open(self.journal_path + ".tmp", "wb") as f:
+            for record in records:
+                payload = pickle.dumps(record, pickle.HIGHEST_PROTOCOL)
+                f.write(RECORD_HEADER.pack(len(payload), zlib.crc32(payload)))
+                f.write(payload)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(self.journal_path + ".tmp", self.journal_path)
+
+    def compact(
+        self, nodes: dict, branches: list, parents: list[Union[str, None]]
+    ) -> None:
+        """
+        Save the whole tree as the new snapshot and empty the journal.
+
+        Parameters
+        ----------
+
+        nodes: position of each node of the graph, by node id.
+        branches: branches of the tree, each one coming after its parent, see save_tree.
+        parents: name of the parent of each branch, None for the root.
+        """
+        self.close()
+
+        # The new snapshot is written aside, so that a crash keeps the former one
+        new_path = self.snapshot_path + ".new"
+        old_path = self.snapshot_path + ".old"
+        shutil.rmtree(new_path, ignore_errors=True)
+        save_tree(new_path, nodes, branches, parents)
+        with open(os.path.join(new_path, SEQ_NAME), "w") as f:
+            json.dump({"seq": self.seq}, f)
+
+        shutil.rmtree(old_path, ignore_errors=True)
+        if os.path.isdir(self.snapshot_path):
+            os.rename(self.snapshot_path, old_path)
+        os.rename(new_path, self.snapshot_path)
+        shutil.rmtree(old_path, ignore_errors=True)
+
+        # The records are included in the snapshot, they would be skipped anyway if a crash happens here
+        self._rewrite_journal([])
+        self.records_since_snapshot = 0
+
+    def clear(self) -> None:
+        """
+        Forget the whole tree, e.g. when the tree is cleared.
+        """
+        self.close()
+        shutil.rmtree(self.snapshot_path, ignore_errors=True)
+        shutil.rmtree(self.snapshot_path + ".old", ignore_errors=True)
+        if os.path.isfile(self.journal_path):
+            os.remove(self.journal_path)
+        self.seq = 0
+        self.records_since_snapshot = 0
+
+    def close(self) -> None:
+        """
+        Close the journal file, it is opened again by the next append.
+        """
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def release(self) -> None:
+        """
+        Close the journal and unlock its folder, the journal can not be used anymore.
+        """
+        self.close()
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
@@ -0,0 +1,170 @@
+from typing import Iterable, Iterator, Union
+import mmap
+import numpy as np
+
+
+class RaggedPoints:
+    """
+    Groups of 3D points of various sizes, e.g. the contour points of each point of a centerline.
+
+    The points are stored in a single flat float32 (N, 3) buffer, group i being
+    data[offsets[i] : offsets[i + 1]]. Slicing the groups does not copy the points.
+    """
+
+    def __init__(self, data: np.ndarray, offsets: np.ndarray) -> None:
+        """
+        Parameters
+        ----------
+
+        data: points of every group, as a (N, 3) array.
+        offsets: start of each group in data, followed by N.
+        """
+        self.data = np.asarray(data, dtype=np.float32).reshape((-1, 3))
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+
+    @classmethod
+    def from_lists(cls, groups: Iterable) -> "RaggedPoints":
+        """
+        Build ragged points from nested lists or arrays of points.
+
+        Parameters
+        ----------
+
+        groups: points of each group, each one as a list or an array of shape (k, 3).
+
+        Returns
+        ----------
+
+        The ragged points, groups being returned unchanged if they are already ragged points.
+        """
+        if isinstance(groups, RaggedPoints):
+            return groups
+
+        groups = [
+            np.asarray(group, dtype=np.float32).reshape((-1, 3)) for group in groups
+        ]
+        offsets = np.zeros(len(groups) + 1, dtype=np.int64)
+        np.cumsum([group.shape[0] for group in groups], out=offsets[1:])
+
+        return cls(
+            np.concatenate(groups) if len(groups) != 0 else np.zeros((0, 3)), offsets
+        )
+
+    @classmethod
+    def concatenate(cls, parts: list["RaggedPoints"]) -> "RaggedPoints":
+        """
+        Concatenate the groups of several ragged points.
+        """
+        parts = [cls.from_lists(part) for part in parts]
+        offsets = [np.zeros(1, dtype=np.int64)]
+        start = 0
+        for part in parts:
+            offsets.append(part.offsets[1:] - part.offsets[0] + start)
+            start += part.offsets[-1] - part.offsets[0]
+
+        return cls(
+            np.concatenate([part.flat for part in parts])
+            if len(parts) != 0
+            else np.zeros((0, 3)),
+            np.concatenate(offsets),
+        )
+
+    def __len__(self) -> int:
+        return self.offsets.shape[0] - 1
+
+    def __getitem__(
+        self, index: Union[int, slice]
+    ) -> Union[np.ndarray, "RaggedPoints"]:
+        """
+        Group at an index, or ragged points of the groups in a slice (without step), sharing the same buffer.
+        """
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step != 1:
+                raise ValueError("Ragged points can only be sliced with a step of 1")
+            stop = max(start, stop)
+            return RaggedPoints(
+                self.data[self.offsets[start] : self.offsets[stop]],
+                self.offsets[start : stop + 1] - self.offsets[start],
+            )
+
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("Ragged points index out of range")
+
+        return self.data[self.offsets[index] : self.offsets[index + 1]]
+
+    def __iter__(self) -> Iterator[np.ndarray]:
+        for start, end in zip(self.offsets[:-1], self.offsets[1:]):
+            yield self.data[start:end]
+
+    def __add__(self, other: "RaggedPoints") -> "RaggedPoints":
+        return RaggedPoints.concatenate([self, other])
+
+    @property
+    def flat(self) -> np.ndarray:
+        """
+        Points of all the groups, as a (N, 3) array, e.g. to fill a markup.
+        """
+        return self.data[self.offsets[0] : self.offsets[-1]]
+
+    @property
+    def counts(self) -> np.ndarray:
+        """
+        Number of points of each group.
+        """
+        return np.diff(self.offsets)
+
+    @property
+    def is_memory_mapped(self) -> bool:
+        """
+        Whether the points are read from a memory mapped file, e.g. a tree loaded with TreeFile.
+        """
+        base = self.data
+        while base is not None:
+            if isinstance(base, (np.memmap, mmap.mmap)):
+                return True
+            base = getattr(base, "base", None)
+        return False
+
+    def copy(self) -> "RaggedPoints":
+        """
+        Ragged points of the same groups, with the points copied in memory.
+        """
+        return RaggedPoints(np.array(self.flat), self.offsets - self.offsets[0])
+
+    def min_distances(self, centers: np.ndarray) -> np.ndarray:
+        """
+        Compute the distance between each center and the closest point of its group.
+
+        Parameters
+        ----------
+
+        centers: one point per group, as a (len, 3) array.
+
+        Returns
+        ----------
+
+        The distance of each group, inf for the empty groups.
+        """
+        centers = np.asarray(centers, dtype=np.float64).reshape((-1, 3))
+        counts = self.counts
+        distances = np.full(len(self), np.inf)
+
+        filled = counts > 0
+        if filled.any():
+            norms = np.linalg.norm(
+                self.flat - np.repeat(centers, counts, axis=0), axis=1
+            )
+            distances[filled] = np.minimum.reduceat(
+                norms, (self.offsets[:-1] - self.offsets[0])[filled]
+            )
+
+        return distances
+
+    def tolist(self) -> list[list[list[float]]]:
+        """
+        Nested lists of the points of each group, e.g. to export them as JSON.
+        """
+        return [group.tolist() for group in self]
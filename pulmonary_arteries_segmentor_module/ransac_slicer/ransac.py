@@ -1,5 +1,6 @@
 #!/usr/bin/env python-real
 from .volume import volume
+from .vesselness import vesselness_map
 from .popup_utils import CustomProgressBar, CustomStatusDialog
 from .cylinder_ransac import (
     sample_around_cylinder,
@@ -8,6 +9,7 @@ from .cylinder_ransac import (
 )
 
 from .cylinder import cylinder, closest_branch
+from .ragged import RaggedPoints
 import numpy as np
 from ransac_slicer.graph_branches import GraphBranches
 import qt
@@ -77,7 +79,7 @@ def interpolate_centerline(
     vol: volume,
     cfg: config,
     distance: float,
-) -> tuple[list[np.ndarray], list[list[np.ndarray]], list[float]]:
+) -> tuple[np.ndarray, RaggedPoints, list[float]]:
     """
     Refine the points of a centerline according to a certain minimum distance between points.
 
@@ -95,8 +97,8 @@ def interpolate_centerline(
     list[np.ndarray]
     A list of center points.
 
-    list[list[np.ndarray]]
-    A list of contours points, each center point has its list of contours.
+    RaggedPoints
+    The contours points, each center point has its group of contours.
 
     list[float]
     A list of underestimated radius, each center point has an underestimated radius.
@@ -121,13 +123,13 @@ def interpolate_centerline(
         new_centerline.extend(tmp_centerline)
         new_contour.extend(tmp_contour_points)
 
+    new_centerline = np.array(new_centerline)
+    new_contour = RaggedPoints.from_lists(new_contour)
+
     return (
-        np.array(new_centerline),
+        new_centerline,
         new_contour,
-        [
-            np.linalg.norm(cp - c, axis=1).min()
-            for cp, c in zip(new_contour, new_centerline)
-        ],
+        new_contour.min_distances(new_centerline).tolist(),
     )
 
 
@@ -142,6 +144,7 @@ def run_ransac(
     graph_branches: GraphBranches,
     isNewBranch: float,
     progress_dialog: CustomStatusDialog,
+    vesselness: vesselness_map = None,
 ) -> GraphBranches:
     """
     Run the RANSAC algorithm to fit a cylinder according to the parameters indicated by the user.
@@ -161,6 +164,7 @@ def run_ransac(
     graph_branches: the graph branch object.
     isNewBranch: flag to tell if it is the first branch or not.
     progress_dialog: UI window to inform the user on the state of the branch tracking.
+    vesselness: optional vesselness map used as a prior for the tracking.
 
     Returns
     ----------
@@ -173,25 +177,26 @@ def run_ransac(
         _, _, idx_cb, idx_cyl = closest_branch(
             starting_point, graph_branches.branch_list
         )
-        if idx_cyl == len(graph_branches.centerlines[idx_cb]) - 2:
-            idx_cyl = len(graph_branches.centerlines[idx_cb]) - 1
+        branch = graph_branches.registry[graph_branches.registry.ids()[idx_cb]]
+        if idx_cyl == len(branch.centerline) - 2:
+            idx_cyl = len(branch.centerline) - 1
 
         # Update Graph
-        parent_node = graph_branches.names[idx_cb]
+        parent_node = branch.name
         # Case when the closest node is the last point of a branch, we concatenate the two branches
-        if idx_cyl == len(graph_branches.centerlines[idx_cb]) - 1:
+        if idx_cyl == len(branch.centerline) - 1:
             end_centerline, end_center_radius, end_contour_point = (
-                graph_branches.centerlines[idx_cb][idx_cyl : idx_cyl + 1],
-                graph_branches.centerline_radius[idx_cb][idx_cyl : idx_cyl + 1],
-                graph_branches.contours_points[idx_cb][idx_cyl : idx_cyl + 1],
+                branch.centerline[idx_cyl : idx_cyl + 1],
+                branch.centerline_radius[idx_cyl : idx_cyl + 1],
+                branch.contour_points[idx_cyl : idx_cyl + 1],
             )
         # Case when the closest node is the first point of a branch, we had the branch to the parent of the closest branch, thus the branch way have more than 2 childs
         elif idx_cyl == 0:
-            parent_node = graph_branches.tree_widget.getParentNodeId(parent_node)
+            parent_node = graph_branches.tree_model.parent(parent_node)
             end_centerline, end_center_radius, end_contour_point = (
-                graph_branches.centerlines[idx_cb][:1],
-                graph_branches.centerline_radius[idx_cb][:1],
-                graph_branches.contours_points[idx_cb][:1],
+                branch.centerline[:1],
+                branch.centerline_radius[:1],
+                branch.contour_points[:1],
             )
         # Case when the closest node is in the middle of a branch, we split the branch at the intersection point
         else:
@@ -199,10 +204,10 @@ def run_ransac(
                 end_centerline,
                 end_center_radius,
                 end_contour_point,
-            ) = graph_branches.split_branch(idx_cb, idx_cyl, parent_node)
+            ) = graph_branches.split_branch(branch.branch_id, idx_cyl, parent_node)
     else:
         parent_node = None
-        graph_branches.nodes.append(starting_point)
+        start_node = graph_branches.add_node(starting_point)
         end_centerline = np.empty((0, 3))
         end_center_radius = []
         end_contour_point = []
@@ -214,7 +219,7 @@ def run_ransac(
     # Tracking configuration
     pct_inl = percent_inlier_points / 100.0
     err = threshold / 100.0
-    cfg = config(percent_inliers=pct_inl, threshold=err)
+    cfg = config(percent_inliers=pct_inl, threshold=err, vesselness=vesselness)
 
     # Initialize tracking
     cyl = cylinder(starting_point, init_radius, direction_point, height=0)
@@ -261,14 +266,12 @@ def run_ransac(
     )
     del cylinders
 
-    graph_branches.nodes.append(centerline[-1])
+    end_node = graph_branches.add_node(centerline[-1])
     edge_begin = (
-        graph_branches.edges[graph_branches.names.index(parent_node)][1]
-        if isNewBranch
-        else len(graph_branches.nodes) - 2
+        graph_branches.registry.get(parent_node).edge[1] if isNewBranch else start_node
     )
     graph_branches.create_new_branch(
-        (edge_begin, len(graph_branches.nodes) - 1),
+        (edge_begin, end_node),
         centerline,
         contour_points,
         centerline_radius,
@@ -0,0 +1,1258 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from scipy.ndimage import distance_transform_edt
+
+# Number of segments checked on each side of the closest centerline sample of a voxel by the distance
+# transform engine, to cover the rounding of the samples to their seed voxel
+NEIGHBOUR_SEGMENTS = 4
+
+
+def stack_centerlines(
+    arrays: list[np.ndarray], width: int = None
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Stack per branch arrays (centerline points, radius, ...) into a single contiguous array.
+
+    Parameters
+    ----------
+
+    arrays: array of each branch.
+    width: number of columns of the arrays (e.g. 3 for points), 1D arrays if None.
+
+    Returns
+    ----------
+
+    The stacked array, and the offsets of the branches: branch b is stacked[offsets[b] : offsets[b + 1]].
+    """
+    shape = (-1,) if width is None else (-1, width)
+    arrays = [np.asarray(array, dtype=np.float64).reshape(shape) for array in arrays]
+
+    offsets = np.zeros(len(arrays) + 1, dtype=int)
+    np.cumsum([array.shape[0] for array in arrays], out=offsets[1:])
+
+    if len(arrays) == 0:
+        return np.zeros((0,) if width is None else (0, width)), offsets
+
+    return np.concatenate(arrays), offsets
+
+
+def split_centerlines(stacked: np.ndarray, offsets: np.ndarray) -> list[np.ndarray]:
+    """
+    Split a stacked array back into the views of each branch (see stack_centerlines).
+    """
+    return [stacked[start:end] for start, end in zip(offsets[:-1], offsets[1:])]
+
+
+def adapt_radius(
+    radius: np.ndarray, reduction_threshold: float, reduction_factor: float
+) -> np.ndarray:
+    """
+    Reduce the growth of big vessels radius to limit the leaking when creating
+    segmentation zones.
+
+    Parameters
+    ----------
+
+    radius: a sphere radius, or an array of radius.
+    reduction_threshold: threshold from which a reduction is applied to the radius.
+    reduction_factor: amount of the reduction.
+
+    Returns
+    ----------
+
+    Newly adapted radius.
+    """
+
+    return np.where(
+        radius <= reduction_threshold,
+        radius,
+        (radius - reduction_threshold) * reduction_factor + reduction_threshold,
+    )
+
+
+def adapt_tree_radius(
+    radius: list[np.ndarray], reduction_threshold: float, reduction_factor: float
+) -> list[np.ndarray]:
+    """
+    Apply adapt_radius to the radius of every centerline point, all branches at once.
+
+    Parameters
+    ----------
+
+    radius: radius of each centerline point.
+    reduction_threshold: threshold from which a reduction is applied to the radius.
+    reduction_factor: amount of the reduction.
+
+    Returns
+    ----------
+
+    Adapted radius of each centerline point.
+    """
+    stacked, offsets = stack_centerlines(radius)
+
+    return split_centerlines(
+        adapt_radius(stacked, reduction_threshold, reduction_factor), offsets
+    )
+
+
+def label_dtype(max_label: int) -> np.dtype:
+    """
+    Choose the smallest unsigned integer type holding the labels up to max_label.
+
+    Parameters
+    ----------
+
+    max_label: highest label to store.
+
+    Returns
+    ----------
+
+    np.uint8, np.uint16 or np.uint32.
+    """
+    for dtype in (np.uint8, np.uint16):
+        if max_label <= np.iinfo(dtype).max:
+            return dtype
+
+    return np.uint32
+
+
+def voxel_spacing(ijk_to_ras: np.ndarray) -> np.ndarray:
+    """
+    Compute the voxel spacing of a volume from its IJK to RAS matrix.
+
+    Parameters
+    ----------
+
+    ijk_to_ras: 4x4 homogeneous matrix from IJK to RAS coordinates.
+
+    Returns
+    ----------
+
+    Voxel spacing, in millimeters, in numpy order (k, j, i).
+    """
+    return np.linalg.norm(np.asarray(ijk_to_ras, dtype=np.float64)[:3, :3], axis=0)[
+        ::-1
+    ]
+
+
+def ras_to_voxel(
+    centerlines: list[np.ndarray], ras_to_ijk: np.ndarray
+) -> list[np.ndarray]:
+    """
+    Transform centerlines from RAS coordinates (real world coordinates) into voxel coordinates.
+
+    Parameters
+    ----------
+
+    centerlines: centerline points, as Nx3 arrays of RAS coordinates.
+    ras_to_ijk: 4x4 homogeneous matrix from RAS to IJK coordinates.
+
+    Returns
+    ----------
+
+    Centerline points, as Nx3 arrays of voxel coordinates in numpy order (k, j, i).
+    """
+    ras_to_ijk = np.asarray(ras_to_ijk, dtype=np.float64)
+    points, offsets = stack_centerlines(centerlines, 3)
+
+    # A single matrix product for all the points, in numpy order
+    points = points @ ras_to_ijk[2::-1, :3].T + ras_to_ijk[2::-1, 3]
+
+    return split_centerlines(points, offsets)
+
+
+def capsule_bbox(
+    p0: np.ndarray,
+    p1: np.ndarray,
+    r0: float,
+    r1: float,
+    spacing: np.ndarray,
+    dimensions: np.ndarray,
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Compute the bounding box of a tapered capsule, clipped to the volume bounds.
+
+    Parameters
+    ----------
+
+    p0: first end of the capsule axis, in voxel coordinates.
+    p1: second end of the capsule axis, in voxel coordinates.
+    r0: radius at p0, in millimeters.
+    r1: radius at p1, in millimeters.
+    spacing: voxel spacing, in millimeters, in the same axis order as the points.
+    dimensions: volume dimensions.
+
+    Returns
+    ----------
+
+    lower_edge (included), higher_edge (excluded) the corners of the bounding box.
+    """
+    radius = max(r0, r1) / spacing
+
+    lower_edge = np.maximum(np.floor(np.minimum(p0, p1) - radius).astype(int), 0)
+    higher_edge = np.minimum(
+        np.ceil(np.maximum(p0, p1) + radius).astype(int) + 1, dimensions
+    )
+
+    return lower_edge, higher_edge
+
+
+def capsule_map(
+    lower_edge: np.ndarray,
+    higher_edge: np.ndarray,
+    p0: np.ndarray,
+    p1: np.ndarray,
+    r0: float,
+    r1: float,
+    spacing: np.ndarray,
+) -> np.ndarray:
+    """
+    Rasterize a tapered capsule inside a bounding box.
+
+    A voxel is inside the capsule if its distance to the segment [p0, p1] is lower than the radius
+    linearly interpolated at its projection on the segment. Distances are computed in millimeters,
+    so that anisotropic voxels are handled. A zero-length segment gives a sphere.
+
+    Parameters
+    ----------
+
+    lower_edge: lower corner of the bounding box (included).
+    higher_edge: higher corner of the bounding box (excluded).
+    p0: first end of the capsule axis, in voxel coordinates.
+    p1: second end of the capsule axis, in voxel coordinates.
+    r0: radius at p0, in millimeters.
+    r1: radius at p1, in millimeters.
+    spacing: voxel spacing, in millimeters, in the same axis order as the points.
+
+    Returns
+    ----------
+
+    Boolean map of the bounding box, True inside the capsule.
+    """
+    x, y, z = np.ogrid[
+        lower_edge[0] : higher_edge[0],
+        lower_edge[1] : higher_edge[1],
+        lower_edge[2] : higher_edge[2],
+    ]
+
+    # Offsets to p0 and segment vector, in millimeters
+    dx = (x - p0[0]) * spacing[0]
+    dy = (y - p0[1]) * spacing[1]
+    dz = (z - p0[2]) * spacing[2]
+    d = (np.asarray(p1) - p0) * spacing
+    length_sqr = d @ d
+
+    # Position of the voxel projection on the segment, in [0, 1]
+    if length_sqr > 0:
+        t = np.clip((dx * d[0] + dy * d[1] + dz * d[2]) / length_sqr, 0, 1)
+    else:
+        t = np.zeros((1, 1, 1))
+
+    distance_sqr = (dx - t * d[0]) ** 2 + (dy - t * d[1]) ** 2 + (dz - t * d[2]) ** 2
+    radius = r0 + t * (r1 - r0)
+
+    return distance_sqr <= radius**2
+
+
+def paint_capsules(
+    target: np.ndarray,
+    points: np.ndarray,
+    radius: np.ndarray,
+    spacing: np.ndarray,
+    value=True,
+    capsule_mask: np.ndarray = None,
+) -> None:
+    """
+    Paint in place the tapered capsules joining consecutive points of a centerline.
+
+    The voxel closest to each point is also painted, so that vessels thinner than a voxel
+    are not lost. Capsules are clipped to the target, which can hence be a view on a region of a
+    larger volume, the points being expressed relatively to this region.
+
+    Parameters
+    ----------
+
+    target: volume to paint.
+    points: centerline points, as a Nx3 array of voxel coordinates.
+    radius: radius of each centerline point, in millimeters.
+    spacing: voxel spacing, in millimeters, in the same axis order as the points.
+    value: value to paint.
+    capsule_mask: capsules to paint, as a boolean array of length N - 1 (length 1 for a single point).
+    Every capsule is painted if None.
+    """
+    points = np.asarray(points, dtype=np.float64).reshape((-1, 3))
+    radius = np.asarray(radius, dtype=np.float64)
+    dimensions = np.array(target.shape)
+
+    if points.shape[0] == 0:
+        return
+
+    # A single point is painted as a sphere
+    if points.shape[0] == 1:
+        starts, ends = np.array([0]), np.array([0])
+    else:
+        starts, ends = np.arange(points.shape[0] - 1), np.arange(1, points.shape[0])
+
+    if capsule_mask is not None:
+        starts, ends = starts[capsule_mask], ends[capsule_mask]
+
+    for a, b in zip(starts, ends):
+        lower_edge, higher_edge = capsule_bbox(
+            points[a], points[b], radius[a], radius[b], spacing, dimensions
+        )
+        if np.any(higher_edge <= lower_edge):
+            continue
+
+        target[
+            lower_edge[0] : higher_edge[0],
+            lower_edge[1] : higher_edge[1],
+            lower_edge[2] : higher_edge[2],
+        ][
+            capsule_map(
+                lower_edge,
+                higher_edge,
+                points[a],
+                points[b],
+                radius[a],
+                radius[b],
+                spacing,
+            )
+        ] = value
+
+    closest_voxels = np.rint(points).astype(int)
+    closest_voxels = closest_voxels[
+        np.all((closest_voxels >= 0) & (closest_voxels < dimensions), axis=1)
+    ]
+    target[closest_voxels[:, 0], closest_voxels[:, 1], closest_voxels[:, 2]] = value
+
+
+def sample_centerline(
+    points: np.ndarray, radius: np.ndarray, step: float = 0.5
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Resample a centerline so that consecutive samples are less than step voxels apart along each axis.
+
+    Parameters
+    ----------
+
+    points: centerline points, as a Nx3 array of voxel coordinates.
+    radius: radius of each centerline point.
+    step: maximum distance between samples, in voxels.
+
+    Returns
+    ----------
+
+    The samples, as a Mx3 array, and their linearly interpolated radius.
+    """
+    points = np.asarray(points, dtype=np.float64).reshape((-1, 3))
+    radius = np.asarray(radius, dtype=np.float64)
+
+    if points.shape[0] < 2:
+        return points, radius
+
+    # Number of samples per segment, the end point of a segment being the first sample of the next one
+    n = np.maximum(
+        np.ceil(np.max(np.abs(np.diff(points, axis=0)), axis=1) / step).astype(int), 1
+    )
+    segment = np.repeat(np.arange(n.shape[0]), n)
+    t = (np.arange(segment.shape[0]) - np.repeat(np.cumsum(n) - n, n)) / n[segment]
+
+    samples = points[segment] + t[:, None] * (points[segment + 1] - points[segment])
+    samples_radius = radius[segment] + t * (radius[segment + 1] - radius[segment])
+
+    return (
+        np.vstack((samples, points[-1:])),
+        np.concatenate((samples_radius, radius[-1:])),
+    )
+
+
+def centerline_bbox(
+    points: np.ndarray, radius: np.ndarray, spacing: np.ndarray
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Compute the bounding box of the capsules of a centerline, without clipping it to the volume bounds.
+
+    Parameters
+    ----------
+
+    points: centerline points, as a Nx3 array of voxel coordinates.
+    radius: radius of each centerline point, in millimeters.
+    spacing: voxel spacing, in millimeters, in the same axis order as the points.
+
+    Returns
+    ----------
+
+    lower_edge (included), higher_edge (excluded) the corners of the bounding box.
+    """
+    points = np.asarray(points, dtype=np.float64).reshape((-1, 3))
+
+    if points.shape[0] == 0:
+        return np.zeros(3, dtype=int), np.zeros(3, dtype=int)
+
+    margin = np.max(radius) / spacing
+
+    return (
+        np.floor(points.min(axis=0) - margin).astype(int),
+        np.ceil(points.max(axis=0) + margin).astype(int) + 1,
+    )
+
+
+def centerline_bboxes(
+    centerlines: list[np.ndarray], radius: list[np.ndarray], spacing: np.ndarray
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Compute the bounding boxes of the capsules of several centerlines at once (see centerline_bbox).
+
+    Parameters
+    ----------
+
+    centerlines: centerline points of each branch, as Nx3 arrays of voxel coordinates.
+    radius: radius of each centerline point, in millimeters.
+    spacing: voxel spacing, in millimeters, in the same axis order as the points.
+
+    Returns
+    ----------
+
+    lower_edges (included), higher_edges (excluded) the corners of the bounding boxes, as Bx3 arrays.
+    Empty boxes are returned for the empty centerlines.
+    """
+    points, offsets = stack_centerlines(centerlines, 3)
+    stacked_radius, _ = stack_centerlines(radius)
+
+    lower_edges = np.zeros((len(centerlines), 3), dtype=int)
+    higher_edges = np.zeros((len(centerlines), 3), dtype=int)
+    filled = offsets[1:] > offsets[:-1]
+    if not filled.any():
+        return lower_edges, higher_edges
+
+    starts = offsets[:-1][filled]
+    margin = np.maximum.reduceat(stacked_radius, starts)[:, None] / spacing
+    lower_edges[filled] = np.floor(
+        np.minimum.reduceat(points, starts, axis=0) - margin
+    ).astype(int)
+    higher_edges[filled] = (
+        np.ceil(np.maximum.reduceat(points, starts, axis=0) + margin).astype(int) + 1
+    )
+
+    return lower_edges, higher_edges
+
+
+def paint_tree(
+    segment_map: np.ndarray,
+    contours_map: np.ndarray,
+    centerlines: list[np.ndarray],
+    radius: list[np.ndarray],
+    adapted_radius: list[np.ndarray],
+    branch_draw_order: list[int],
+    labels: list[int],
+    spacing: np.ndarray,
+    reduction_threshold: float,
+    engine: str = "capsule",
+    lower_edge: np.ndarray = None,
+    higher_edge: np.ndarray = None,
+    progress=None,
+    n_workers: int = None,
+    tile_size: int = 64,
+) -> None:
+    """
+    Paint in place a centerline tree, and the mask from which its contour ring is computed.
+
+    The label map holds the branches painted with their adapted radius, the branch drawn last
+    winning where several overlap. The contour mask holds the painted voxels, plus the capsules
+    of the points whose radius has been reduced, painted with their real radius.
+
+    Only the region between lower_edge and higher_edge is cleared and repainted, with every branch
+    intersecting it: the result in the region is the same as when painting the whole volume.
+
+    The region is therefore split in tiles along the first axis, painted in parallel by a thread pool
+    (the numpy and scipy kernels release the GIL). Each tile resolves the overlaps with the same
+    branch_draw_order, so the result is identical to the one of the sequential painting (n_workers=1).
+
+    Parameters
+    ----------
+
+    segment_map: label map to paint.
+    contours_map: contour mask to paint.
+    centerlines: centerline points of each branch, as Nx3 arrays of voxel coordinates.
+    radius: radius of each centerline point, in millimeters.
+    adapted_radius: reduced radius of each centerline point, used for the label map, in millimeters.
+    branch_draw_order: list of indexes in which branch will be drawn.
+    labels: label of each branch.
+    spacing: voxel spacing, in millimeters, in the same axis order as the points.
+    reduction_threshold: radius above which the adapted radius is lower than the real one.
+    engine: "capsule" to paint each branch capsule by capsule, "edt" to paint each branch with a distance
+    transform of its centerline (see paint_tree_edt).
+    lower_edge: lower corner of the region to repaint (included), the whole volume if None.
+    higher_edge: higher corner of the region to repaint (excluded), the whole volume if None.
+    progress: function wrapping the iterable of the tiles painted (of the branches painted if n_workers is 1),
+    e.g. to display a progress bar.
+    n_workers: number of threads, os.cpu_count() if None. The region is painted sequentially if 1.
+    tile_size: number of planes of a tile along the first axis.
+    """
+    if engine not in ("capsule", "edt"):
+        raise ValueError(f"Unknown painting engine: {engine}")
+
+    dimensions = np.array(segment_map.shape)
+    lower_edge = (
+        np.zeros(3, dtype=int) if lower_edge is None else np.maximum(lower_edge, 0)
+    )
+    higher_edge = (
+        dimensions if higher_edge is None else np.minimum(higher_edge, dimensions)
+    )
+
+    if np.any(higher_edge <= lower_edge):
+        return
+
+    if n_workers != 1:
+
+        def paint_tile(tile_start):
+            paint_tree(
+                segment_map,
+                contours_map,
+                centerlines,
+                radius,
+                adapted_radius,
+                branch_draw_order,
+                labels,
+                spacing,
+                reduction_threshold,
+                engine,
+                np.array([tile_start, *lower_edge[1:]]),
+                np.array(
+                    [min(tile_start + tile_size, higher_edge[0]), *higher_edge[1:]]
+                ),
+                n_workers=1,
+            )
+
+        # Tiles are disjoint, so that the threads never write the same voxel
+        with ThreadPoolExecutor(max_workers=n_workers) as executor:
+            tiles = [
+                executor.submit(paint_tile, tile_start)
+                for tile_start in range(lower_edge[0], higher_edge[0], tile_size)
+            ]
+            for tile in tiles if progress is None else progress(tiles):
+                tile.result()
+        return
+
+    box = tuple(slice(low, high) for low, high in zip(lower_edge, higher_edge))
+    segment_map[box] = 0
+    contours_map[box] = False
+
+    if engine == "edt":
+        paint_tree_edt(
+            segment_map,
+            contours_map,
+            centerlines,
+            radius,
+            adapted_radius,
+            branch_draw_order,
+            labels,
+            spacing,
+            lower_edge,
+            higher_edge,
+        )
+        return
+
+    # Only the branches intersecting the region are painted, relatively to the region
+    lower_edges, higher_edges = centerline_bboxes(centerlines, radius, spacing)
+    intersects = np.all(lower_edges < higher_edge, axis=1) & np.all(
+        higher_edges > lower_edge, axis=1
+    )
+    intersecting = [idx for idx in branch_draw_order if intersects[idx]]
+
+    for centerline_idx in intersecting if progress is None else progress(intersecting):
+        paint_capsules(
+            segment_map[box],
+            np.asarray(centerlines[centerline_idx]).reshape((-1, 3)) - lower_edge,
+            adapted_radius[centerline_idx],
+            spacing,
+            labels[centerline_idx],
+        )
+
+    contours_map[box] = segment_map[box] > 0
+
+    # Only repaint the capsules having a point that has been shrunk, with its real radius
+    for centerline_idx in intersecting:
+        shrunk = np.array(radius[centerline_idx]) > reduction_threshold
+        if shrunk.shape[0] > 1:
+            shrunk = shrunk[:-1] | shrunk[1:]
+        paint_capsules(
+            contours_map[box],
+            np.asarray(centerlines[centerline_idx]).reshape((-1, 3)) - lower_edge,
+            radius[centerline_idx],
+            spacing,
+            capsule_mask=shrunk,
+        )
+
+
+def paint_tree_edt(
+    segment_map: np.ndarray,
+    contours_map: np.ndarray,
+    centerlines: list[np.ndarray],
+    radius: list[np.ndarray],
+    adapted_radius: list[np.ndarray],
+    branch_draw_order: list[int],
+    labels: list[int],
+    spacing: np.ndarray,
+    lower_edge: np.ndarray = None,
+    higher_edge: np.ndarray = None,
+    slab_size: int = 64,
+) -> None:
+    """
+    Paint in place a centerline tree with Euclidean distance transforms of its centerlines.
+
+    The branches are painted one after the other in branch_draw_order, as with the capsule engine, each
+    with a distance transform of its centerline inside its bounding box (see paint_seeds_edt). A branch
+    overwrites the branches drawn before it, so that the label map is the same as the one of the capsule
+    engine, up to the discretization of the centerlines into voxels.
+
+    Parameters
+    ----------
+
+    segment_map: label map to paint.
+    contours_map: contour mask to paint.
+    centerlines: centerline points of each branch, as Nx3 arrays of voxel coordinates.
+    radius: radius of each centerline point, in millimeters.
+    adapted_radius: reduced radius of each centerline point, used for the label map, in millimeters.
+    branch_draw_order: list of indexes in which branch will be drawn.
+    labels: label of each branch.
+    spacing: voxel spacing, in millimeters, in the same axis order as the points.
+    lower_edge: lower corner of the region to paint (included), the whole volume if None.
+    higher_edge: higher corner of the region to paint (excluded), the whole volume if None.
+    slab_size: number of planes processed at once along the first axis.
+    """
+    dimensions = np.array(segment_map.shape)
+    lower_edge = np.zeros(3, dtype=int) if lower_edge is None else lower_edge
+    higher_edge = dimensions if higher_edge is None else higher_edge
+
+    for centerline_idx in branch_draw_order:
+        points, points_radius = sample_centerline(
+            centerlines[centerline_idx], radius[centerline_idx]
+        )
+        _, points_adapted_radius = sample_centerline(
+            centerlines[centerline_idx], adapted_radius[centerline_idx]
+        )
+        paint_seeds_edt(
+            segment_map,
+            contours_map,
+            points,
+            points_radius,
+            points_adapted_radius,
+            labels[centerline_idx],
+            spacing,
+            lower_edge,
+            higher_edge,
+            slab_size,
+        )
+
+        # As with the capsule engine, the voxel closest to each point is also painted
+        closest_voxels = np.rint(
+            np.asarray(centerlines[centerline_idx]).reshape((-1, 3))
+        ).astype(int)
+        closest_voxels = closest_voxels[
+            np.all(
+                (closest_voxels >= lower_edge) & (closest_voxels < higher_edge), axis=1
+            )
+        ]
+        segment_map[tuple(closest_voxels.T)] = labels[centerline_idx]
+        contours_map[tuple(closest_voxels.T)] = True
+
+
+def paint_seeds_edt(
+    segment_map: np.ndarray,
+    contours_map: np.ndarray,
+    points: np.ndarray,
+    points_radius: np.ndarray,
+    points_adapted_radius: np.ndarray,
+    label: int,
+    spacing: np.ndarray,
+    lower_edge: np.ndarray,
+    higher_edge: np.ndarray,
+    slab_size: int = 64,
+) -> None:
+    """
+    Paint in place a branch given by centerline samples with a Euclidean distance transform.
+
+    The samples are rasterized as seed voxels, and the distance transform of the seeds gives the closest
+    seed of each voxel of the bounding box of the branch. The voxels close enough to their seed are then
+    checked against the tapered capsules joining the sample of this seed to its neighbours (see capsule_map):
+    the voxel gets the label if it lies inside the capsules with the adapted radius, and belongs to the
+    contour mask if it lies inside them with the real radius. When several samples fall in the same voxel,
+    the one with the largest radius is kept.
+
+    The bounding box is processed in slabs along the first axis, with a margin of the largest radius so
+    that the closest seed of any painted voxel is always within the slab. The voxels outside the region
+    to paint, or left unpainted, are not modified.
+
+    Parameters
+    ----------
+
+    segment_map: label map to paint.
+    contours_map: contour mask to paint.
+    points: centerline samples of the branch, as a Nx3 array of voxel coordinates, less than a voxel apart
+    (see sample_centerline).
+    points_radius: radius of each sample, in millimeters.
+    points_adapted_radius: reduced radius of each sample, used for the label map, in millimeters.
+    label: label of the branch.
+    spacing: voxel spacing, in millimeters, in the same axis order as the points.
+    lower_edge: lower corner of the region to paint (included).
+    higher_edge: higher corner of the region to paint (excluded).
+    slab_size: number of planes processed at once along the first axis.
+    """
+    dimensions = np.array(segment_map.shape)
+    points = np.asarray(points, dtype=np.float64).reshape((-1, 3))
+    points_radius = np.asarray(points_radius, dtype=np.float64)
+    points_adapted_radius = np.asarray(points_adapted_radius, dtype=np.float64)
+    seeds = np.rint(points).astype(int)
+
+    if seeds.shape[0] == 0:
+        return
+
+    # Only the seeds inside the volume that may be the closest one of a voxel of the region are kept
+    margin = np.ceil(points_radius.max() / spacing).astype(int) + 1
+    near = np.nonzero(
+        np.all(
+            (seeds >= np.maximum(lower_edge - margin, 0))
+            & (seeds < np.minimum(higher_edge + margin, dimensions)),
+            axis=1,
+        )
+    )[0]
+
+    if near.shape[0] == 0:
+        return
+
+    # Bounding box of the branch, within the region to paint
+    roi_lower = np.maximum(seeds[near].min(axis=0) - margin, lower_edge)
+    roi_higher = np.minimum(seeds[near].max(axis=0) + margin + 1, higher_edge)
+
+    # Keep the seed with the largest radius of each voxel
+    linear = np.ravel_multi_index(seeds[near].T, segment_map.shape)
+    order = np.lexsort((points_radius[near], linear))
+    kept = near[order[np.append(linear[order][1:] != linear[order][:-1], True)]]
+
+    # The distance to the closest seed is off by up to half a voxel diagonal from the one to its sample
+    half_diagonal = 0.5 * np.linalg.norm(spacing)
+    last = points.shape[0] - 1
+
+    for slab_start in range(roi_lower[0], roi_higher[0], slab_size):
+        slab_end = min(slab_start + slab_size, roi_higher[0])
+
+        # The distance transform is computed on the slab enlarged by the margin
+        low = np.maximum([slab_start, *roi_lower[1:]] - margin, 0)
+        high = np.minimum([slab_end, *roi_higher[1:]] + margin, dimensions)
+
+        in_slab = kept[np.all((seeds[kept] >= low) & (seeds[kept] < high), axis=1)]
+        if in_slab.shape[0] == 0:
+            continue
+
+        # Index of the sample of each seed voxel, -1 for background
+        seed_map = np.full(high - low, -1, dtype=np.int64)
+        local = seeds[in_slab] - low
+        seed_map[local[:, 0], local[:, 1], local[:, 2]] = in_slab
+
+        distance, indices = distance_transform_edt(
+            seed_map < 0,
+            sampling=spacing,
+            return_indices=True,
+        )
+
+        # Only keep the slab, without its margin
+        crop = (
+            slice(slab_start - low[0], slab_end - low[0]),
+            slice(roi_lower[1] - low[1], roi_higher[1] - low[1]),
+            slice(roi_lower[2] - low[2], roi_higher[2] - low[2]),
+        )
+        distance = distance[crop]
+        closest = seed_map[indices[0][crop], indices[1][crop], indices[2][crop]]
+        del indices, seed_map
+
+        candidates = np.nonzero(distance <= points_radius[closest] + half_diagonal)
+        closest = closest[candidates]
+        del distance
+
+        voxels = np.stack(candidates, axis=1) + [slab_start, roi_lower[1], roi_lower[2]]
+        painted = np.zeros(closest.shape[0], dtype=bool)
+        contour = np.zeros(closest.shape[0], dtype=bool)
+        for shift in range(-NEIGHBOUR_SEGMENTS, NEIGHBOUR_SEGMENTS):
+            a = np.clip(closest + shift, 0, last)
+            b = np.clip(closest + shift + 1, 0, last)
+
+            # Offsets to the first sample and segment vectors, in millimeters
+            offset = (voxels - points[a]) * spacing
+            d = (points[b] - points[a]) * spacing
+            length_sqr = np.einsum("ij,ij->i", d, d)
+
+            # Position of the voxel projection on the segment, in [0, 1]
+            t = np.clip(
+                np.divide(
+                    np.einsum("ij,ij->i", offset, d),
+                    length_sqr,
+                    out=np.zeros_like(length_sqr),
+                    where=length_sqr > 0,
+                ),
+                0,
+                1,
+            )
+            distance_sqr = np.sum((offset - t[:, None] * d) ** 2, axis=1)
+
+            adapted_radius = points_adapted_radius[a] + t * (
+                points_adapted_radius[b] - points_adapted_radius[a]
+            )
+            radius = points_radius[a] + t * (points_radius[b] - points_radius[a])
+            painted |= distance_sqr <= adapted_radius**2
+            contour |= distance_sqr <= radius**2
+
+        box = (
+            slice(slab_start, slab_end),
+            slice(roi_lower[1], roi_higher[1]),
+            slice(roi_lower[2], roi_higher[2]),
+        )
+        segment_map[box][tuple(axis[painted] for axis in candidates)] = label
+        contours_map[box][tuple(axis[contour] for axis in candidates)] = True
+
+
+def paint_branch_masks(
+    centerlines: list[np.ndarray],
+    adapted_radius: list[np.ndarray],
+    branch_draw_order: list[int],
+    spacing: np.ndarray,
+    shape: tuple[int, int, int],
+) -> dict[int, tuple[np.ndarray, np.ndarray, np.ndarray]]:
+    """
+    Paint each branch in its own bounding box, as a sparse alternative to a dense label map.
+
+    A voxel belongs to the branch drawn last among the ones painting it, as in paint_tree: each branch
+    removes the voxels it paints from the masks of the branches drawn before whose box intersects its own.
+    The memory used hence scales with the size of the branch boxes, not with the size of the volume and the
+    number of labels.
+
+    Parameters
+    ----------
+
+    centerlines: centerline points of each branch, as Nx3 arrays of voxel coordinates.
+    adapted_radius: radius of each centerline point to paint, in millimeters.
+    branch_draw_order: list of indexes in which branch will be drawn.
+    spacing: voxel spacing, in millimeters, in the same axis order as the points.
+    shape: volume dimensions.
+
+    Returns
+    ----------
+
+    Index of each painted branch -> lower_edge (included), higher_edge (excluded) of its box clipped to the
+    volume, and its mask packed with np.packbits (see unpack_branch_mask).
+    """
+    lower_edges, higher_edges = centerline_bboxes(centerlines, adapted_radius, spacing)
+    lower_edges = np.maximum(lower_edges, 0)
+    higher_edges = np.minimum(higher_edges, shape)
+
+    masks = {}
+    painted = np.zeros(len(centerlines), dtype=np.bool_)
+    for centerline_idx in branch_draw_order:
+        lower_edge = lower_edges[centerline_idx]
+        higher_edge = higher_edges[centerline_idx]
+        if np.any(higher_edge <= lower_edge):
+            continue
+
+        mask = np.zeros(higher_edge - lower_edge, dtype=np.bool_)
+        paint_capsules(
+            mask,
+            np.asarray(centerlines[centerline_idx]).reshape((-1, 3)) - lower_edge,
+            adapted_radius[centerline_idx],
+            spacing,
+        )
+
+        # The branches drawn before lose the voxels painted by this one, only the intersecting boxes are visited
+        for other_idx in np.flatnonzero(
+            painted
+            & np.all(lower_edges < higher_edge, axis=1)
+            & np.all(higher_edges > lower_edge, axis=1)
+        ):
+            low = np.maximum(lower_edges[other_idx], lower_edge)
+            high = np.minimum(higher_edges[other_idx], higher_edge)
+            other_box = tuple(
+                slice(a - b, c - b)
+                for a, b, c in zip(low, lower_edges[other_idx], high)
+            )
+            box = tuple(slice(a - b, c - b) for a, b, c in zip(low, lower_edge, high))
+            masks[other_idx][other_box] &= ~mask[box]
+
+        masks[centerline_idx] = mask
+        painted[centerline_idx] = True
+
+    return {
+        centerline_idx: (
+            lower_edges[centerline_idx],
+            higher_edges[centerline_idx],
+            np.packbits(mask, axis=None),
+        )
+        for centerline_idx, mask in masks.items()
+    }
+
+
+def unpack_branch_mask(
+    lower_edge: np.ndarray, higher_edge: np.ndarray, packed: np.ndarray
+) -> np.ndarray:
+    """
+    Unpack a branch mask painted by paint_branch_masks.
+
+    Parameters
+    ----------
+
+    lower_edge: lower corner of the branch box (included).
+    higher_edge: higher corner of the branch box (excluded).
+    packed: mask packed with np.packbits.
+
+    Returns
+    ----------
+
+    Boolean mask of the branch box.
+    """
+    shape = tuple(higher_edge - lower_edge)
+
+    return (
+        np.unpackbits(packed, count=int(np.prod(shape))).reshape(shape).view(np.bool_)
+    )
+
+
+def paint_contour_masks(
+    centerlines: list[np.ndarray],
+    radius: list[np.ndarray],
+    adapted_radius: list[np.ndarray],
+    spacing: np.ndarray,
+    shape: tuple[int, int, int],
+    reduction_threshold: float,
+) -> list[tuple[np.ndarray, np.ndarray, np.ndarray]]:
+    """
+    Paint the contour mask of each branch in its own bounding box, as a sparse alternative to the dense
+    contour mask of paint_tree: the union of the masks is the same.
+
+    Parameters
+    ----------
+
+    centerlines: centerline points of each branch, as Nx3 arrays of voxel coordinates.
+    radius: radius of each centerline point, in millimeters.
+    adapted_radius: reduced radius of each centerline point, used for the label map, in millimeters.
+    spacing: voxel spacing, in millimeters, in the same axis order as the points.
+    shape: volume dimensions.
+    reduction_threshold: radius above which the adapted radius is lower than the real one.
+
+    Returns
+    ----------
+
+    lower_edge (included), higher_edge (excluded) and boolean mask of the box of each painted branch.
+    """
+    lower_edges, higher_edges = centerline_bboxes(centerlines, radius, spacing)
+    lower_edges = np.maximum(lower_edges, 0)
+    higher_edges = np.minimum(higher_edges, shape)
+
+    masks = []
+    for centerline_idx in range(len(centerlines)):
+        lower_edge = lower_edges[centerline_idx]
+        higher_edge = higher_edges[centerline_idx]
+        if np.any(higher_edge <= lower_edge):
+            continue
+
+        points = np.asarray(centerlines[centerline_idx]).reshape((-1, 3)) - lower_edge
+        mask = np.zeros(higher_edge - lower_edge, dtype=np.bool_)
+        paint_capsules(mask, points, adapted_radius[centerline_idx], spacing)
+
+        # Capsules having a point that has been shrunk, with their real radius
+        shrunk = np.asarray(radius[centerline_idx]) > reduction_threshold
+        if shrunk.shape[0] > 1:
+            shrunk = shrunk[:-1] | shrunk[1:]
+        paint_capsules(
+            mask, points, radius[centerline_idx], spacing, capsule_mask=shrunk
+        )
+
+        masks.append((lower_edge, higher_edge, mask))
+
+    return masks
+
+
+def sparse_contour_ring(
+    masks: list[tuple[np.ndarray, np.ndarray, np.ndarray]],
+    inner_distance: float,
+    outer_distance: float,
+    spacing: np.ndarray,
+    shape: tuple[int, int, int],
+) -> list[tuple[np.ndarray, np.ndarray, np.ndarray]]:
+    """
+    Compute the contour ring (see contour_ring) of the union of masks painted in their own box, box by box.
+
+    The ring is computed in each box enlarged by outer_distance, from the masks whose box intersects it,
+    so that the union of the returned rings is the ring of the union of the masks.
+
+    Parameters
+    ----------
+
+    masks: lower_edge (included), higher_edge (excluded) and boolean mask of each box, see paint_contour_masks.
+    inner_distance: inner distance of the ring, in voxels.
+    outer_distance: outer distance of the ring, in voxels.
+    spacing: voxel spacing, in the same axis order as the masks.
+    shape: volume dimensions.
+
+    Returns
+    ----------
+
+    lower_edge (included), higher_edge (excluded) and boolean ring of each enlarged box.
+    """
+    if len(masks) == 0:
+        return []
+
+    sampling = np.asarray(spacing, dtype=np.float64) / np.min(spacing)
+    margin = np.ceil(outer_distance / sampling).astype(int) + 1
+    lower_edges = np.array([lower_edge for lower_edge, _, _ in masks])
+    higher_edges = np.array([higher_edge for _, higher_edge, _ in masks])
+
+    rings = []
+    for lower_edge, higher_edge, _ in masks:
+        # Region of the ring, and the region enlarged by the margin holding the masks it depends on
+        region_low = np.maximum(lower_edge - margin, 0)
+        region_high = np.minimum(higher_edge + margin, shape)
+        low = np.maximum(region_low - margin, 0)
+        high = np.minimum(region_high + margin, shape)
+
+        local_mask = np.zeros(high - low, dtype=np.bool_)
+        for other_idx in np.flatnonzero(
+            np.all(lower_edges < high, axis=1) & np.all(higher_edges > low, axis=1)
+        ):
+            other_low, other_high, other_mask = masks[other_idx]
+            a = np.maximum(other_low, low)
+            b = np.minimum(other_high, high)
+            local_mask[tuple(slice(i - j, k - j) for i, j, k in zip(a, low, b))] |= (
+                other_mask[
+                    tuple(slice(i - j, k - j) for i, j, k in zip(a, other_low, b))
+                ]
+            )
+
+        crop = tuple(
+            slice(a - b, c - b) for a, b, c in zip(region_low, low, region_high)
+        )
+        distance = distance_transform_edt(~local_mask, sampling=sampling)[crop]
+        rings.append(
+            (
+                region_low,
+                region_high,
+                (distance > inner_distance) & (distance <= outer_distance),
+            )
+        )
+
+    return rings
+
+
+def update_contour_ring(
+    ring: np.ndarray,
+    mask: np.ndarray,
+    inner_distance: float,
+    outer_distance: float,
+    spacing: np.ndarray = None,
+    lower_edge: np.ndarray = None,
+    higher_edge: np.ndarray = None,
+) -> None:
+    """
+    Recompute in place the contour ring of a mask (see contour_ring) inside a region.
+
+    The distance transform is computed on the region enlarged by outer_distance, so that the
+    ring inside the region is the same as when computed on the whole volume.
+
+    Parameters
+    ----------
+
+    ring: boolean map of the ring to update.
+    mask: boolean map around which to compute the ring.
+    inner_distance: inner distance of the ring, in voxels.
+    outer_distance: outer distance of the ring, in voxels.
+    spacing: voxel spacing, in the same axis order as the mask. Isotropic if None.
+    lower_edge: lower corner of the region to update (included), the whole volume if None.
+    higher_edge: higher corner of the region to update (excluded), the whole volume if None.
+    """
+    dimensions = np.array(mask.shape)
+    lower_edge = (
+        np.zeros(3, dtype=int) if lower_edge is None else np.maximum(lower_edge, 0)
+    )
+    higher_edge = (
+        dimensions if higher_edge is None else np.minimum(higher_edge, dimensions)
+    )
+
+    if np.any(higher_edge <= lower_edge):
+        return
+
+    if spacing is None:
+        sampling = np.ones(3)
+    else:
+        sampling = np.asarray(spacing, dtype=np.float64) / np.min(spacing)
+
+    margin = np.ceil(outer_distance / sampling).astype(int) + 1
+    low = np.maximum(lower_edge - margin, 0)
+    high = np.minimum(higher_edge + margin, dimensions)
+    box = tuple(slice(a, b) for a, b in zip(lower_edge, higher_edge))
+    crop = tuple(slice(a - b, c - b) for a, b, c in zip(lower_edge, low, higher_edge))
+
+    local_mask = mask[tuple(slice(a, b) for a, b in zip(low, high))]
+    if not local_mask.any():
+        ring[box] = False
+        return
+
+    distance = distance_transform_edt(~local_mask, sampling=sampling)[crop]
+    ring[box] = (distance > inner_distance) & (distance <= outer_distance)
+
+
+def contour_ring(
+    mask: np.ndarray,
+    inner_distance: float,
+    outer_distance: float,
+    spacing: np.ndarray = None,
+) -> np.ndarray:
+    """
+    Compute the ring of voxels lying between inner_distance (excluded) and outer_distance (included) of a mask.
+
+    The distance transform is only computed on the bounding box of the mask, enlarged by outer_distance,
+    since farther voxels cannot belong to the ring. Distances are expressed in voxels of the finest axis,
+    the coarser axes being scaled according to the spacing. With an isotropic spacing, the ring is the
+    difference between the dilations of the mask by balls of radius outer_distance and inner_distance.
+
+    Parameters
+    ----------
+
+    mask: boolean map around which to compute the ring.
+    inner_distance: inner distance of the ring, in voxels.
+    outer_distance: outer distance of the ring, in voxels.
+    spacing: voxel spacing, in the same axis order as the mask. Isotropic if None.
+
+    Returns
+    ----------
+
+    Boolean map of the ring, with the same shape as mask.
+    """
+    ring = np.zeros(mask.shape, dtype=np.bool_)
+
+    # Indexes of the planes containing painted voxels, along each axis
+    planes = [
+        np.flatnonzero(np.any(mask, axis=tuple(a for a in range(3) if a != axis)))
+        for axis in range(3)
+    ]
+
+    if planes[0].shape[0] == 0:
+        return ring
+
+    if spacing is None:
+        sampling = np.ones(3)
+    else:
+        sampling = np.asarray(spacing, dtype=np.float64) / np.min(spacing)
+
+    # Bounding box of the mask, enlarged by the outer distance
+    margin = np.ceil(outer_distance / sampling).astype(int) + 1
+    update_contour_ring(
+        ring,
+        mask,
+        inner_distance,
+        outer_distance,
+        spacing,
+        np.array([p[0] for p in planes]) - margin,
+        np.array([p[-1] + 1 for p in planes]) + margin,
+    )
+
+    return ring
+
+
+def rasterize_tree(
+    centerlines: list[np.ndarray],
+    radius: list[np.ndarray],
+    branch_draw_order: list[int],
+    ijk_to_ras: np.ndarray,
+    shape: tuple[int, int, int],
+    reduction_factor: float,
+    reduction_threshold: float,
+    contour_distance: float,
+    labels: list[int] = None,
+    engine: str = "capsule",
+    progress=None,
+    n_workers: int = None,
+    sparse: bool = False,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Rasterize a centerline tree into a label map and its contour ring, without any Slicer dependency.
+
+    Parameters
+    ----------
+
+    centerlines: centerline points of each branch, as Nx3 arrays of RAS coordinates.
+    radius: radius of each centerline point, in millimeters.
+    branch_draw_order: list of indexes in which branch will be drawn.
+    ijk_to_ras: 4x4 homogeneous matrix from IJK to RAS coordinates of the volume.
+    shape: volume dimensions, in numpy order (k, j, i).
+    reduction_factor: amount of the reduction of the radius of big vessels (see adapt_radius).
+    reduction_threshold: threshold from which a reduction is applied to the radius.
+    contour_distance: distance in voxels between the vessels and the contour ring.
+    labels: label of each branch, 1, 2, ... in the order of centerlines if None.
+    engine: painting engine, see paint_tree.
+    progress: function wrapping the iterable of the tiles painted, see paint_tree.
+    n_workers: number of threads, see paint_tree.
+    sparse: if True, the branches, the contour mask and the contour ring are painted capsule by capsule in
+    the box of each branch (see paint_branch_masks, paint_contour_masks and sparse_contour_ring), instead of
+    in dense maps of the volume. Requires the capsule engine.
+
+    Returns
+    ----------
+
+    The label map (the smallest unsigned type holding the labels, see label_dtype), the contour mask (the
+    vessels painted with their real radius) and the contour ring, with the given shape.
+    If sparse, label -> lower_edge, higher_edge and packed mask of the branch (see unpack_branch_mask),
+    and the contour mask and ring as lists of lower_edge, higher_edge and packed mask of boxes, whose
+    union gives the dense maps.
+    """
+    if sparse and engine != "capsule":
+        raise ValueError("Sparse branch masks can only be painted with capsules")
+
+    ijk_to_ras = np.asarray(ijk_to_ras, dtype=np.float64)
+    spacing = voxel_spacing(ijk_to_ras)
+    labels = [idx + 1 for idx in range(len(centerlines))] if labels is None else labels
+    radius = [np.asarray(radius_list, dtype=np.float64) for radius_list in radius]
+
+    centerlines = ras_to_voxel(centerlines, np.linalg.inv(ijk_to_ras))
+    adapted_radius = adapt_tree_radius(radius, reduction_threshold, reduction_factor)
+
+    if sparse:
+        segment_map = {
+            labels[centerline_idx]: branch_mask
+            for centerline_idx, branch_mask in paint_branch_masks(
+                centerlines, adapted_radius, branch_draw_order, spacing, shape
+            ).items()
+        }
+        contour_masks = paint_contour_masks(
+            centerlines, radius, adapted_radius, spacing, shape, reduction_threshold
+        )
+        rings = sparse_contour_ring(
+            contour_masks, contour_distance, contour_distance + 2, spacing, shape
+        )
+
+        return (
+            segment_map,
+            [
+                (low, high, np.packbits(mask, axis=None))
+                for low, high, mask in contour_masks
+            ],
+            [(low, high, np.packbits(ring, axis=None)) for low, high, ring in rings],
+        )
+
+    contours_map = np.zeros(shape, dtype=np.bool_)
+    segment_map = np.zeros(shape, dtype=label_dtype(max(labels, default=0)))
+    paint_tree(
+        segment_map,
+        contours_map,
+        centerlines,
+        radius,
+        adapted_radius,
+        branch_draw_order,
+        labels,
+        spacing,
+        reduction_threshold,
+        engine,
+        progress=progress,
+        n_workers=n_workers,
+    )
+
+    ring = contour_ring(contours_map, contour_distance, contour_distance + 2, spacing)
+
+    return segment_map, contours_map, ring
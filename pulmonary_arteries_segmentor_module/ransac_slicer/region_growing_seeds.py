@@ -3,8 +3,21 @@ from .popup_utils import CustomProgressBar, CustomStatusDialog
 import slicer
 import numpy as np
 import vtk
-from skimage.morphology import binary_dilation, ball
+from scipy.ndimage import find_objects
 from .color_palettes import vessel_colors, contour_color
+from .rasterization import (
+    adapt_tree_radius,
+    centerline_bbox,
+    centerline_bboxes,
+    label_dtype,
+    paint_tree,
+    ras_to_voxel,
+    rasterize_tree,
+    split_centerlines,
+    stack_centerlines,
+    update_contour_ring,
+    voxel_spacing,
+)
 import time
 
 
@@ -38,76 +51,555 @@ def update_segment(
     )
 
 
-def compute_bbox(
-    centerline_points: list[np.ndarray],
-    radius: list[np.ndarray],
-    lower_bound: np.ndarray,
-    dimensions: np.ndarray,
-) -> tuple[np.ndarray, np.ndarray]:
+def create_labelmap_node(
+    volume_node: slicer.vtkMRMLScalarVolumeNode,
+    lower_edge: Union[np.ndarray, None] = None,
+    higher_edge: Union[np.ndarray, None] = None,
+    dtype: np.dtype = np.uint8,
+) -> slicer.vtkMRMLLabelMapVolumeNode:
     """
-    Compute the bounding box of a zone on which to evaluate a sphere equation.
-
-    The bounding box cannot be located outside of the volume bounds.
+    Create a labelmap node with the same spacing and orientation as a volume, covering the whole volume
+    or only a box of it.
 
     Parameters
     ----------
 
-    centerline_points: list of sphere centers.
-    radius: list of the sphere radius.
-    lower_bound: lower coordinate limit on which point can be located.
-    dimensions: volume dimensions.
+    volume_node: reference volume.
+    lower_edge: lower corner of the box (included), in numpy order (k, j, i). The whole volume if None.
+    higher_edge: higher corner of the box (excluded), in numpy order (k, j, i). The whole volume if None.
+    dtype: type of the labels, np.uint8, np.uint16 or np.uint32 (see rasterization.label_dtype).
 
     Returns
     ----------
 
-    min_point, max_point the corners of the bounding box.
+    The labelmap node, to be removed from the scene once used.
     """
-    centerline_points = np.array(centerline_points)
-    radius = np.array(radius)
+    dimensions = np.array(volume_node.GetImageData().GetDimensions())
+    lower_edge = np.zeros(3, dtype=int) if lower_edge is None else lower_edge[::-1]
+    higher_edge = dimensions if higher_edge is None else higher_edge[::-1]
 
-    min_point = np.maximum(
-        np.floor(np.min(centerline_points - radius, axis=0)).astype(int), lower_bound
+    labelmap_node = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLLabelMapVolumeNode")
+    labelmap_node.CopyOrientation(volume_node)
+    labelmap_node.SetSpacing(volume_node.GetSpacing())
+
+    # The origin is moved to the lower corner of the box
+    ijk_to_ras = vtk.vtkMatrix4x4()
+    volume_node.GetIJKToRASMatrix(ijk_to_ras)
+    origin = ijk_to_ras.MultiplyPoint([*(float(i) for i in lower_edge), 1.0])
+    for axis in range(3):
+        ijk_to_ras.SetElement(axis, 3, origin[axis])
+    labelmap_node.SetIJKToRASMatrix(ijk_to_ras)
+
+    labelmap_node.CreateDefaultDisplayNodes()
+    labelmap_node.SetAndObserveImageData(vtk.vtkImageData())
+    labelmap_node.GetImageData().SetDimensions(
+        *(int(size) for size in higher_edge - lower_edge)
     )
-    max_point = np.minimum(
-        np.ceil(np.max(centerline_points + radius, axis=0)).astype(int), dimensions
+
+    # Labelmap pixel values with one channel, wide enough for every label
+    labelmap_node.GetImageData().AllocateScalars(
+        {
+            np.uint8: vtk.VTK_UNSIGNED_CHAR,
+            np.uint16: vtk.VTK_UNSIGNED_SHORT,
+            np.uint32: vtk.VTK_UNSIGNED_INT,
+        }[dtype],
+        1,
     )
 
-    return min_point, max_point
+    return labelmap_node
 
 
-def adapt_radius(
-    radius: float, reduction_threshold: float, reduction_factor: float
-) -> float:
+class SegmentPainter:
+    """
+    Paint the segmentation segments according to the centerlines and their associated radius.
+
+    The painter keeps the label map, the contour mask and the contour ring it painted, with the
+    geometry and the segment of each branch. When told which branches changed since the last paint,
+    it only repaints the regions covered by these branches (before and after the change), updates
+    the contour ring around them, and imports only the segments touched by these regions.
+    A full paint is done the first time, or whenever the volume, the segmentation or the parameters
+    changed, or the segmentation was edited by another tool.
+
+    Only the bounding box of the painted voxels is imported into the segmentation. The extent of each
+    imported segment is kept in segment_extents: segment id -> (i_min, i_max, j_min, j_max, k_min, k_max),
+    bounds included, as a VTK extent.
     """
-    Reduce the growth of big vessels radius to limit the leaking when creating
-    segmentation zones.
 
-    Parameters
-    ----------
+    def __init__(self) -> None:
+        self.reset()
+
+    def reset(self) -> None:
+        """
+        Forget what has been painted, so that the next paint is a full one.
+        """
+        self._key = None
+        self._segmentation_mtime = None
+        self._segment_map = None
+        self._contours_map = None
+        self._ring = None
+        self._branches = {}  # name -> label, centerline (voxel coordinates), radius and segment id
+        self._draw_order = []  # branch names, in draw order
+        self._vessels_segment_id = None
+        self._contours_segment_id = None
+        self.segment_extents = {}
+
+    def paint(
+        self,
+        volume_node: slicer.vtkMRMLScalarVolumeNode,
+        centerlines: list[np.ndarray],
+        centerline_names: list[str],
+        radius: list[list[float]],
+        branch_draw_order: list[int],
+        segmentation_node: slicer.vtkMRMLSegmentationNode,
+        reduction_factor: float,
+        reduction_threshold: float,
+        contour_distance: int,
+        merge_all_vessels: bool,
+        engine: str = "capsule",
+        dirty_branches: Union[set, None] = None,
+        renamed_branches: Union[dict, None] = None,
+    ) -> None:
+        """
+        Paint the segments, only repainting the changed branches when possible.
+
+        Parameters
+        ----------
+
+        volume_node: input volume.
+        centerlines: centerlines segmented.
+        centerline_names: list of the centerline names, will be used for the segmentation name.
+        radius: list of radius of each centerline points.
+        branch_draw_order: list of indexes in which branch will be drawn.
+        segmentation_node: segmentation_node on which segment will be added and updated.
+        reduction_threshold: threshold from which a reduction is applied to the radius.
+        reduction_factor: amount of the reduction.
+        contour_distance: distance in voxel between the vessel and the contour.
+        merge_all_vessels: if True, this flag will put every vessels in the same segment, instead of separeted ones.
+        engine: "capsule" to paint each branch capsule by capsule, "edt" to paint each branch with a distance
+        transform of its centerline (see rasterization.paint_tree).
+        dirty_branches: names of the branches created or modified since the last paint. A full paint is done if None.
+        renamed_branches: current name of the renamed branches -> their name at the last paint.
+        """
+        if engine not in ("capsule", "edt"):
+            raise ValueError(f"Unknown painting engine: {engine}")
+
+        # Get the ijk to ras matrix as numpy array
+        ijk_to_ras = vtk.vtkMatrix4x4()
+        volume_node.GetIJKToRASMatrix(ijk_to_ras)
+        np_ijk_to_ras = np.zeros(shape=(4, 4))
+        ijk_to_ras.DeepCopy(np_ijk_to_ras.ravel(), ijk_to_ras)
+
+        # Important variables
+        spacing = voxel_spacing(np_ijk_to_ras)
+        volume_dimensions = np.array(volume_node.GetImageData().GetDimensions()[::-1])
+
+        # Transform ras coordinates (real world coordinates) into ijk coordinates (voxel coordinates), in numpy order
+        ras_centerlines = centerlines
+        centerlines = ras_to_voxel(centerlines, np.linalg.inv(np_ijk_to_ras))
+        radius = split_centerlines(*stack_centerlines(radius))
+
+        key = (
+            volume_node.GetID(),
+            segmentation_node.GetID(),
+            tuple(volume_dimensions),
+            tuple(spacing),
+            tuple(np_ijk_to_ras.ravel()),
+            reduction_factor,
+            reduction_threshold,
+            contour_distance,
+            merge_all_vessels,
+            engine,
+        )
 
-    radius: a sphere radius.
-    reduction_threshold: threshold from which a reduction is applied to the radius.
-    reduction_factor: amount of the reduction.
+        if (
+            dirty_branches is None
+            or key != self._key
+            or segmentation_node.GetSegmentation().GetMTime()
+            != self._segmentation_mtime
+            or not self._paint_changed(
+                centerlines,
+                centerline_names,
+                radius,
+                branch_draw_order,
+                segmentation_node,
+                volume_node,
+                spacing,
+                reduction_factor,
+                reduction_threshold,
+                contour_distance,
+                merge_all_vessels,
+                engine,
+                dirty_branches,
+                renamed_branches or {},
+            )
+        ):
+            self._paint_all(
+                ras_centerlines,
+                centerlines,
+                centerline_names,
+                radius,
+                branch_draw_order,
+                segmentation_node,
+                volume_node,
+                volume_dimensions,
+                np_ijk_to_ras,
+                reduction_factor,
+                reduction_threshold,
+                contour_distance,
+                merge_all_vessels,
+                engine,
+            )
 
-    Returns
-    ----------
+        self._key = key
+        self._segmentation_mtime = segmentation_node.GetSegmentation().GetMTime()
 
-    Newly adapted radius.
-    """
+    def _paint_all(
+        self,
+        ras_centerlines,
+        centerlines,
+        centerline_names,
+        radius,
+        branch_draw_order,
+        segmentation_node,
+        volume_node,
+        volume_dimensions,
+        ijk_to_ras,
+        reduction_factor,
+        reduction_threshold,
+        contour_distance,
+        merge_all_vessels,
+        engine,
+    ) -> None:
+        """
+        Clear the segmentation and paint every branch. See paint for the parameters, centerlines being given
+        both in RAS and in voxel coordinates.
+        """
+        self.reset()
+        segmentation = segmentation_node.GetSegmentation()
+
+        # Clear all segments of segmentation
+        progress_dialog = CustomStatusDialog(
+            windowTitle="Clearing all segments ...",
+            text="Please wait",
+            width=300,
+            height=50,
+        )
+        # Timer added to let the interface load
+        time.sleep(0.1)
+
+        progress_dialog.setText("Clearing all segments ...")
+        segmentation.RemoveAllSegments()
+        progress_dialog.close()
+
+        labels = [idx + 1 for idx in range(len(centerlines))]
+        self._segment_map, self._contours_map, self._ring = rasterize_tree(
+            ras_centerlines,
+            radius,
+            branch_draw_order,
+            ijk_to_ras,
+            tuple(volume_dimensions),
+            reduction_factor,
+            reduction_threshold,
+            contour_distance,
+            labels,
+            engine,
+            progress=lambda iterable: CustomProgressBar(
+                iterable=iterable,
+                quantity_to_measure="tiles painted",
+                windowTitle="Computing segment regions...",
+                width=300,
+            ),
+        )
 
-    return (
-        radius
-        if radius <= reduction_threshold
-        else (radius - reduction_threshold) * reduction_factor + reduction_threshold
-    )
+        progress_dialog = CustomStatusDialog(
+            windowTitle="Computing contours ...",
+            text="Please wait",
+            width=300,
+            height=50,
+        )
+        # Timer added to let the interface load
+        time.sleep(0.1)
 
+        if merge_all_vessels:
+            self._vessels_segment_id = segmentation.AddEmptySegment(
+                "", "Vessels", vessel_colors[0]
+            )
 
-def split_list(lst, n):
-    """
-    Split list in n parts.
-    """
-    for i in range(0, len(lst), n):
-        yield lst[i : i + n]
+        for idx, segment_name in enumerate(centerline_names):
+            self._branches[segment_name] = {
+                "label": labels[idx],
+                "centerline": centerlines[idx],
+                "radius": radius[idx],
+                "segment_id": None
+                if merge_all_vessels
+                else segmentation.AddEmptySegment(
+                    "", segment_name, vessel_colors[idx % len(vessel_colors)]
+                ),
+            }
+        self._draw_order = [centerline_names[idx] for idx in branch_draw_order]
+
+        # Add contours segment, also makes it transparent
+        self._contours_segment_id = segmentation.AddEmptySegment(
+            "", "Contours", contour_color
+        )
+        segmentation_node.GetDisplayNode().SetSegmentOpacity3D(
+            self._contours_segment_id, 0.1
+        )
+
+        self._import_segments(volume_node, segmentation_node, centerline_names)
+        progress_dialog.close()
+
+    def _paint_changed(
+        self,
+        centerlines,
+        centerline_names,
+        radius,
+        branch_draw_order,
+        segmentation_node,
+        volume_node,
+        spacing,
+        reduction_factor,
+        reduction_threshold,
+        contour_distance,
+        merge_all_vessels,
+        engine,
+        dirty_branches,
+        renamed_branches,
+    ) -> bool:
+        """
+        Only repaint the changed branches. See paint for the parameters.
+
+        Returns
+        ----------
+
+        False if an incremental paint is not possible, in which case nothing has been modified.
+        """
+        segmentation = segmentation_node.GetSegmentation()
+
+        # Every segment painted must still exist
+        segment_ids = [self._vessels_segment_id, self._contours_segment_id] + [
+            branch["segment_id"] for branch in self._branches.values()
+        ]
+        if any(
+            segment_id is not None and segmentation.GetSegment(segment_id) is None
+            for segment_id in segment_ids
+        ):
+            return False
+
+        # Follow the renames. The former branches that are not found anymore are deleted, which includes a branch
+        # whose name has been taken by a renamed one
+        new_names = {
+            previous_name: name
+            for name, previous_name in renamed_branches.items()
+            if previous_name in self._branches
+        }
+        branches, deleted = {}, []
+        for previous_name, branch in self._branches.items():
+            name = new_names.get(previous_name, previous_name)
+            if name in new_names.values() and previous_name not in new_names:
+                deleted.append(branch)
+            else:
+                branches[name] = branch
+
+        current = set(centerline_names)
+        deleted += [branch for name, branch in branches.items() if name not in current]
+        changed = [
+            name
+            for name in centerline_names
+            if name not in branches or name in dirty_branches
+        ]
+        unchanged = current.difference(changed)
+
+        # The relative draw order of the unchanged branches must be the same, for their overlaps to be unchanged
+        draw_order = [centerline_names[idx] for idx in branch_draw_order]
+        previous_draw_order = [
+            new_names.get(previous_name, previous_name)
+            for previous_name in self._draw_order
+        ]
+        if [name for name in draw_order if name in unchanged] != [
+            name for name in previous_draw_order if name in unchanged
+        ]:
+            return False
+
+        # Stable labels: the changed branches keep their label when possible, the new ones take the smallest free ones.
+        # A full paint, with a wider label type, is needed when the label map type cannot hold them
+        labels = {name: branches[name]["label"] for name in unchanged}
+        for name in changed:
+            if name in branches and branches[name]["label"] not in labels.values():
+                labels[name] = branches[name]["label"]
+        max_label = np.iinfo(self._segment_map.dtype).max
+        free = (
+            label for label in range(1, max_label + 1) if label not in labels.values()
+        )
+        for name in changed:
+            if name not in labels:
+                labels[name] = next(free, None)
+        if None in labels.values():
+            return False
+
+        # Regions to repaint: the former and the new extents of the changed branches
+        former = deleted + [branches[name] for name in changed if name in branches]
+        regions = [
+            centerline_bbox(branch["centerline"], branch["radius"], spacing)
+            for branch in former
+            if branch["centerline"].shape[0] > 0
+        ]
+        lower_edges, higher_edges = centerline_bboxes(centerlines, radius, spacing)
+        regions += [
+            (lower_edges[idx], higher_edges[idx])
+            for idx, name in enumerate(centerline_names)
+            if name in changed and centerlines[idx].shape[0] > 0
+        ]
+
+        # Repaint the regions, and list the labels found there before and after
+        adapted_radius = adapt_tree_radius(
+            radius, reduction_threshold, reduction_factor
+        )
+        label_list = [labels[name] for name in centerline_names]
+        sampling = spacing / np.min(spacing)
+        ring_margin = np.ceil((contour_distance + 2) / sampling).astype(int) + 1
+        touched_labels = set()
+
+        for lower_edge, higher_edge in regions:
+            box = tuple(
+                slice(max(low, 0), max(high, 0))
+                for low, high in zip(lower_edge, higher_edge)
+            )
+            touched_labels.update(np.unique(self._segment_map[box]).tolist())
+            paint_tree(
+                self._segment_map,
+                self._contours_map,
+                centerlines,
+                radius,
+                adapted_radius,
+                branch_draw_order,
+                label_list,
+                spacing,
+                reduction_threshold,
+                engine,
+                lower_edge,
+                higher_edge,
+            )
+            touched_labels.update(np.unique(self._segment_map[box]).tolist())
+            update_contour_ring(
+                self._ring,
+                self._contours_map,
+                contour_distance,
+                contour_distance + 2,
+                spacing,
+                lower_edge - ring_margin,
+                higher_edge + ring_margin,
+            )
+
+        # Update the segments
+        for branch in deleted:
+            if branch["segment_id"] is not None:
+                segmentation.RemoveSegment(branch["segment_id"])
+                self.segment_extents.pop(branch["segment_id"], None)
+
+        self._branches = {}
+        for idx, name in enumerate(centerline_names):
+            segment_id = branches[name]["segment_id"] if name in branches else None
+            if segment_id is None and not merge_all_vessels:
+                segment_id = segmentation.AddEmptySegment(
+                    "", name, vessel_colors[idx % len(vessel_colors)]
+                )
+            elif segment_id is not None:
+                segmentation.GetSegment(segment_id).SetName(name)
+
+            self._branches[name] = {
+                "label": labels[name],
+                "centerline": centerlines[idx],
+                "radius": radius[idx],
+                "segment_id": segment_id,
+            }
+        self._draw_order = draw_order
+
+        self._import_segments(
+            volume_node,
+            segmentation_node,
+            [
+                name
+                for name in centerline_names
+                if name in changed or labels[name] in touched_labels
+            ],
+        )
+
+        return True
+
+    def _import_segments(
+        self,
+        volume_node: slicer.vtkMRMLScalarVolumeNode,
+        segmentation_node: slicer.vtkMRMLSegmentationNode,
+        names: list[str],
+    ) -> None:
+        """
+        Write the painted branches and the contour ring into their segments.
+
+        Parameters
+        ----------
+
+        volume_node: input volume.
+        segmentation_node: segmentation_node on which segment are updated.
+        names: names of the branches to write, the other segments are left untouched.
+        """
+        if self._vessels_segment_id is not None:
+            # Merge all vessels in a single segment
+            ids = [self._vessels_segment_id, self._contours_segment_id]
+            data = (self._segment_map > 0).astype(np.uint8)
+        else:
+            # Labels of the written branches are mapped to 1, 2, ..., the other ones to 0
+            ids = [self._branches[name]["segment_id"] for name in names] + [
+                self._contours_segment_id
+            ]
+            lut = np.zeros(
+                max((branch["label"] for branch in self._branches.values()), default=0)
+                + 1,
+                dtype=label_dtype(len(ids)),
+            )
+            for idx, name in enumerate(names):
+                lut[self._branches[name]["label"]] = idx + 1
+            data = lut[self._segment_map]
+
+        data[self._ring] = len(ids)
+
+        # The imported box covers the former and the new extents of the written segments, so that every voxel
+        # they lose is cleared
+        corners = [
+            (np.array(extent[4::-2]), np.array(extent[5::-2]) + 1)
+            for extent in (self.segment_extents.get(segment_id) for segment_id in ids)
+            if extent is not None
+        ]
+        for segment_id, box in zip(ids, find_objects(data, max_label=len(ids))):
+            if box is None:
+                self.segment_extents[segment_id] = None
+                continue
+            corners.append(
+                (
+                    np.array([axis.start for axis in box]),
+                    np.array([axis.stop for axis in box]),
+                )
+            )
+            self.segment_extents[segment_id] = tuple(
+                bound for axis in box[::-1] for bound in (axis.start, axis.stop - 1)
+            )
+
+        if len(corners) == 0:
+            # Empty segments, a single voxel is enough to clear them
+            lower_edge, higher_edge = np.zeros(3, dtype=int), np.ones(3, dtype=int)
+        else:
+            lower_edge = np.min([lower for lower, _ in corners], axis=0)
+            higher_edge = np.max([higher for _, higher in corners], axis=0)
+
+        # Write the cropped labelmap inside the segmentation
+        crop = tuple(slice(low, high) for low, high in zip(lower_edge, higher_edge))
+        labelmap_node = create_labelmap_node(
+            volume_node, lower_edge, higher_edge, data.dtype.type
+        )
+        update_segment(
+            ids, labelmap_node, np.ascontiguousarray(data[crop]), segmentation_node
+        )
+        slicer.mrmlScene.RemoveNode(labelmap_node)
 
 
 def paint_segments(
@@ -121,9 +613,11 @@ def paint_segments(
     reduction_threshold: float,
     contour_distance: int,
     merge_all_vessels: bool,
+    engine: str = "capsule",
 ) -> None:
     """
     Paint the segmentations segments according to the centerlines and their associated radius.
+    Every segment is cleared and repainted, see SegmentPainter for incremental updates.
 
     Parameters
     ----------
@@ -138,257 +632,19 @@ def paint_segments(
     reduction_factor: amount of the reduction.
     contour_distance: distance in voxel between the vessel and the contour.
     merge_all_vessels: if True, this flag will put every vessels in the same segment, instead of separeted ones.
+    engine: "capsule" to paint each branch capsule by capsule, "edt" to paint each branch with a distance
+    transform of its centerline (see rasterization.paint_tree).
     """
-
-    # Important variables
-    voxel_spacing = np.array(volume_node.GetSpacing()[::-1])
-    volume_dimensions = np.array(volume_node.GetImageData().GetDimensions()[::-1])
-    segmentation = segmentation_node.GetSegmentation()
-
-    # Get the ras to ijk matrix as numpy array
-    ras_to_ijk = vtk.vtkMatrix4x4()
-    volume_node.GetRASToIJKMatrix(ras_to_ijk)
-    np_ras_to_ijk = np.zeros(shape=(4, 4))
-    ras_to_ijk.DeepCopy(np_ras_to_ijk.ravel(), ras_to_ijk)
-
-    # Clear all segments of segmentation
-    progress_dialog = CustomStatusDialog(
-        windowTitle="Clearing all segments ...",
-        text="Please wait",
-        width=300,
-        height=50,
-    )
-    # Timer added to let the interface load
-    time.sleep(0.1)
-
-    progress_dialog.setText("Clearing all segments ...")
-    segmentation.RemoveAllSegments()
-    progress_dialog.close()
-
-    # Ensure the labelmap has the same dimensions, spacing, orientation, localisation as the volume
-    labelmap_node = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLLabelMapVolumeNode")
-    labelmap_node.CopyOrientation(volume_node)
-    labelmap_node.SetOrigin(volume_node.GetOrigin())
-    labelmap_node.SetSpacing(voxel_spacing)
-    ijk_to_ras = vtk.vtkMatrix4x4()
-    volume_node.GetIJKToRASMatrix(ijk_to_ras)
-    labelmap_node.SetIJKToRASMatrix(ijk_to_ras)
-
-    labelmap_node.CreateDefaultDisplayNodes()
-    labelmap_node.SetAndObserveImageData(vtk.vtkImageData())
-    labelmap_node.GetImageData().SetDimensions(volume_dimensions)
-
-    # Set the labelmap pixel values to uint8 with one channel, it might become a problem later if there are more than 255 labels
-    labelmap_node.GetImageData().AllocateScalars(vtk.VTK_UNSIGNED_CHAR, 1)
-
-    # Transform ras coordinates (real world coordinates) into ijk coordinates (voxel coordinates)
-    centerlines = [
-        [
-            [(np_ras_to_ijk @ np.array([*point, 1]))[-2::-1] for point in list_part]
-            for list_part in split_list(centerline, 3)
-        ]
-        for centerline in centerlines
-    ]
-    radius = [list(split_list(radius_list, 3)) for radius_list in radius]
-
-    # Constants
-    x, y, z = np.indices(volume_dimensions)
-    low_bound = np.array([0, 0, 0], dtype=int)
-    high_bound = volume_dimensions - 1
-
-    # Paint centerlines
-    treated_radius = [
-        [
-            [
-                np.array([adapt_radius(r, reduction_threshold, reduction_factor)] * 3)
-                / voxel_spacing
-                for r in radius_part
-            ]
-            for radius_part in radius_per_centerline
-        ]
-        for radius_per_centerline in radius
-    ]
-    segment_map = np.zeros(volume_dimensions, dtype=np.uint8)
-
-    for centerline_idx in CustomProgressBar(
-        iterable=branch_draw_order,
-        quantity_to_measure="vessels painted",
-        windowTitle="Computing segment regions...",
-        width=300,
-    ):
-        centerline = centerlines[centerline_idx]
-        radius_per_centerline = treated_radius[centerline_idx]
-        sub_segment_map = np.zeros_like(segment_map, dtype=np.bool_)
-        for points, points_radius in zip(centerline, radius_per_centerline):
-            lower_edge, highter_edge = compute_bbox(
-                points, points_radius, low_bound, volume_dimensions
-            )
-            for point, radius_ in zip(points, points_radius):
-                center_x, center_y, center_z = point
-                radius_x, radius_y, radius_z = radius_
-
-                sphere_map = (
-                    (
-                        (
-                            x[
-                                lower_edge[0] : highter_edge[0],
-                                lower_edge[1] : highter_edge[1],
-                                lower_edge[2] : highter_edge[2],
-                            ]
-                            - center_x
-                        )
-                        ** 2
-                        / radius_x**2
-                        + (
-                            y[
-                                lower_edge[0] : highter_edge[0],
-                                lower_edge[1] : highter_edge[1],
-                                lower_edge[2] : highter_edge[2],
-                            ]
-                            - center_y
-                        )
-                        ** 2
-                        / radius_y**2
-                        + (
-                            z[
-                                lower_edge[0] : highter_edge[0],
-                                lower_edge[1] : highter_edge[1],
-                                lower_edge[2] : highter_edge[2],
-                            ]
-                            - center_z
-                        )
-                        ** 2
-                        / radius_z**2
-                    )
-                    <= 1
-                ).astype(np.bool_)
-                closest_pixel_to_paint = np.maximum(
-                    np.minimum(
-                        [round(coord) for coord in point], high_bound, dtype=int
-                    ),
-                    low_bound,
-                    dtype=int,
-                )
-
-                sub_segment_map[
-                    closest_pixel_to_paint[0],
-                    closest_pixel_to_paint[1],
-                    closest_pixel_to_paint[2],
-                ] = True
-                sub_segment_map[
-                    lower_edge[0] : highter_edge[0],
-                    lower_edge[1] : highter_edge[1],
-                    lower_edge[2] : highter_edge[2],
-                ] += sphere_map
-
-        segment_map[sub_segment_map] = centerline_idx + 1
-
-    del treated_radius
-
-    # Paint contours
-    contours_map = (segment_map > 0).astype(np.bool_)
-    # Filtering point that have not been shrunk
-    centerline_and_radius = [
-        [centerline_part, [np.array([r] * 3) / voxel_spacing for r in radius_part]]
-        for (centerline, radius_per_centerline) in zip(centerlines, radius)
-        for (centerline_part, radius_part) in zip(centerline, radius_per_centerline)
-        if any(map(lambda x: x > reduction_threshold, radius_part))
-    ]
-
-    for points, points_radius in centerline_and_radius:
-        lower_edge, highter_edge = compute_bbox(
-            points, points_radius, low_bound, volume_dimensions
-        )
-        for point, radius_ in zip(points, points_radius):
-            center_x, center_y, center_z = point
-            radius_x, radius_y, radius_z = radius_
-
-            sphere_map = (
-                (
-                    (
-                        x[
-                            lower_edge[0] : highter_edge[0],
-                            lower_edge[1] : highter_edge[1],
-                            lower_edge[2] : highter_edge[2],
-                        ]
-                        - center_x
-                    )
-                    ** 2
-                    / radius_x**2
-                    + (
-                        y[
-                            lower_edge[0] : highter_edge[0],
-                            lower_edge[1] : highter_edge[1],
-                            lower_edge[2] : highter_edge[2],
-                        ]
-                        - center_y
-                    )
-                    ** 2
-                    / radius_y**2
-                    + (
-                        z[
-                            lower_edge[0] : highter_edge[0],
-                            lower_edge[1] : highter_edge[1],
-                            lower_edge[2] : highter_edge[2],
-                        ]
-                        - center_z
-                    )
-                    ** 2
-                    / radius_z**2
-                )
-                <= 1
-            ).astype(np.bool_)
-            contours_map[
-                lower_edge[0] : highter_edge[0],
-                lower_edge[1] : highter_edge[1],
-                lower_edge[2] : highter_edge[2],
-            ] += sphere_map
-
-    progress_dialog = CustomStatusDialog(
-        windowTitle="Computing contours ...", text="Please wait", width=300, height=50
-    )
-    # Timer added to let the interface load
-    time.sleep(0.1)
-
-    # Outter edge
-    progress_dialog.setText("Computing the outter edge ...")
-    contours_dilated = binary_dilation(contours_map, ball(radius=contour_distance + 2))
-
-    # Inner edge
-    progress_dialog.setText("Computing the inner edge ...")
-    contours_dilated[
-        binary_dilation(contours_map, ball(radius=contour_distance))
-    ] = False
-    del contours_map
-
-    # Add the segment to the segmentation, also merge the segment and contour map
-    ids = []
-    if merge_all_vessels:
-        segment_map = (segment_map > 0).astype(np.uint8) + (
-            contours_dilated * 2
-        ).astype(np.uint8)
-        ids.append(segmentation.AddEmptySegment("", "Vessels", vessel_colors[0]))
-    else:
-        segment_map += (contours_dilated * (len(centerlines) + 1)).astype(np.uint8)
-        for idx, segment_name in enumerate(centerline_names):
-            ids.append(
-                segmentation.AddEmptySegment(
-                    "", segment_name, vessel_colors[idx % len(vessel_colors)]
-                )
-            )
-    del contours_dilated
-
-    # Add contours to segment id list, also makes it transparent
-    ids.append(segmentation.AddEmptySegment("", "Contours", contour_color))
-    segmentation_node.GetDisplayNode().SetSegmentOpacity3D(ids[-1], 0.1)
-
-    # Write the labelmap inside the segmentation
-    update_segment(
-        ids,
-        labelmap_node,
-        segment_map,
+    SegmentPainter().paint(
+        volume_node,
+        centerlines,
+        centerline_names,
+        radius,
+        branch_draw_order,
         segmentation_node,
+        reduction_factor,
+        reduction_threshold,
+        contour_distance,
+        merge_all_vessels,
+        engine,
     )
-
-    slicer.mrmlScene.RemoveNode(labelmap_node)
-    progress_dialog.close()
@@ -0,0 +1,30 @@
+from contextlib import contextmanager
+import slicer
+
+
+@contextmanager
+def batch_scene_update(tree_widget=None):
+    """
+    Context manager to modify many MRML nodes at once, e.g. when loading or clearing the tree.
+
+    The scene is in batch processing state and the rendering is paused, so the scene events and the render
+    happen once at the end instead of after each node modified. The updates of the tree widget are suspended too.
+    It can be nested, only the outermost one flushes the updates.
+
+    Parameters
+    ----------
+
+    tree_widget: widget whose updates are suspended, None to only batch the scene updates.
+    """
+    updates_enabled = tree_widget is not None and tree_widget.updatesEnabled
+    if updates_enabled:
+        tree_widget.setUpdatesEnabled(False)
+    slicer.app.pauseRender()
+    slicer.mrmlScene.StartState(slicer.vtkMRMLScene.BatchProcessState)
+    try:
+        yield
+    finally:
+        slicer.mrmlScene.EndState(slicer.vtkMRMLScene.BatchProcessState)
+        slicer.app.resumeRender()
+        if updates_enabled:
+            tree_widget.setUpdatesEnabled(True)
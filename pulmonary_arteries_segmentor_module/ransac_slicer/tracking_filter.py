@@ -0,0 +1,210 @@
+import numpy as np
+
+
+class prediction:
+    """
+    Predicted pose of the next cylinder, with the search windows derived from its uncertainty
+    """
+
+    def __init__(self, center, direction, radius, a_max, r_min, r_max, ray_len):
+        """
+        Initialize a prediction
+
+        Args:
+            center (np.array(dtype=np.float64)): Predicted center of the next cylinder
+            direction (np.array(dtype=np.float64)): Predicted unit direction of the next cylinder
+            radius (float): Predicted radius of the next cylinder
+            a_max (float): Maximum angle between the candidate axes and the predicted direction
+            r_min (float): Proportion of the predicted radius to take as min value of acceptable radius
+            r_max (float): Proportion of the predicted radius to take as max value of acceptable radius
+            ray_len (float): Length of a cast ray, as a proportion of the predicted radius
+        """
+
+        self.center = center
+        self.direction = direction
+        self.radius = radius
+        self.a_max = a_max
+        self.r_min = r_min
+        self.r_max = r_max
+        self.ray_len = ray_len
+
+
+class tracking_filter:
+    """
+    Kalman-style estimator of the tracked vessel state (center, direction, radius), under a constant curvature model.
+    Each quantity has a scalar variance: the prediction increases it proportionally to the step length with a process
+    noise learnt from the innovations, and each accepted cylinder (measurement) reduces it.
+    The predicted uncertainty narrows the angular cone, the radius window and the ray length of the next RANSAC search.
+    """
+
+    def __init__(
+        self,
+        cyl,
+        cfg,
+        n_sigma=3,
+        a_min=np.pi / 12,
+        r_margin=0.15,
+        measurement_angle=0.05,
+        measurement_radius=0.05,
+        prior_angle=0.1,
+        forgetting=0.3,
+    ):
+        """
+        Initialize the filter from the first cylinder. The initial uncertainties match the windows of cfg, so that the
+        angular and radius windows of the first search are the same as without filter. Its rays are shorter though,
+        they only reach past the largest acceptable radius (see predict).
+
+        Args:
+            cyl (cylinder): Initial cylinder
+            cfg (config): Tracking configuration, its windows are upper bounds of the predicted ones
+            n_sigma (float, optional): Number of standard deviations covered by the windows. Defaults to 3.
+            a_min (float, optional): Minimum half-angle of the axis cone. Defaults to np.pi/12.
+            r_margin (float, optional): Minimum relative half-width of the radius window. Defaults to 0.15.
+            measurement_angle (float, optional): Standard deviation of the measured direction, in radians.
+                                                 Defaults to 0.05.
+            measurement_radius (float, optional): Standard deviation of the measured radius, as a proportion of the
+                                                  radius. Defaults to 0.05.
+            prior_angle (float, optional): Standard deviation of the direction given by the vesselness prior, in
+                                           radians. Defaults to 0.1.
+            forgetting (float, optional): Weight of the last innovation in the process noise estimate, in [0,1].
+                                          Defaults to 0.3.
+        """
+
+        self.cfg = cfg
+        self.n_sigma = n_sigma
+        self.a_min = a_min
+        self.r_margin = r_margin
+        self.forgetting = forgetting
+
+        self.center = np.asarray(cyl.center, dtype=np.float64).copy()
+        self.direction = np.asarray(cyl.direction, dtype=np.float64).copy()
+        self.radius = cyl.radius
+
+        # Change of direction per unit length, orthogonal to the direction
+        self.curvature = np.zeros(3)
+
+        # Last measured direction, and its angle to the one measured before: the axis cone never gets narrower than
+        # the turn actually observed between two consecutive cylinders
+        self.measured_direction = self.direction.copy()
+        self.turn_angle = 0.0
+
+        # Variances of the direction (rad^2) and of the relative radius
+        self.var_angle = (cfg.a_max / n_sigma) ** 2
+        self.var_radius = (max(1 - cfg.r_min, cfg.r_max - 1) / n_sigma) ** 2
+
+        # Process noises, per unit length, and measurement noises
+        self.q_angle = self.var_angle
+        self.q_radius = self.var_radius
+        self.r_angle = measurement_angle**2
+        self.r_radius = measurement_radius**2
+        self.r_prior = prior_angle**2
+
+        self._pred = None
+        self._step = 0
+
+    def predict(self, step, prior=None):
+        """
+        Predict the next cylinder after advancing of step along the vessel
+
+        Args:
+            step (float): Advance length
+            prior (np.array(dtype=np.float64), optional): Vessel direction given by the vesselness prior at the current
+                                                          center, oriented as the current direction. Defaults to None.
+
+        Returns:
+            prediction: Predicted pose and search windows
+        """
+
+        # The prior is fused with the current direction as a measurement. The variance is kept, since the prior is
+        # not independent of the next measurement
+        start_direction = self.direction
+        if prior is not None:
+            k = self.var_angle / (self.var_angle + self.r_prior)
+            start_direction = self.direction + k * (prior - self.direction)
+            start_direction /= np.linalg.norm(start_direction)
+
+        # Constant curvature: rotate the direction by curvature * step, and advance along the mean direction
+        direction = start_direction + self.curvature * step
+        direction /= np.linalg.norm(direction)
+        mean_direction = start_direction + direction
+        mean_direction /= np.linalg.norm(mean_direction)
+        center = self.center + step * mean_direction
+
+        # Uncertainty grows with the advance, relative to the vessel radius
+        s = step / self.radius if self.radius > 0 else 0
+        var_angle = self.var_angle + self.q_angle * s
+        var_radius = self.var_radius + self.q_radius * s
+
+        sigma_angle = self.n_sigma * np.sqrt(var_angle)
+        sigma_radius = max(self.n_sigma * np.sqrt(var_radius), self.r_margin)
+
+        a_max = float(
+            np.clip(max(sigma_angle, self.turn_angle), self.a_min, self.cfg.a_max)
+        )
+        r_min = max(self.cfg.r_min, 1 - sigma_radius)
+        r_max = min(self.cfg.r_max, 1 + sigma_radius)
+
+        # Rays only need to reach past the largest acceptable radius (points are kept up to 0.9 times the ray length)
+        ray_len = min(self.cfg.ray_len, max(1.25 * r_max, r_max + self.r_margin))
+
+        self._pred = (direction, var_angle, var_radius)
+        self._step = s
+
+        return prediction(center, direction, self.radius, a_max, r_min, r_max, ray_len)
+
+    def update(self, cyl):
+        """
+        Correct the state with an accepted cylinder
+
+        Args:
+            cyl (cylinder): Cylinder found at the predicted location
+        """
+
+        if self._pred is None:
+            self.predict(0)
+
+        direction, var_angle, var_radius = self._pred
+        measured = np.asarray(cyl.direction, dtype=np.float64)
+
+        if measured @ direction < 0:
+            measured = -measured
+
+        # Direction update
+        innovation_angle = np.arccos(np.clip(measured @ direction, -1, 1))
+        k = var_angle / (var_angle + self.r_angle)
+        new_direction = direction + k * (measured - direction)
+        new_direction /= np.linalg.norm(new_direction)
+        self.var_angle = (1 - k) * var_angle
+
+        # Radius update, in relative terms
+        innovation_radius = (cyl.radius - self.radius) / self.radius
+        k = var_radius / (var_radius + self.r_radius)
+        new_radius = self.radius * (1 + k * innovation_radius)
+        self.var_radius = (1 - k) * var_radius
+
+        # Curvature from the change of direction between the two centers
+        step = np.linalg.norm(cyl.center - self.center)
+        if step > 0:
+            turn = new_direction - self.direction
+            turn -= (turn @ new_direction) * new_direction
+            self.curvature = (
+                1 - self.forgetting
+            ) * self.curvature + self.forgetting * turn / step
+
+        self.turn_angle = float(
+            np.arccos(np.clip(abs(measured @ self.measured_direction), 0, 1))
+        )
+        self.measured_direction = measured
+
+        # Learn the process noises from the innovations, per unit of relative advance
+        if self._step > 0:
+            f = self.forgetting
+            self.q_angle = (1 - f) * self.q_angle + f * innovation_angle**2 / self._step
+            self.q_radius = (
+                1 - f
+            ) * self.q_radius + f * innovation_radius**2 / self._step
+
+        self.center = np.asarray(cyl.center, dtype=np.float64).copy()
+        self.direction = new_direction
+        self.radius = new_radius
+        self._pred = None
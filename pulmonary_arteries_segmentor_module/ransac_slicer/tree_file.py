@@ -0,0 +1,183 @@
+import json
+import os
+from typing import Iterable, Union
+import numpy as np
+from .ragged import RaggedPoints
+
+
+TREE_FORMAT = "pulmonary_arteries_tree"
+TREE_VERSION = 1
+HEADER_NAME = "header.json"
+
+# Flat buffers of the tree, saved as .npy files next to the header
+BUFFER_NAMES = (
+    "centerlines",  # points of all the centerlines, as a (N, 3) float64 array
+    "centerline_offsets",  # start of each branch in centerlines, followed by N
+    "centerline_radius",  # radius of each point of the centerlines, as a (N,) float64 array
+    "contour_points",  # contour points of all the centerline points, as a (M, 3) float32 array
+    "contour_offsets",  # start of the contour points of each centerline point, followed by M
+)
+
+
+def _save_array(path: str, array: np.ndarray) -> None:
+    """
+    Save an array as a .npy file, replacing the former one only once it is fully written.
+
+    Writing in place would truncate a file which may still be memory mapped by a loaded tree.
+    Windows does not allow to replace a mapped file either, the maps must be released first,
+    see GraphBranches.release_memory_maps.
+    """
+    with open(path + ".tmp", "wb") as f:
+        np.save(f, array)
+    os.replace(path + ".tmp", path)
+
+
+def save_tree(
+    folder_path: str, nodes: dict, branches: Iterable, parents: list[Union[str, None]]
+) -> str:
+    """
+    Save a vessel tree in the binary tree format.
+
+    The tree is a folder holding a small JSON header, with the nodes and the name, edge and parent of each branch,
+    and the points of all the branches in a few flat .npy buffers, which can be loaded lazily with TreeFile.
+
+    Parameters
+    ----------
+
+    folder_path: folder where the tree is saved, created if needed.
+    nodes: position of each node of the graph, by node id.
+    branches: branches of the tree, see Branch, each one coming after its parent (e.g. in depth first order).
+    parents: name of the parent of each branch, None for the root.
+
+    Returns
+    ----------
+
+    The path of the header of the tree.
+    """
+    os.makedirs(folder_path, exist_ok=True)
+
+    branches = list(branches)
+    contour_points = RaggedPoints.concatenate(
+        [branch.contour_points for branch in branches]
+    )
+    buffers = {
+        "centerlines": np.concatenate(
+            [np.asarray(branch.centerline, dtype=np.float64) for branch in branches]
+        )
+        if len(branches) != 0
+        else np.zeros((0, 3)),
+        "centerline_offsets": np.concatenate(
+            [[0], np.cumsum([len(branch.centerline) for branch in branches])]
+        ).astype(np.int64),
+        "centerline_radius": np.concatenate(
+            [[]]
+            + [
+                np.asarray(branch.centerline_radius, dtype=np.float64)
+                for branch in branches
+            ]
+        ),
+        "contour_points": contour_points.data,
+        "contour_offsets": contour_points.offsets,
+    }
+    for name in BUFFER_NAMES:
+        _save_array(os.path.join(folder_path, name + ".npy"), buffers[name])
+
+    header = {
+        "format": TREE_FORMAT,
+        "version": TREE_VERSION,
+        "nodes": {
+            str(node_id): np.asarray(position, dtype=np.float64).tolist()
+            for node_id, position in nodes.items()
+        },
+        "branches": [
+            {
+                "name": branch.name,
+                "edge": [int(branch.edge[0]), int(branch.edge[1])],
+                "parent": parent,
+            }
+            for branch, parent in zip(branches, parents)
+        ],
+    }
+    header_path = os.path.join(folder_path, HEADER_NAME)
+    with open(header_path + ".tmp", "w") as f:
+        json.dump(header, f)
+    os.replace(header_path + ".tmp", header_path)
+
+    return header_path
+
+
+def is_tree_header(file_path: str) -> bool:
+    """
+    Check if a file is the header of a tree saved with save_tree, rather than a networkX JSON graph.
+    """
+    return os.path.basename(file_path) == HEADER_NAME and all(
+        os.path.isfile(os.path.join(os.path.dirname(file_path), name + ".npy"))
+        for name in BUFFER_NAMES
+    )
+
+
+class TreeFile:
+    """
+    Vessel tree loaded from the binary tree format.
+
+    The buffers are memory mapped, so the points of a branch are only read from the disk when used.
+    """
+
+    def __init__(self, header_path: str) -> None:
+        """
+        Parameters
+        ----------
+
+        header_path: path of the header of the tree, see save_tree.
+        """
+        with open(header_path) as f:
+            header = json.load(f)
+        if header.get("format") != TREE_FORMAT:
+            raise ValueError(f"{header_path} is not a vessel tree header")
+        if header.get("version", 0) > TREE_VERSION:
+            raise ValueError(
+                f"{header_path} was saved with a newer version of the tree format"
+            )
+
+        self.nodes = {
+            int(node_id): np.array(position)
+            for node_id, position in header["nodes"].items()
+        }
+        self.names = [branch["name"] for branch in header["branches"]]
+        self.edges = [tuple(branch["edge"]) for branch in header["branches"]]
+        self.parents = [branch["parent"] for branch in header["branches"]]
+
+        folder_path = os.path.dirname(header_path)
+        self.buffers = {
+            name: np.load(os.path.join(folder_path, name + ".npy"), mmap_mode="r")
+            for name in BUFFER_NAMES
+        }
+        # The offsets are small, they are kept in memory
+        self.centerline_offsets = np.array(self.buffers["centerline_offsets"])
+        self.contour_offsets = np.array(self.buffers["contour_offsets"])
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def centerline(self, idx: int) -> np.ndarray:
+        """
+        Points of the centerline of the branch idx, as a read only memory mapped array.
+        """
+        start, end = self.centerline_offsets[idx : idx + 2]
+        return self.buffers["centerlines"][start:end]
+
+    def centerline_radius(self, idx: int) -> np.ndarray:
+        """
+        Radius of each point of the centerline of the branch idx, as a read only memory mapped array.
+        """
+        start, end = self.centerline_offsets[idx : idx + 2]
+        return self.buffers["centerline_radius"][start:end]
+
+    def contour_points(self, idx: int) -> RaggedPoints:
+        """
+        Contour points of each point of the centerline of the branch idx, sharing the memory mapped buffer.
+        """
+        start, end = self.centerline_offsets[idx : idx + 2]
+        return RaggedPoints(
+            self.buffers["contour_points"], self.contour_offsets[start : end + 1]
+        )
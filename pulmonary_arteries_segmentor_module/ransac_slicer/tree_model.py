@@ -0,0 +1,247 @@
+from collections import deque
+from typing import Iterator, Union
+from .signal_utils import Signal
+
+
+class TreeModel:
+    """
+    Topology of the branch tree, independent of any widget.
+
+    Each branch is a node identified by its name, the parent and children of every node are stored so that
+    topology queries do not depend on the state of the tree widget. The widget (see BranchTree) is a view
+    following the changes through the signals of the model.
+
+    The traversal orders, depths and subtree sizes of the whole tree are cached until the next structural edit.
+    """
+
+    def __init__(self) -> None:
+        self._parent: dict[str, Union[str, None]] = {}
+        self._children: dict[str, list[str]] = {}
+        self.root = None
+        self._cache = {}
+
+        self.nodeInserted = Signal(str, "str or None", bool)
+        self.nodeRemoved = Signal(str)
+        self.nodeRenamed = Signal(str, str)
+        self.cleared = Signal()
+
+    def __len__(self) -> int:
+        return len(self._parent)
+
+    def __contains__(self, node_id: str) -> bool:
+        return node_id in self._parent
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._parent)
+
+    def _detach(self, node_id: str) -> None:
+        """
+        Remove a node from the children of its parent, if it is already in the tree.
+        """
+        if node_id not in self._parent:
+            self._children[node_id] = []
+            return
+
+        parent_id = self._parent[node_id]
+        if parent_id is not None:
+            self._children[parent_id].remove(node_id)
+        elif self.root == node_id:
+            self.root = None
+
+    def _insert(
+        self,
+        node_id: str,
+        parent_id: Union[str, None],
+        become_intermediary_parent: bool = False,
+    ) -> None:
+        self._detach(node_id)
+        if not parent_id:
+            # The new node becomes the root, the former root becomes its child
+            if self.root is not None and self.root != node_id:
+                self._parent[self.root] = node_id
+                self._children[node_id].append(self.root)
+            self._parent[node_id] = None
+            self.root = node_id
+        else:
+            children = list(self._children[parent_id])
+            self._children[parent_id].append(node_id)
+            self._parent[node_id] = parent_id
+
+            if become_intermediary_parent and len(children) >= 2:
+                for child in children:
+                    self._insert(child, node_id)
+
+    def insert_after_node(
+        self,
+        node_id: str,
+        parent_id: Union[str, None],
+        become_intermediary_parent: bool = False,
+    ) -> None:
+        """
+        Insert a node as the last child of a parent, or as the root if the parent is None.
+
+        Parameters
+        ----------
+
+        node_id: name of the node to insert, it is moved if it is already in the tree.
+        parent_id: name of the parent node, None to insert the node as root, the former root becoming its child.
+        become_intermediary_parent: flag to move the children of the parent under the new node, when the
+        parent has at least 2 children, e.g. when a branch is split.
+        """
+        if parent_id and parent_id not in self._parent:
+            raise ValueError(f"{parent_id} is not in the tree")
+
+        self._insert(node_id, parent_id, become_intermediary_parent)
+        self._cache = {}
+        self.nodeInserted.emit(node_id, parent_id, become_intermediary_parent)
+
+    def remove_node(self, node_id: str) -> bool:
+        """
+        Remove a node from the tree, its children are moved to its parent. The root can not be removed.
+
+        Parameters
+        ----------
+
+        node_id: name of the node to remove.
+
+        Returns
+        ----------
+
+        True if the node was removed, False if it is the root.
+        """
+        parent_id = self._parent[node_id]
+        if parent_id is None:
+            return False
+
+        self._children[parent_id].remove(node_id)
+        for child in self._children.pop(node_id):
+            self._children[parent_id].append(child)
+            self._parent[child] = parent_id
+        del self._parent[node_id]
+
+        self._cache = {}
+        self.nodeRemoved.emit(node_id)
+        return True
+
+    def rename(self, previous: str, new: str) -> None:
+        """
+        Rename a node, the new name must not be used by another node.
+        """
+        if new == previous:
+            return
+        if new in self._parent:
+            raise ValueError(f"{new} is already in the tree")
+
+        parent_id = self._parent.pop(previous)
+        self._parent[new] = parent_id
+        if parent_id is not None:
+            siblings = self._children[parent_id]
+            siblings[siblings.index(previous)] = new
+        else:
+            self.root = new
+        self._children[new] = self._children.pop(previous)
+        for child in self._children[new]:
+            self._parent[child] = new
+
+        self._cache = {}
+        self.nodeRenamed.emit(previous, new)
+
+    def clear(self) -> None:
+        """
+        Remove every node.
+        """
+        self._parent = {}
+        self._children = {}
+        self.root = None
+        self._cache = {}
+        self.cleared.emit()
+
+    def parent(self, node_id: str) -> Union[str, None]:
+        """
+        Name of the parent of a node, None if it is the root.
+        """
+        return self._parent[node_id]
+
+    def children(self, node_id: str) -> list[str]:
+        """
+        Names of the children of a node, in the order they were inserted.
+        """
+        return list(self._children[node_id])
+
+    def is_root(self, node_id: str) -> bool:
+        return self._parent[node_id] is None
+
+    def is_leaf(self, node_id: str) -> bool:
+        return len(self._children[node_id]) == 0
+
+    def bfs(self, node_id: Union[str, None] = None) -> list[str]:
+        """
+        Names of the nodes of a subtree in breadth first order.
+
+        Parameters
+        ----------
+
+        node_id: root of the subtree, the root of the tree if None (cached).
+        """
+        if node_id is None or node_id == self.root:
+            if "bfs" not in self._cache:
+                self._cache["bfs"] = [] if self.root is None else self._bfs(self.root)
+            return list(self._cache["bfs"])
+
+        return self._bfs(node_id)
+
+    def _bfs(self, node_id: str) -> list[str]:
+        order = [node_id]
+        queue = deque([node_id])
+        while queue:
+            children = self._children[queue.popleft()]
+            order += children
+            queue.extend(children)
+
+        return order
+
+    def dfs(self) -> list[str]:
+        """
+        Names of the nodes of the tree in depth first pre-order, each node coming after its parent (cached).
+        """
+        if "dfs" not in self._cache:
+            self._cache["dfs"] = [] if self.root is None else self.subtree(self.root)
+        return list(self._cache["dfs"])
+
+    def depth(self, node_id: str) -> int:
+        """
+        Number of ancestors of a node, 0 for the root (cached).
+        """
+        if "depth" not in self._cache:
+            depths = {}
+            for current in self.bfs():
+                parent_id = self._parent[current]
+                depths[current] = 0 if parent_id is None else depths[parent_id] + 1
+            self._cache["depth"] = depths
+        return self._cache["depth"][node_id]
+
+    def subtree_size(self, node_id: str) -> int:
+        """
+        Number of nodes of the subtree of a node, including the node (cached).
+        """
+        if "subtree_size" not in self._cache:
+            sizes = {}
+            for current in reversed(self.bfs()):
+                sizes[current] = 1 + sum(
+                    sizes[child] for child in self._children[current]
+                )
+            self._cache["subtree_size"] = sizes
+        return self._cache["subtree_size"][node_id]
+
+    def subtree(self, node_id: str) -> list[str]:
+        """
+        Names of the nodes of the subtree of a node, in depth first pre-order, starting with the node.
+        """
+        order = []
+        stack = [node_id]
+        while stack:
+            current = stack.pop()
+            order.append(current)
+            stack.extend(reversed(self._children[current]))
+
+        return order
@@ -0,0 +1,506 @@
+import hashlib
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import scipy.ndimage as sndi
+
+# Support of the Gaussian filters, in standard deviations (the scipy default)
+TRUNCATE = 4.0
+
+# Maximum number of threads computing the vesselness
+MAX_WORKERS = 4
+
+
+def _hessian(data, sigma, spacing):
+    """
+    Compute the scale-normalized Hessian of a 3D array at scale sigma (in millimeters)
+
+    Args:
+        data (np.array(dtype=np.float32)): Input array
+        sigma (float): Scale of the Gaussian derivatives, in millimeters
+        spacing (np.array(dtype=np.float64)): Voxel size along each array axis
+
+    Returns:
+        list: The 6 Hessian components (xx, xy, xz, yy, yz, zz), each with the shape of data
+    """
+
+    sigma_vox = sigma / spacing
+    h = []
+
+    for a in range(3):
+        for b in range(a, 3):
+            order = [0, 0, 0]
+            order[a] += 1
+            order[b] += 1
+            d = sndi.gaussian_filter(
+                data, sigma_vox, order=order, mode="nearest", truncate=TRUNCATE
+            )
+
+            # Express the derivative in millimeters and normalize it with respect to the scale
+            h.append(d * (sigma * sigma / (spacing[a] * spacing[b])))
+
+    return h
+
+
+def _structureness(h):
+    """
+    Second order structureness of voxels, the Frobenius norm of their Hessian (sqrt(l1^2 + l2^2 + l3^2))
+
+    Args:
+        h (list): The 6 Hessian components of N voxels, as returned by _hessian
+
+    Returns:
+        np.array(dtype=np.float32): Structureness of the N voxels
+    """
+
+    hxx, hxy, hxz, hyy, hyz, hzz = h
+
+    return np.sqrt(
+        hxx * hxx + hyy * hyy + hzz * hzz + 2 * (hxy * hxy + hxz * hxz + hyz * hyz)
+    )
+
+
+def _frangi(h, alpha, beta, c):
+    """
+    Frangi vesselness of bright tubular structures, and the associated vessel direction
+
+    Args:
+        h (list): The 6 Hessian components of N voxels, as returned by _hessian (flattened)
+        alpha (float): Sensitivity to the plate-like / line-like ratio
+        beta (float): Sensitivity to the blob-like ratio
+        c (float): Sensitivity to the second order structureness, strictly positive
+
+    Returns:
+        np.array(dtype=np.float32): Vesselness of the N voxels
+        np.array(dtype=np.float32): Nx3 array of unit vessel directions (eigenvector of the smallest eigenvalue)
+    """
+
+    hxx, hxy, hxz, hyy, hyz, hzz = h
+    m = np.empty((hxx.shape[0], 3, 3), dtype=np.float32)
+    m[:, 0, 0], m[:, 0, 1], m[:, 0, 2] = hxx, hxy, hxz
+    m[:, 1, 0], m[:, 1, 1], m[:, 1, 2] = hxy, hyy, hyz
+    m[:, 2, 0], m[:, 2, 1], m[:, 2, 2] = hxz, hyz, hzz
+
+    w, v = np.linalg.eigh(m)
+
+    # Sort eigenvalues by increasing magnitude: |l1| <= |l2| <= |l3|
+    idx = np.argsort(np.abs(w), axis=1)
+    w = np.take_along_axis(w, idx, axis=1)
+    l1, l2, l3 = w[:, 0], w[:, 1], w[:, 2]
+    direction = np.take_along_axis(v, idx[:, None, :], axis=2)[:, :, 0]
+
+    eps = np.finfo(np.float32).eps
+    ra = np.abs(l2) / (np.abs(l3) + eps)
+    rb = np.abs(l1) / (np.sqrt(np.abs(l2 * l3)) + eps)
+    s = np.sqrt(l1 * l1 + l2 * l2 + l3 * l3)
+
+    vesselness = (
+        (1 - np.exp(-(ra * ra) / (2 * alpha * alpha)))
+        * np.exp(-(rb * rb) / (2 * beta * beta))
+        * (1 - np.exp(-(s * s) / (2 * c * c)))
+    )
+
+    # Only bright vessels on a dark background: l2 and l3 must be negative
+    vesselness[(l2 > 0) | (l3 > 0)] = 0
+
+    return vesselness.astype(np.float32), direction.astype(np.float32)
+
+
+class vesselness_map:
+    """
+    Multi-scale Hessian (Frangi) vesselness and principal direction field of a volume, restricted to a ROI.
+    Used as a prior for the tracking: the local vessel direction orders the candidate axes of the RANSAC search, and
+    predicts where the next cylinder center lies.
+    """
+
+    def __init__(
+        self,
+        vesselness=np.zeros((0, 0, 0), dtype=np.float32),
+        direction=np.zeros((0, 0, 0, 3), dtype=np.float32),
+        ijk_to_ras=np.eye(4),
+        roi_origin=np.zeros(3, dtype=int),
+        threshold=0.05,
+    ):
+        """
+        Initializes a vesselness map
+
+        Args:
+            vesselness (np.array(dtype=np.float32), optional): Vesselness of each voxel of the ROI, normalized in
+                                                               [0,1]. Defaults to an empty array.
+            direction (np.array(dtype=np.float16), optional): Unit vessel direction of each voxel of the ROI,
+                                                              expressed in the IJK frame scaled to millimeters.
+                                                              Defaults to an empty array.
+            ijk_to_ras (np.array(dtype=np.float64), optional): IJK to RAS transform of the whole volume.
+                                                               Defaults to np.eye(4).
+            roi_origin (np.array(dtype=int), optional): IJK index of the first voxel of the ROI. Defaults to 0.
+            threshold (float, optional): Vesselness below which no prior is given. Defaults to 0.05.
+
+        Raises:
+            ValueError: If the vesselness and direction shapes do not match
+        """
+
+        if direction.shape != (*vesselness.shape, 3):
+            raise ValueError
+
+        self.vesselness = vesselness
+        self.direction_field = direction
+        self.roi_origin = np.asarray(roi_origin, dtype=int)
+        self.threshold = threshold
+        self.ijk_to_ras = ijk_to_ras
+
+    @property
+    def ijk_to_ras(self):
+        """
+        Getter for IJK to RAS transform
+
+        Returns:
+            np.array(dtype=np.float64): IJK to RAS transform
+        """
+
+        return self._ijk_to_ras
+
+    @ijk_to_ras.setter
+    def ijk_to_ras(self, m):
+        """
+        Setter for IJK to RAS transform.
+        Also updates the rotation from the millimeter-scaled IJK frame, in which directions are stored, to RAS.
+
+        Args:
+            m (np.array(dtype=np.float64)): New IJK to RAS transform
+        """
+
+        self._ijk_to_ras = np.asarray(m, dtype=np.float64).copy()
+        self._ras_to_ijk = np.linalg.inv(self._ijk_to_ras)
+        self._dir_to_ras = self._ijk_to_ras[:3, :3] / np.linalg.norm(
+            self._ijk_to_ras[:3, :3], axis=0
+        )
+
+    def _index(self, p):
+        """
+        Nearest voxel of the ROI to a RAS point
+
+        Args:
+            p (np.array(dtype=np.float64)): 3D point in RAS coordinates
+
+        Returns:
+            tuple: Index of the voxel in the ROI arrays, or None if p lies outside the ROI
+        """
+
+        ijk = self._ras_to_ijk[:3, :3] @ p + self._ras_to_ijk[:3, 3]
+        idx = np.rint(ijk).astype(int) - self.roi_origin
+
+        if np.any(idx < 0) or np.any(idx >= self.vesselness.shape):
+            return None
+
+        return tuple(idx)
+
+    def value(self, p):
+        """
+        Vesselness at a RAS point
+
+        Args:
+            p (np.array(dtype=np.float64)): 3D point in RAS coordinates
+
+        Returns:
+            float: Vesselness at the nearest voxel, 0 outside the ROI
+        """
+
+        idx = self._index(p)
+
+        return 0.0 if idx is None else float(self.vesselness[idx])
+
+    def direction(self, p, reference=None):
+        """
+        Vessel direction at a RAS point
+
+        Args:
+            p (np.array(dtype=np.float64)): 3D point in RAS coordinates
+            reference (np.array(dtype=np.float64), optional): If given, the returned direction is flipped so that it
+                                                              points to the same side as reference. Defaults to None.
+
+        Returns:
+            np.array(dtype=np.float64): Unit vessel direction in RAS coordinates, or None if p lies outside the ROI
+                                        or if the vesselness is below the threshold
+        """
+
+        idx = self._index(p)
+
+        if idx is None or self.vesselness[idx] < self.threshold:
+            return None
+
+        d = self._dir_to_ras @ self.direction_field[idx].astype(np.float64)
+        n = np.linalg.norm(d)
+
+        if np.isclose(n, 0):
+            return None
+
+        d /= n
+
+        if reference is not None and d @ reference < 0:
+            d = -d
+
+        return d
+
+    def save(self, f_name):
+        """
+        Save the map to a .npz file
+
+        Args:
+            f_name (str): Output file name
+        """
+
+        np.savez(
+            f_name,
+            vesselness=self.vesselness,
+            direction=self.direction_field,
+            ijk_to_ras=self.ijk_to_ras,
+            roi_origin=self.roi_origin,
+            threshold=self.threshold,
+        )
+
+
+def load_vesselness_map(f_name):
+    """
+    Read a vesselness map saved with vesselness_map.save
+
+    Args:
+        f_name (str): File name
+
+    Returns:
+        vesselness_map: The loaded map
+    """
+
+    with np.load(f_name) as f:
+        return vesselness_map(
+            f["vesselness"],
+            f["direction"],
+            f["ijk_to_ras"],
+            f["roi_origin"],
+            float(f["threshold"]),
+        )
+
+
+def compute_vesselness(
+    data,
+    ijk_to_ras,
+    sigmas=(1.0, 2.0, 4.0),
+    roi=None,
+    alpha=0.5,
+    beta=0.5,
+    c=0,
+    slab_size=32,
+    n_workers=None,
+    threshold=0.05,
+):
+    """
+    Compute the multi-scale Frangi vesselness and principal direction field of a volume over a ROI.
+    The ROI is split in slabs along the first axis, processed in parallel (the scipy filters and numpy linear algebra
+    release the GIL). Each slab is extended by the support of the Gaussian filters of the largest scale, and the
+    automatic structureness sensitivity of each scale is computed over the whole ROI in a first pass, so that the
+    result does not depend on the slab size.
+
+    Args:
+        data (np.array): Volume data, indexed in IJK
+        ijk_to_ras (np.array(dtype=np.float64)): Volume's IJK to RAS transformation
+        sigmas (tuple, optional): Scales, in millimeters. Defaults to (1.0, 2.0, 4.0).
+        roi (tuple, optional): (min, max) IJK corners of the ROI, max excluded. Defaults to None (whole volume).
+        alpha (float, optional): Frangi plate sensitivity. Defaults to 0.5.
+        beta (float, optional): Frangi blob sensitivity. Defaults to 0.5.
+        c (float, optional): Frangi structureness sensitivity, half the maximum structureness of the ROI at each
+                             scale if <= 0. Defaults to 0.
+        slab_size (int, optional): Number of planes of a slab. Defaults to 32.
+        n_workers (int, optional): Number of threads. Defaults to None (MAX_WORKERS at most, leaving a core to the
+                                   user interface).
+        threshold (float, optional): Vesselness below which the map gives no prior. Defaults to 0.05.
+
+    Returns:
+        vesselness_map: The vesselness map of the ROI
+    """
+
+    shape = np.asarray(data.shape)
+    spacing = np.linalg.norm(np.asarray(ijk_to_ras)[:3, :3], axis=0)
+
+    if roi is None:
+        lo, hi = np.zeros(3, dtype=int), shape.copy()
+    else:
+        lo = np.maximum(np.asarray(roi[0], dtype=int), 0)
+        hi = np.minimum(np.asarray(roi[1], dtype=int), shape)
+
+    roi_shape = tuple(np.maximum(hi - lo, 0))
+    vesselness = np.zeros(roi_shape, dtype=np.float32)
+    direction = np.zeros((*roi_shape, 3), dtype=np.float16)
+
+    if 0 in roi_shape:
+        return vesselness_map(vesselness, direction, ijk_to_ras, lo, threshold)
+
+    if n_workers is None:
+        n_workers = max(1, min(MAX_WORKERS, (os.cpu_count() or 1) - 1))
+
+    margin = np.ceil(TRUNCATE * max(sigmas) / spacing).astype(int)
+
+    def slab_hessians(start):
+        """
+        Yield the Hessian components of the ROI voxels of the slab starting at start, at each scale
+        """
+
+        stop = min(start + slab_size, hi[0])
+
+        # Extend the slab by the filter support, within the volume
+        ext_lo = np.maximum(np.array([start, lo[1], lo[2]]) - margin, 0)
+        ext_hi = np.minimum(np.array([stop, hi[1], hi[2]]) + margin, shape)
+        block = np.asarray(
+            data[ext_lo[0] : ext_hi[0], ext_lo[1] : ext_hi[1], ext_lo[2] : ext_hi[2]],
+            dtype=np.float32,
+        )
+        crop = tuple(
+            slice(a - b, a - b + n)
+            for a, b, n in zip(
+                (start, lo[1], lo[2]), ext_lo, (stop - start, *roi_shape[1:])
+            )
+        )
+
+        for sigma in sigmas:
+            yield [comp[crop].ravel() for comp in _hessian(block, sigma, spacing)]
+
+    def max_structureness(start):
+        return [_structureness(h).max(initial=0) for h in slab_hessians(start)]
+
+    def process_slab(start):
+        stop = min(start + slab_size, hi[0])
+        best_v = np.zeros((stop - start, *roi_shape[1:]), dtype=np.float32).ravel()
+        best_d = np.zeros((best_v.shape[0], 3), dtype=np.float32)
+
+        for h, c_sigma in zip(slab_hessians(start), cs):
+            v, d = _frangi(h, alpha, beta, c_sigma)
+            better = v > best_v
+            best_v[better] = v[better]
+            best_d[better] = d[better]
+
+        s = slice(start - lo[0], stop - lo[0])
+        vesselness[s] = best_v.reshape(vesselness[s].shape)
+        direction[s] = best_d.reshape(direction[s].shape)
+
+    starts = range(lo[0], hi[0], slab_size)
+    with ThreadPoolExecutor(max_workers=n_workers) as executor:
+        if c > 0:
+            cs = [c] * len(sigmas)
+        else:
+            # The sensitivity must be the same for all the slabs, it is computed over the whole ROI first
+            s_max = np.max(list(executor.map(max_structureness, starts)), axis=0)
+            cs = [max(0.5 * s, np.finfo(np.float32).eps) for s in s_max]
+
+        list(executor.map(process_slab, starts))
+
+    v_max = vesselness.max()
+    if v_max > 0:
+        vesselness /= v_max
+
+    return vesselness_map(vesselness, direction, ijk_to_ras, lo, threshold)
+
+
+def tracking_roi(points, ijk_to_ras, shape, margin=64.0, grid=32):
+    """
+    ROI of the vesselness map needed to track a vessel from points, e.g. the seed and direction points of a branch.
+    The corners are snapped to a grid, so that nearby seeds share the same ROI, and thus the same cached map.
+
+    Args:
+        points (np.array(dtype=np.float64)): Nx3 array of RAS points
+        ijk_to_ras (np.array(dtype=np.float64)): Volume's IJK to RAS transformation
+        shape (tuple): Shape of the volume
+        margin (float, optional): Distance between the points and the ROI boundary, in millimeters. Defaults to 64.
+        grid (int, optional): Step of the grid on which the corners are snapped, in voxels. Defaults to 32.
+
+    Returns:
+        tuple: (min, max) IJK corners of the ROI, max excluded
+    """
+
+    ras_to_ijk = np.linalg.inv(np.asarray(ijk_to_ras, dtype=np.float64))
+    ijk = np.atleast_2d(points) @ ras_to_ijk[:3, :3].T + ras_to_ijk[:3, 3]
+    margin_vox = margin / np.linalg.norm(np.asarray(ijk_to_ras)[:3, :3], axis=0)
+
+    lo = np.floor((ijk.min(axis=0) - margin_vox) / grid).astype(int) * grid
+    hi = np.ceil((ijk.max(axis=0) + margin_vox) / grid).astype(int) * grid
+
+    return np.maximum(lo, 0), np.minimum(hi, shape)
+
+
+def roi_contains(roi, other):
+    """
+    Check if a ROI contains another one
+
+    Args:
+        roi (tuple): (min, max) IJK corners of the ROI
+        other (tuple): (min, max) IJK corners of the other ROI
+
+    Returns:
+        bool: True if other lies inside roi
+    """
+
+    return bool(np.all(roi[0] <= other[0]) and np.all(other[1] <= roi[1]))
+
+
+def vesselness_cache_path(
+    data, ijk_to_ras, cache_dir, sigmas=(1.0, 2.0, 4.0), roi=None
+):
+    """
+    Path of the cache file holding the vesselness map of a volume. The file name is a digest of the volume geometry,
+    a subsample of its voxels, the scales and the ROI, so that a modified volume does not reuse a stale map.
+
+    Args:
+        data (np.array): Volume data, indexed in IJK
+        ijk_to_ras (np.array(dtype=np.float64)): Volume's IJK to RAS transformation
+        cache_dir (str): Directory where vesselness maps are cached
+        sigmas (tuple, optional): Scales, in millimeters. Defaults to (1.0, 2.0, 4.0).
+        roi (tuple, optional): (min, max) IJK corners of the ROI. Defaults to None (whole volume).
+
+    Returns:
+        str: Path of the cache file
+    """
+
+    digest = hashlib.sha1()
+    digest.update(np.asarray(data.shape, dtype=np.int64).tobytes())
+    digest.update(np.asarray(ijk_to_ras, dtype=np.float64).tobytes())
+    digest.update(np.ascontiguousarray(data[::7, ::7, ::7]).tobytes())
+    digest.update(np.asarray(sigmas, dtype=np.float64).tobytes())
+    if roi is not None:
+        digest.update(np.asarray(roi, dtype=np.int64).tobytes())
+
+    return os.path.join(cache_dir, f"vesselness_{digest.hexdigest()}.npz")
+
+
+def cached_vesselness(
+    data, ijk_to_ras, cache_dir, sigmas=(1.0, 2.0, 4.0), roi=None, **kwargs
+):
+    """
+    Load the vesselness map of a volume from the disk cache, or compute and cache it
+
+    Args:
+        data (np.array): Volume data, indexed in IJK
+        ijk_to_ras (np.array(dtype=np.float64)): Volume's IJK to RAS transformation
+        cache_dir (str): Directory where vesselness maps are cached
+        sigmas (tuple, optional): Scales, in millimeters. Defaults to (1.0, 2.0, 4.0).
+        roi (tuple, optional): (min, max) IJK corners of the ROI. Defaults to None (whole volume).
+        **kwargs: Other parameters of compute_vesselness
+
+    Returns:
+        vesselness_map: The vesselness map of the ROI
+    """
+
+    f_name = vesselness_cache_path(data, ijk_to_ras, cache_dir, sigmas, roi)
+
+    if os.path.exists(f_name):
+        try:
+            return load_vesselness_map(f_name)
+        except (OSError, KeyError, ValueError):
+            # Corrupted cache file, compute the map again
+            pass
+
+    v_map = compute_vesselness(data, ijk_to_ras, sigmas, roi, **kwargs)
+
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_name = f_name + ".tmp.npz"
+    v_map.save(tmp_name)
+    os.replace(tmp_name, f_name)
+
+    return v_map